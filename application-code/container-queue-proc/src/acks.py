@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Track the SQS messages a worker has in flight. Finished messages are deleted in
+batches as soon as 10 are ready or a short deadline passes, and the visibility
+timeout of messages that are still being processed is extended before it expires
+so that no other worker receives and reprocesses them.
+"""
+import logging
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of entries in a single SQS batch request.
+MAX_BATCH = 10
+
+
+def _batches(items):
+    for start in range(0, len(items), MAX_BATCH):
+        yield items[start:start + MAX_BATCH]
+
+
+class AckTracker:
+    """
+    Deletes acknowledged messages and heartbeats unacknowledged ones from a
+    background thread. All methods are thread safe.
+    """
+
+    def __init__(self, queue, flush_interval=1.0, visibility_timeout=None):
+        """
+        :param queue: The queue the messages were received from.
+        :param flush_interval: The longest time, in seconds, an acknowledged
+                               message waits before it is deleted.
+        :param visibility_timeout: The visibility timeout, in seconds, to assume
+                                   for received messages and to extend them by.
+                                   Defaults to the queue's VisibilityTimeout.
+        """
+        self.queue = queue
+        self.flush_interval = flush_interval
+        if visibility_timeout is None:
+            visibility_timeout = int(queue.attributes['VisibilityTimeout'])
+        self.visibility_timeout = visibility_timeout
+
+        # receipt handle -> (message, time at which it becomes visible again)
+        self._in_flight = {}
+        self._to_delete = []
+        self._oldest_ack = None
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def track(self, message):
+        """
+        Start heartbeating a message that has just been received.
+        """
+        with self._changed:
+            self._in_flight[message.receipt_handle] = (
+                message, time.monotonic() + self.visibility_timeout
+            )
+
+    def ack(self, message):
+        """
+        Mark a message as processed. It is deleted with the next batch.
+        """
+        with self._changed:
+            self._in_flight.pop(message.receipt_handle, None)
+            self._to_delete.append(message)
+            if self._oldest_ack is None:
+                # The flusher may be sleeping until a later heartbeat, so wake it
+                # to wait for this batch's flush deadline instead.
+                self._oldest_ack = time.monotonic()
+                self._changed.notify()
+            elif len(self._to_delete) >= MAX_BATCH:
+                self._changed.notify()
+
+    def abandon(self, message):
+        """
+        Stop heartbeating a message without deleting it, so that it becomes visible
+        again when its current visibility timeout expires and is retried.
+        """
+        with self._changed:
+            self._in_flight.pop(message.receipt_handle, None)
+
+    def in_flight(self):
+        """
+        :return: The number of tracked messages that are neither acked nor abandoned.
+        """
+        with self._changed:
+            return len(self._in_flight)
+
+    def close(self):
+        """
+        Delete every acknowledged message and stop the background thread.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        self._thread.join()
+
+    def _next_wakeup(self, now):
+        deadlines = [
+            visible_at - self.visibility_timeout / 2 for _, visible_at in self._in_flight.values()
+        ]
+        if self._oldest_ack is not None:
+            deadlines.append(self._oldest_ack + self.flush_interval)
+        return min(deadlines, default=now + self.flush_interval)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                now = time.monotonic()
+                if (not self._closed and len(self._to_delete) < MAX_BATCH
+                        and self._next_wakeup(now) > now):
+                    self._changed.wait(self._next_wakeup(now) - now)
+                now = time.monotonic()
+                closed = self._closed
+                if (closed or len(self._to_delete) >= MAX_BATCH
+                        or (self._oldest_ack is not None
+                            and now >= self._oldest_ack + self.flush_interval)):
+                    to_delete, self._to_delete, self._oldest_ack = self._to_delete, [], None
+                else:
+                    to_delete = []
+                # Extend messages once half of their visibility timeout has elapsed.
+                to_extend = [
+                    message for message, visible_at in self._in_flight.values()
+                    if now >= visible_at - self.visibility_timeout / 2
+                ]
+                for message in to_extend:
+                    self._in_flight[message.receipt_handle] = (
+                        message, now + self.visibility_timeout
+                    )
+
+            for batch in _batches(to_delete):
+                self._delete(batch)
+            for batch in _batches(to_extend):
+                self._extend(batch)
+            if closed:
+                return
+
+    def _delete(self, messages):
+        try:
+            response = self.queue.delete_messages(Entries=[{
+                'Id': str(ind),
+                'ReceiptHandle': msg.receipt_handle
+            } for ind, msg in enumerate(messages)])
+        except ClientError:
+            logger.exception("Couldn't delete messages from queue %s", self.queue)
+            return
+        for msg_meta in response.get('Failed', []):
+            logger.warning(
+                "Could not delete %s: %s",
+                messages[int(msg_meta['Id'])].message_id, msg_meta.get('Message')
+            )
+        logger.info("Deleted %s messages.", len(response.get('Successful', [])))
+
+    def _extend(self, messages):
+        try:
+            response = self.queue.change_message_visibility_batch(Entries=[{
+                'Id': str(ind),
+                'ReceiptHandle': msg.receipt_handle,
+                'VisibilityTimeout': self.visibility_timeout
+            } for ind, msg in enumerate(messages)])
+        except ClientError:
+            logger.exception("Couldn't extend message visibility on queue %s", self.queue)
+            return
+        for msg_meta in response.get('Failed', []):
+            logger.warning(
+                "Could not extend visibility of %s: %s",
+                messages[int(msg_meta['Id'])].message_id, msg_meta.get('Message')
+            )
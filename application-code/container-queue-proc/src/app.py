@@ -7,22 +7,110 @@ Purpose
 Demonstrate basic message operations in Amazon Simple Queue Service (Amazon SQS).
 """
 import urllib.parse
+import io
 import logging
-import sys, os
+import shutil
+import signal
+import os
 import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 try:
     from PIL import Image
 except ImportError:
     import Image
+try:
+    # Registers the AVIF encoder with Pillow releases that do not include one.
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+from acks import AckTracker
+from pipeline import ThumbnailPipeline, available_cpus
+import queue_logging
 
 logger = logging.getLogger(__name__)
-sqs = boto3.resource('sqs')
-s3_client = boto3.client('s3')
+# Per-message records, sampled at LOG_SAMPLE_RATE.
+message_log = queue_logging.message_logger(__name__)
 
+QUEUE_NAME = '<QUEUE_NAME>'
 DEST_BUCKET = '<DESTINATION_BUCKET>'
 S3_PREFIX = os.environ['PIPELINE_S3_DEST_PREFIX']
+WORK_DIR = '/tmp/ecsproc'
+
+# Number of concurrent S3 downloads (and, separately, uploads) per task.
+TRANSFER_WORKERS = int(os.environ.get('PIPELINE_TRANSFER_WORKERS', '8'))
+# Number of resize processes per task. Defaults to the task's vCPUs.
+RESIZE_WORKERS = int(os.environ.get('PIPELINE_RESIZE_WORKERS', '0')) or available_cpus()
+# Capacity of the queues between pipeline stages. 0 sizes them from the workers.
+QUEUE_DEPTH = int(os.environ.get('PIPELINE_QUEUE_DEPTH', '0')) or None
+# Images up to this size are resized in memory; larger ones are staged in WORK_DIR.
+MAX_IN_MEMORY_BYTES = int(os.environ.get('PIPELINE_MAX_IN_MEMORY_BYTES', str(16 * 1024 * 1024)))
+# Longest time a processed message waits to be deleted in a batch of up to 10.
+ACK_FLUSH_SECONDS = float(os.environ.get('PIPELINE_ACK_FLUSH_SECONDS', '1'))
+# How long a resident worker keeps polling without receiving a message before it
+# exits. 0 exits on the first empty receive.
+IDLE_SECONDS = float(os.environ.get('PIPELINE_IDLE_SECONDS', '0'))
+# Number of concurrent 20 second long polls a resident worker keeps open.
+POLLERS = int(os.environ.get('PIPELINE_POLLERS', '2'))
+
+sqs = boto3.resource('sqs')
+s3_client = boto3.client(
+    's3', config=Config(max_pool_connections=max(10, 3 * TRANSFER_WORKERS))
+)
+# Uploads the renditions of a single image concurrently.
+_rendition_uploader = ThreadPoolExecutor(max_workers=TRANSFER_WORKERS)
+
+ThumbnailJob = namedtuple(
+    'ThumbnailJob', ['message', 'bucket', 'key', 'size', 'download_path', 'file_name']
+)
+
+# A thumbnail that fits in a `size` x `size` box, encoded in `format`, or in the
+# source image's format when `format` is None.
+Rendition = namedtuple('Rendition', ['size', 'format'])
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp', 'AVIF': '.avif', 'PNG': '.png'}
+
+# Reused by every resize in a pool process to encode thumbnails without growing a
+# fresh buffer for each image.
+_thumbnail_buffer = io.BytesIO()
+
+
+def parse_renditions(spec):
+    """
+    Parse a rendition spec such as "1024,512:webp,224,224:avif,64". Each entry is a
+    size, optionally followed by a Pillow format name.
+
+    :param spec: The comma-separated rendition spec.
+    :return: The list of renditions, in spec order and without duplicates.
+    """
+    renditions = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        size, _, image_format = entry.partition(':')
+        rendition = Rendition(int(size), image_format.strip().upper() or None)
+        if rendition not in renditions:
+            renditions.append(rendition)
+    if not renditions:
+        raise ValueError("The rendition spec {!r} is empty.".format(spec))
+
+    Image.init()
+    unsupported = sorted({r.format for r in renditions if r.format and r.format not in Image.SAVE})
+    if unsupported:
+        raise ValueError("Pillow can't encode {}.".format(', '.join(unsupported)))
+    return renditions
+
+
+# The thumbnails written for every source image. The default keeps the original
+# single 224x224 thumbnail in the source format.
+RENDITIONS = parse_renditions(os.environ.get('PIPELINE_RENDITIONS', '224'))
 
 
 def receive_messages(queue, max_number, wait_time):
@@ -45,7 +133,7 @@ def receive_messages(queue, max_number, wait_time):
             WaitTimeSeconds=wait_time
         )
         for msg in messages:
-            logger.info("Received message: %s: %s", msg.message_id, msg.body)
+            message_log.debug("Received message: %s: %s", msg.message_id, msg.body)
     except ClientError as error:
         logger.exception("Couldn't receive messages from queue: %s", queue)
         raise error
@@ -70,7 +158,7 @@ def delete_messages(queue, messages):
         response = queue.delete_messages(Entries=entries)
         if 'Successful' in response:
             for msg_meta in response['Successful']:
-                logger.info("Deleted %s", messages[int(msg_meta['Id'])].receipt_handle)
+                message_log.debug("Deleted %s", messages[int(msg_meta['Id'])].receipt_handle)
         if 'Failed' in response:
             for msg_meta in response['Failed']:
                 logger.warning(
@@ -94,74 +182,269 @@ def delete_message(message):
     """
     try:
         message.delete()
-        logger.info("Deleted message: %s", message.message_id)
+        message_log.debug("Deleted message: %s", message.message_id)
     except ClientError as error:
         logger.exception("Couldn't delete message: %s", message.message_id)
         raise error
 
 
-def resize_image(image_path, resized_path):
-    size = 224, 224
+def render_renditions(source, renditions):
+    """
+    Decode an image once and encode every rendition from it. Runs on the pipeline's
+    process pool.
+
+    Sizes are rendered largest first and each smaller size is downscaled from the
+    previous one rather than from the source. Image.thumbnail() also asks the JPEG
+    decoder for a draft at twice the largest size, so large JPEGs are downscaled
+    while they are decoded.
+
+    :param source: The encoded image, or the path of the image on disk.
+    :param renditions: The renditions to produce.
+    :return: A list of (rendition, encoded image, content type) tuples.
+    """
+    # BytesIO shares the bytes object instead of copying it until it is written to.
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as image:
+        source_format = image.format or 'JPEG'
+        outputs = []
+        for size in sorted({r.size for r in renditions}, reverse=True):
+            image.thumbnail((size, size))
+            for rendition in renditions:
+                if rendition.size != size:
+                    continue
+                image_format = rendition.format or source_format
+                encoded = image
+                if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+                    encoded = image.convert('RGB')
+                _thumbnail_buffer.seek(0)
+                _thumbnail_buffer.truncate()
+                encoded.save(_thumbnail_buffer, format=image_format)
+                outputs.append((
+                    rendition,
+                    _thumbnail_buffer.getvalue(),
+                    Image.MIME.get(image_format, 'application/octet-stream'),
+                ))
+    return outputs
+
+
+def rendition_key(file_name, rendition):
+    """
+    Get the destination key of a rendition. A single configured rendition keeps the
+    source file name under S3_PREFIX; several are grouped into a folder per size.
+
+    :param file_name: The file name of the source image.
+    :param rendition: The rendition.
+    :return: The object key in DEST_BUCKET.
+    """
+    stem, extension = os.path.splitext(file_name)
+    if rendition.format:
+        extension = FORMAT_EXTENSIONS.get(rendition.format, '.' + rendition.format.lower())
+    if len(RENDITIONS) == 1:
+        return "{}/{}{}".format(S3_PREFIX, stem, extension)
+    return "{}/{}/{}{}".format(S3_PREFIX, rendition.size, stem, extension)
+
+
+def make_job(message):
+    """
+    Build a thumbnail job from an S3 event notification message.
 
+    :param message: The SQS message that holds the S3 event notification.
+    :return: The job, or None when the message does not reference an S3 object.
+    """
+    body = json.loads(message.body)
     try:
-        with Image.open(image_path) as image:
-            image.thumbnail(size)
-            image.save(resized_path)
-            print("Processed " + image_path + " to " + resized_path)
-    except IOError:
-        print("Cannot process image " + image_path)
+        bucket = body['Records'][0]['s3']['bucket']['name']
+        key = urllib.parse.unquote_plus(body['Records'][0]['s3']['object']['key'], encoding='utf-8')
+    except (KeyError, IndexError):
+        logger.warning("Invalid S3 event notification in message %s", message.message_id)
+        return None
+    size = body['Records'][0]['s3']['object'].get('size')
+    file_name = os.path.split(key)[1]
+    # Jobs run concurrently, so local paths are made unique per message.
+    local_name = '{}-{}'.format(message.message_id, file_name)
+    return ThumbnailJob(
+        message=message,
+        bucket=bucket,
+        key=key,
+        size=size,
+        download_path=os.path.join(WORK_DIR, local_name),
+        file_name=file_name,
+    )
+
 
+def download_image(job):
+    """
+    Fetch the source image into memory, or onto disk when it is larger than
+    MAX_IN_MEMORY_BYTES.
 
-def usage_demo():
+    :param job: The thumbnail job.
+    :return: The arguments for render_renditions.
+    """
+    if job.size is not None and job.size > MAX_IN_MEMORY_BYTES:
+        s3_client.download_file(job.bucket, job.key, job.download_path)
+        return job.download_path, RENDITIONS
+
+    response = s3_client.get_object(Bucket=job.bucket, Key=job.key)
+    if response['ContentLength'] > MAX_IN_MEMORY_BYTES:
+        with open(job.download_path, 'wb') as file:
+            shutil.copyfileobj(response['Body'], file, 1024 * 1024)
+        return job.download_path, RENDITIONS
+    return response['Body'].read(), RENDITIONS
+
+
+def upload_images(job, outputs):
+    """
+    Upload every rendition of an image from memory, concurrently when there are
+    several.
+
+    :param job: The thumbnail job.
+    :param outputs: The return value of render_renditions.
+    """
+    def put(output):
+        rendition, data, content_type = output
+        s3_client.put_object(
+            Bucket=DEST_BUCKET, Key=rendition_key(job.file_name, rendition),
+            Body=data, ContentType=content_type
+        )
+
+    if len(outputs) == 1:
+        put(outputs[0])
+        return
+    # Wait for every upload, then raise the first error, if any.
+    for future in [_rendition_uploader.submit(put, output) for output in outputs]:
+        future.result()
+
+
+def usage_demo(transfer_workers=None, resize_workers=None):
     """
     Shows how to:
     * Retrieve object metadata from the SQS queue that holds notifications from the source S3 bucket.
     * Download each image from the source S3 bucket.
-    * Resize each image into a standard 224x224 format.
+    * Resize each image into a standard 224x224 format, or into every rendition in
+      PIPELINE_RENDITIONS.
     * Upload each resized image to the destination S3 bucket.
     * Repeat until the SQS queue is empty.
-    """
 
-    def unpack_message(msg):
-        return (msg.body)
+    Downloads and uploads run on a thread pool and resizing runs on a process pool,
+    so several images are in flight at once. Images up to PIPELINE_MAX_IN_MEMORY_BYTES
+    never touch the disk. Messages are deleted in batches shortly after their image
+    has been uploaded, and the visibility timeout of messages that are still in
+    flight is extended so they are not redelivered to another worker.
+
+    When PIPELINE_IDLE_SECONDS is set the worker stays resident: it keeps
+    PIPELINE_POLLERS long polls open and only exits once no message has arrived for
+    that long. SIGTERM stops polling in either mode, and the worker exits once every
+    message it has received has been processed.
+
+    :param transfer_workers: Overrides PIPELINE_TRANSFER_WORKERS.
+    :param resize_workers: Overrides PIPELINE_RESIZE_WORKERS.
+    """
 
     print('-'*88)
     print("Welcome to the Amazon Simple Queue Service (Amazon SQS) demo!")
     print('-'*88)
 
-    queue = sqs.get_queue_by_name(QueueName='<QUEUE_NAME>')
+    queue = sqs.get_queue_by_name(QueueName=QUEUE_NAME)
+    tracker = AckTracker(queue, flush_interval=ACK_FLUSH_SECONDS)
+    resident = IDLE_SECONDS > 0
+    stop = threading.Event()
+    last_received = time.monotonic()
+
+    def on_done(job, error):
+        try:
+            os.remove(job.download_path)
+        except OSError:
+            pass
+        if error is None:
+            message_log.info("Processed s3://%s/%s", job.bucket, job.key,
+                             extra={'message_id': job.message.message_id})
+            tracker.ack(job.message)
+        else:
+            # Leave the message on the queue so it is retried after its
+            # visibility timeout expires.
+            logger.error("Couldn't process s3://%s/%s: %s", job.bucket, job.key, error)
+            tracker.abandon(job.message)
+
+    def on_sigterm(signum, frame):
+        logger.info("Received SIGTERM. Finishing in-flight messages.")
+        stop.set()
+
+    def poll(pipeline):
+        nonlocal last_received
+        # Resources are not thread safe, so each poller gets its own.
+        poll_queue = boto3.session.Session().resource('sqs').Queue(queue.url)
+        try:
+            while not stop.is_set():
+                try:
+                    received_messages = receive_messages(
+                        poll_queue, batch_size, 20 if resident else 4
+                    )
+                except Exception as error:
+                    logger.error("Couldn't receive messages: %s", error)
+                    if not resident:
+                        stop.set()
+                    else:
+                        time.sleep(1)
+                    continue
+                if not received_messages:
+                    if not resident:
+                        stop.set()
+                    continue
+
+                last_received = time.monotonic()
+                logger.debug("Received %s messages.", len(received_messages))
+                for message in received_messages:
+                    tracker.track(message)
+                for message in received_messages:
+                    try:
+                        body = json.loads(message.body)
+                        if body.get('Event') == 's3:TestEvent':
+                            tracker.ack(message)
+                            continue
+                        job = make_job(message)
+                    except Exception as error:
+                        # Stop extending its visibility, so the message returns to
+                        # the queue and, after maxReceiveCount, its dead-letter queue.
+                        logger.error("Couldn't read message %s: %s", message.message_id, error)
+                        tracker.abandon(message)
+                        continue
+                    if job is None:
+                        tracker.ack(message)
+                    else:
+                        # Blocks while the pipeline is full, which keeps the number of
+                        # received but unprocessed messages bounded.
+                        pipeline.submit(job)
+        except Exception:
+            # Without this the main loop would wait forever for a stop that never comes,
+            # while the tracker kept the poller's messages invisible.
+            logger.exception("Poller stopped unexpectedly. Draining.")
+            stop.set()
+            raise
 
     batch_size = 10
     print(f"Receiving, handling, and deleting messages in batches of {batch_size}.")
-    more_messages = True
-    while more_messages:
-        received_messages = receive_messages(queue, batch_size, 4)
-        sys.stdout.flush()
-
-        for message in received_messages:
-            msg = unpack_message(message)
-            body = json.loads(msg)
-            # print(body)
-            if body.get('Event') == 's3:TestEvent':
-                delete_message(message)
-            else:
-                try:
-                    bucket = body['Records'][0]['s3']['bucket']['name']
-                    key = urllib.parse.unquote_plus(body['Records'][0]['s3']['object']['key'], encoding='utf-8')
-                except KeyError:
-                    print(f"Invalid {bucket} or {key}")
-                file_name = os.path.split(key)
-                download_path = '/tmp/ecsproc/' + file_name[1]
-                upload_path = '/tmp/ecsproc/thumbnail-{}'.format(file_name[1])
-
-                s3_client.download_file(bucket, key, download_path)
-                resize_image(download_path, upload_path)
-                s3_client.upload_file(upload_path, DEST_BUCKET, S3_PREFIX + "/" + file_name[1])
-
-        if received_messages:
-            delete_messages(queue, received_messages)
-        else:
-            more_messages = False
+    previous_handler = signal.signal(signal.SIGTERM, on_sigterm)
+    try:
+        with tracker, ThumbnailPipeline(
+                download_image, render_renditions, upload_images, on_done,
+                transfer_workers=transfer_workers or TRANSFER_WORKERS,
+                resize_workers=resize_workers or RESIZE_WORKERS,
+                queue_depth=QUEUE_DEPTH) as pipeline:
+            pollers = [
+                threading.Thread(target=poll, args=(pipeline,), daemon=True)
+                for _ in range(POLLERS if resident else 1)
+            ]
+            for poller in pollers:
+                poller.start()
+            while not stop.wait(1):
+                if resident and time.monotonic() - last_received >= IDLE_SECONDS:
+                    logger.info("No messages for %g seconds. Draining.", IDLE_SECONDS)
+                    stop.set()
+            # Pollers finish their current receive, so messages it returns are
+            # still processed before the pipeline is closed.
+            for poller in pollers:
+                poller.join()
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
     print('Done.')
 
     print("Thanks for watching!")
@@ -169,4 +452,5 @@ def usage_demo():
 
 
 if __name__ == '__main__':
+    queue_logging.configure()
     usage_demo()
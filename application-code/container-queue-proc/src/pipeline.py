@@ -0,0 +1,188 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Staged download/resize/upload pipeline for the thumbnail queue worker.
+
+S3 transfers run on threads, image resizing runs on a process pool sized to the
+task's vCPUs, and bounded queues between the stages apply back pressure so the
+worker keeps its CPUs busy while a fixed number of transfers are in flight.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def available_cpus():
+    """
+    Get the number of vCPUs this process is allowed to run on.
+
+    :return: The size of the CPU affinity set when the platform exposes it, else
+             the number of CPUs in the system.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ThumbnailPipeline:
+    """
+    Runs jobs through three stages connected by bounded queues:
+
+    * download - `transfer_workers` threads call `download(job)`, which returns the
+      positional arguments for the resize stage.
+    * resize - `resize_workers` processes call `resize(*args)`. The function and its
+      arguments must be picklable.
+    * upload - `transfer_workers` threads call `upload(job, result)` with the value
+      returned by `resize`.
+
+    Every job is reported exactly once through `on_done(job, error)`, where `error`
+    is None on success or the exception raised by the stage that failed. The
+    callback runs on a pipeline thread and must be thread safe.
+    """
+
+    def __init__(self, download, resize, upload, on_done,
+                 transfer_workers=8, resize_workers=None, queue_depth=None):
+        """
+        :param download: Called with a job on a transfer thread.
+        :param resize: Module-level function run on the process pool.
+        :param upload: Called with a job and the resize result on a transfer thread.
+        :param on_done: Called with a job and None or an exception when it finishes.
+        :param transfer_workers: The number of download threads and, separately, of
+                                 upload threads.
+        :param resize_workers: The number of resize processes. Defaults to the
+                               number of available vCPUs.
+        :param queue_depth: The capacity of each queue between stages. Defaults to
+                            twice the number of workers that read from it.
+        """
+        self._download = download
+        self._resize = resize
+        self._upload = upload
+        self._on_done = on_done
+        self.transfer_workers = transfer_workers
+        self.resize_workers = resize_workers or available_cpus()
+
+        self._download_q = queue.Queue(queue_depth or 2 * self.transfer_workers)
+        self._resize_q = queue.Queue(queue_depth or 2 * self.resize_workers)
+        self._upload_q = queue.Queue(queue_depth or 2 * self.transfer_workers)
+
+        self._pending = 0
+        self._idle = threading.Condition()
+
+        # Start the resize processes from a fork server rather than by forking this
+        # process, whose other threads, such as the ack flusher and the logging
+        # listener, may hold a lock a forked child would inherit in its held state.
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.resize_workers, mp_context=multiprocessing.get_context('forkserver')
+        )
+        # Start them now rather than with the first image.
+        self._pool.submit(os.getpid).result()
+
+        self._stages = [
+            (self._download_q, self._start(self._download_worker, self.transfer_workers)),
+            (self._resize_q, self._start(self._resize_worker, self.resize_workers)),
+            (self._upload_q, self._start(self._upload_worker, self.transfer_workers)),
+        ]
+        logger.info(
+            "Started pipeline with %s transfer threads and %s resize processes.",
+            self.transfer_workers, self.resize_workers
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _start(target, count):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def submit(self, job):
+        """
+        Queue a job for processing. Blocks while the download queue is full.
+
+        :param job: The job to process. It is passed unchanged to the stage functions.
+        """
+        with self._idle:
+            self._pending += 1
+        self._download_q.put(job)
+
+    def join(self):
+        """
+        Wait until every submitted job has been reported through `on_done`.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+
+    def close(self):
+        """
+        Finish all submitted jobs, then stop the stage threads and the process pool.
+        """
+        for stage_q, threads in self._stages:
+            for _ in threads:
+                stage_q.put(_STOP)
+            for thread in threads:
+                thread.join()
+        self._pool.shutdown()
+
+    def _finish(self, job, error):
+        try:
+            self._on_done(job, error)
+        except Exception:
+            logger.exception("Completion callback failed for job %s", job)
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _download_worker(self):
+        while True:
+            job = self._download_q.get()
+            if job is _STOP:
+                return
+            try:
+                args = self._download(job)
+            except Exception as error:
+                self._finish(job, error)
+            else:
+                self._resize_q.put((job, args))
+
+    def _resize_worker(self):
+        while True:
+            item = self._resize_q.get()
+            if item is _STOP:
+                return
+            job, args = item
+            try:
+                result = self._pool.submit(self._resize, *args).result()
+            except Exception as error:
+                self._finish(job, error)
+            else:
+                self._upload_q.put((job, result))
+
+    def _upload_worker(self):
+        while True:
+            item = self._upload_q.get()
+            if item is _STOP:
+                return
+            job, result = item
+            try:
+                self._upload(job, result)
+            except Exception as error:
+                self._finish(job, error)
+            else:
+                self._finish(job, None)
@@ -0,0 +1,57 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from acks import AckTracker  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, receipt_handle):
+        self.receipt_handle = receipt_handle
+        self.message_id = receipt_handle
+
+
+class FakeQueue:
+    def __init__(self):
+        self.deleted = []
+        self.deleted_event = threading.Event()
+
+    def delete_messages(self, Entries):
+        self.deleted.extend((entry['ReceiptHandle'], time.monotonic()) for entry in Entries)
+        self.deleted_event.set()
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def change_message_visibility_batch(self, Entries):
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+
+def test_ack_is_deleted_within_flush_interval_while_another_message_is_in_flight():
+    queue = FakeQueue()
+    with AckTracker(queue, flush_interval=0.2, visibility_timeout=30) as tracker:
+        tracker.track(FakeMessage('in-flight'))
+        tracker.track(FakeMessage('done'))
+        # Let the flusher go to sleep until the in-flight message's heartbeat
+        time.sleep(0.5)
+        acked_at = time.monotonic()
+        tracker.ack(FakeMessage('done'))
+
+        assert queue.deleted_event.wait(2)
+        (receipt_handle, deleted_at), = queue.deleted
+        assert receipt_handle == 'done'
+        assert deleted_at - acked_at < 0.2 + 0.1
+        assert tracker.in_flight() == 1
+
+
+def test_full_batch_is_deleted_at_once():
+    queue = FakeQueue()
+    with AckTracker(queue, flush_interval=60, visibility_timeout=30) as tracker:
+        for index in range(10):
+            tracker.track(FakeMessage(str(index)))
+        for index in range(10):
+            tracker.ack(FakeMessage(str(index)))
+
+        assert queue.deleted_event.wait(2)
+        assert len(queue.deleted) == 10
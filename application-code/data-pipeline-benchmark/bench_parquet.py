@@ -0,0 +1,190 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Compare the clean rows output of the data pipeline task as gzip-compressed,
+tab-separated CSV with its Parquet output, on a synthetic CSV object of
+--size gigabytes validated by the arrow engine against synthetic.SCHEMA.
+
+For each output the benchmark reports its size and the time a consumer takes
+to scan it with PyArrow: reading every column, and reading the amount column
+only, which Parquet can do without reading the others. Outputs are written to
+a temporary directory and deleted afterwards.
+
+Usage:
+    python bench_parquet.py --size 1 --compressions zstd,snappy
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'data-pipeline-task'))
+
+GB = 1024 ** 3
+
+
+class LocalRaw(io.RawIOBase):
+    """
+    Local file standing in for the task's S3MultipartWriter.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.key = path
+        self.file = open(path, 'wb')
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+    def abort(self):
+        self.close()
+
+
+class LocalCsvSink:
+    """
+    Local gzip file standing in for the task's S3Sink.
+    """
+
+    def __init__(self, path):
+        self.text = gzip.open(path, 'wt', compresslevel=6, encoding='utf-8', newline='')
+
+    def write(self, text):
+        return self.text.write(text)
+
+    def write_bytes(self, data):
+        self.text.flush()
+        self.text.buffer.write(data)
+
+    def close(self):
+        self.text.close()
+
+
+class NullSink:
+    def write(self, text):
+        return len(text)
+
+    def write_bytes(self, data):
+        return len(data)
+
+
+def write_output(format, compression, size, bad_value_every, directory):
+    import columnar
+    from synthetic import SCHEMA, SyntheticBody
+
+    rules = columnar.load_schema(json.dumps(SCHEMA))
+    body = SyntheticBody(size, bad_value_every=bad_value_every)
+    started = time.perf_counter()
+    if format == 'csv':
+        path = os.path.join(directory, 'clean.csv.gz')
+        clean_data = LocalCsvSink(path)
+        counts = columnar.validate(body, clean_data, NullSink(), rules)
+        clean_data.close()
+    else:
+        path = os.path.join(directory, 'clean-{}.parquet'.format(compression))
+        with columnar.ParquetSink(LocalRaw(path), compression) as clean_data:
+            counts = columnar.validate(body, clean_data, NullSink(), rules)
+    return path, counts, time.perf_counter() - started
+
+
+def scan(format, path, columns=None):
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    started = time.perf_counter()
+    if format == 'csv':
+        # A consumer of the CSV output parses it whole, whatever the columns it needs
+        table = pacsv.read_csv(path, parse_options=pacsv.ParseOptions(delimiter='\t'))
+        if columns:
+            table = table.select(columns)
+    else:
+        table = pq.read_table(path, columns=columns)
+    # Sum a column, so the values are decoded
+    pc.sum(table.column('amount'))
+    return table.num_rows, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=float, default=0.5, help="Object size, in GB.")
+    parser.add_argument('--compressions', default='zstd,snappy', help="Comma-separated Parquet codecs to run.")
+    parser.add_argument('--bad-value-every', type=int, default=500,
+                        help="Every how many rows one breaks the schema. 0 for none.")
+    parser.add_argument('--output', default=None,
+                        help="JSON results path. Defaults to results/parquet-<commit>.json.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-parquet-')
+    results = []
+    try:
+        runs = [('csv', 'gzip')] + [('parquet', compression) for compression in args.compressions.split(',')]
+        for format, compression in runs:
+            path, counts, write_seconds = write_output(format, compression, int(args.size * GB),
+                                                       args.bad_value_every, directory)
+            rows, scan_seconds = scan(format, path)
+            _, column_seconds = scan(format, path, ['amount'])
+            result = {
+                'label': '{} {}'.format(format, compression),
+                'format': format,
+                'compression': compression,
+                'clean_rows': counts['clean_rows'] - 1,
+                'scanned_rows': rows,
+                'bytes': os.path.getsize(path),
+                'write_seconds': round(write_seconds, 2),
+                'scan_seconds': round(scan_seconds, 2),
+                'column_scan_seconds': round(column_seconds, 2),
+            }
+            print('{label}: {bytes} bytes, {scan_seconds} s scan, {column_scan_seconds} s column scan'.format(**result))
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+
+    commit = git_commit()
+    output = args.output or os.path.join(HERE, 'results', 'parquet-{}.json'.format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'benchmark': 'parquet', 'commit': commit, 'params': vars(args), 'results': results},
+                  file, indent=2)
+
+    print()
+    print('{:<20} {:>12} {:>14} {:>10} {:>10} {:>12}'.format('run', 'rows', 'MB', 'write s', 'scan s',
+                                                           'column s'))
+    for result in results:
+        print('{:<20} {:>12} {:>14} {:>10} {:>10} {:>12}'.format(
+            result['label'], result['scanned_rows'], round(result['bytes'] / 1024 / 1024, 1),
+            result['write_seconds'], result['scan_seconds'], result['column_scan_seconds']))
+    print()
+    print('Wrote ' + output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Measure how the data pipeline task reads a CSV object, comparing the original
+pattern (Body.read().decode('utf-8').splitlines(True), which holds the file in
+memory three times over) with the streaming reader (an incremental UTF-8
+decoder and line iterator over a buffered body).
+
+Each run validates one synthetic CSV object of --sizes gigabytes, generated on
+the fly, with the task's row loop, and writes the clean and faulty rows to
+/dev/null. Every run is a separate process, so its peak resident memory is its
+own. The original pattern is skipped above --before-max-gb.
+
+Usage:
+    python bench_stream.py --sizes 0.5,2,4 --before-max-gb 1
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'data-pipeline-task'))
+
+GB = 1024 ** 3
+
+
+def read_before(body):
+    return csv.reader(body.read().decode('utf-8').splitlines(True))
+
+
+def child(mode, size):
+    import task
+    from synthetic import SyntheticBody
+
+    body = SyntheticBody(size)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    reader = read_before(body) if mode == 'before' else task.open_csv(body)
+    with open(os.devnull, 'w', newline='') as devnull:
+        writer = csv.writer(devnull, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
+        counts = task.process_rows(reader, writer, writer)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert counts['rows'] == body.rows, (counts, body.rows)
+    return {
+        'label': '{} {:g} GB'.format(mode, size / GB),
+        'mode': mode,
+        'bytes': body.size,
+        'rows': counts['rows'],
+        'faulty_rows': counts['faulty_rows'],
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(counts['rows'] / elapsed),
+        'mb_per_second': round(body.size / elapsed / 1024 / 1024, 1),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(peak / 1024, 1),
+        'startup_rss_mb': round(baseline / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='0.5,2', help="Comma-separated object sizes, in GB.")
+    parser.add_argument('--before-max-gb', type=float, default=1,
+                        help="Largest size the original pattern is run on.")
+    parser.add_argument('--output', default=None,
+                        help="JSON results path. Defaults to results/stream-<commit>.json.")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'BYTES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child[0], int(args.child[1]))))
+        return
+
+    results = []
+    for size in [float(value) for value in args.sizes.split(',')]:
+        for mode in ('before', 'streaming'):
+            if mode == 'before' and size > args.before_max_gb:
+                continue
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--child', mode, str(int(size * GB))], cwd=HERE)
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print('{label}: {rows_per_second} rows/s, {peak_rss_mb} MB peak RSS'.format(**result))
+            results.append(result)
+
+    commit = git_commit()
+    output = args.output or os.path.join(HERE, 'results', 'stream-{}.json'.format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'benchmark': 'stream', 'commit': commit, 'params': vars(args), 'results': results},
+                  file, indent=2)
+
+    print()
+    print('{:<24} {:>12} {:>12} {:>10} {:>10}'.format('run', 'rows', 'rows/s', 'MB/s', 'rss MB'))
+    for result in results:
+        print('{:<24} {:>12} {:>12} {:>10} {:>10}'.format(
+            result['label'], result['rows'], result['rows_per_second'], result['mb_per_second'],
+            result['peak_rss_mb']))
+    print()
+    print('Wrote ' + output)
+
+
+if __name__ == '__main__':
+    main()
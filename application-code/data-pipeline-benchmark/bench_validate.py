@@ -0,0 +1,180 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Measure the validation throughput of the data pipeline task's engines on a
+synthetic CSV object of --size gigabytes:
+
+* rows: the task's row loop, which only checks the number of columns
+* rows+schema: the row loop with synthetic.SCHEMA checked in Python, row by
+  row, as a row-wise validator of the same rules would
+* arrow: the columnar engine, checking synthetic.SCHEMA with vectorized
+  kernels on batches of --block-mb megabytes
+
+Every --bad-value-every-th row breaks the schema, so all engines but rows send
+it to the faulty output. Outputs are discarded. Every run is a separate
+process, so its peak resident memory is its own.
+
+Usage:
+    python bench_validate.py --size 1 --engines rows,rows+schema,arrow
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'data-pipeline-task'))
+
+GB = 1024 ** 3
+
+
+class NullSink:
+    def write(self, text):
+        return len(text)
+
+    def write_bytes(self, data):
+        return len(data)
+
+
+def row_checks(header, schema):
+    """
+    Per-row Python checks of a schema, as (column index, predicate) pairs.
+    """
+    import columnar
+
+    checks = []
+    for column in schema['columns']:
+        rule = columnar.ColumnRule(**column)
+        index = header.index(rule.name)
+        type_pattern = re.compile(columnar.TYPE_PATTERNS[rule.type]) if columnar.TYPE_PATTERNS[rule.type] else None
+        pattern = re.compile(rule.pattern) if rule.pattern else None
+        allowed = set(rule.allowed.to_pylist()) if rule.allowed is not None else None
+
+        def valid(value, rule=rule, type_pattern=type_pattern, pattern=pattern, allowed=allowed):
+            if value == '':
+                return rule.nullable
+            if type_pattern and not type_pattern.match(value):
+                return False
+            if rule.min is not None or rule.max is not None:
+                number = float(value)
+                if (rule.min is not None and number < rule.min) or (rule.max is not None and number > rule.max):
+                    return False
+            if allowed is not None and value not in allowed:
+                return False
+            return not pattern or bool(pattern.search(value))
+        checks.append((index, valid))
+    return checks
+
+
+def validate_rows_schema(task, body, sink, schema):
+    reader = task.open_csv(body)
+    writer = csv.writer(sink, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
+    header = next(reader)
+    writer.writerow(header)
+    checks = row_checks(header, schema)
+    counts = {"rows": 1, "clean_rows": 1, "faulty_rows": 0}
+    for row in reader:
+        counts["rows"] += 1
+        if len(row) == len(header) and all(valid(row[index]) for index, valid in checks):
+            counts["clean_rows"] += 1
+        else:
+            counts["faulty_rows"] += 1
+        writer.writerow(row)
+    return counts
+
+
+def child(engine, size, bad_value_every, block_size):
+    import task
+    from synthetic import SCHEMA, SyntheticBody
+
+    body = SyntheticBody(size, bad_value_every=bad_value_every)
+    sink = NullSink()
+    started = time.perf_counter()
+    if engine == 'rows':
+        writer = csv.writer(sink, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
+        counts = task.process_rows(task.open_csv(body), writer, writer)
+    elif engine == 'rows+schema':
+        counts = validate_rows_schema(task, body, sink, SCHEMA)
+    else:
+        import columnar
+        counts = columnar.validate(body, sink, sink, columnar.load_schema(json.dumps(SCHEMA)), block_size)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert counts['rows'] == body.rows, (counts, body.rows)
+    return {
+        'label': '{} {:g} GB'.format(engine, size / GB),
+        'engine': engine,
+        'bytes': body.size,
+        'rows': counts['rows'],
+        'faulty_rows': counts['faulty_rows'],
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(counts['rows'] / elapsed),
+        'mb_per_second': round(body.size / elapsed / 1024 / 1024, 1),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(peak / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=float, default=1, help="Object size, in GB.")
+    parser.add_argument('--engines', default='rows,rows+schema,arrow', help="Comma-separated engines to run.")
+    parser.add_argument('--bad-value-every', type=int, default=500,
+                        help="Every how many rows one breaks the schema. 0 for none.")
+    parser.add_argument('--block-mb', type=int, default=16, help="Batch size of the arrow engine, in MB.")
+    parser.add_argument('--output', default=None,
+                        help="JSON results path. Defaults to results/validate-<commit>.json.")
+    parser.add_argument('--child', nargs=2, metavar=('ENGINE', 'BYTES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child[0], int(args.child[1]), args.bad_value_every,
+                               args.block_mb * 1024 * 1024)))
+        return
+
+    results = []
+    for engine in args.engines.split(','):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', engine, str(int(args.size * GB)),
+             '--bad-value-every', str(args.bad_value_every), '--block-mb', str(args.block_mb)], cwd=HERE)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        print('{label}: {rows_per_second} rows/s, {faulty_rows} faulty rows'.format(**result))
+        results.append(result)
+
+    commit = git_commit()
+    output = args.output or os.path.join(HERE, 'results', 'validate-{}.json'.format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'benchmark': 'validate', 'commit': commit, 'params': vars(args), 'results': results},
+                  file, indent=2)
+
+    print()
+    print('{:<24} {:>12} {:>12} {:>12} {:>10} {:>10}'.format('run', 'rows', 'faulty', 'rows/s', 'MB/s', 'rss MB'))
+    for result in results:
+        print('{:<24} {:>12} {:>12} {:>12} {:>10} {:>10}'.format(
+            result['label'], result['rows'], result['faulty_rows'], result['rows_per_second'],
+            result['mb_per_second'], result['peak_rss_mb']))
+    print()
+    print('Wrote ' + output)
+
+
+if __name__ == '__main__':
+    main()
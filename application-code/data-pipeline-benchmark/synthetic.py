@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Synthetic CSV input for the data pipeline benchmarks, generated on the fly so
+that multi-GB files need neither disk nor memory.
+"""
+import csv
+import io
+import random
+
+HEADER = ['id', 'customer', 'email', 'amount', 'quantity', 'country', 'created_at', 'note']
+COUNTRIES = ['US', 'DE', 'FR', 'JP', 'BR', 'IN', 'GB', 'CA']
+NOTES = ['', 'gift', 'express, fragile', 'leave at "back door"', 'call ahead']
+
+# Validation schema of the rows, for the arrow engine
+SCHEMA = {
+    'columns': [
+        {'name': 'id', 'type': 'int64', 'nullable': False, 'min': 0},
+        {'name': 'customer', 'type': 'string', 'nullable': False, 'pattern': '^customer-[0-9]+$'},
+        {'name': 'email', 'type': 'string', 'nullable': False, 'pattern': '^[^@]+@[^@]+$'},
+        {'name': 'amount', 'type': 'float64', 'nullable': False, 'min': 0, 'max': 10000},
+        {'name': 'quantity', 'type': 'int64', 'nullable': False, 'min': 1},
+        {'name': 'country', 'type': 'string', 'nullable': False, 'allowed': COUNTRIES},
+        {'name': 'created_at', 'type': 'timestamp', 'nullable': False},
+    ]
+}
+
+
+def build_block(rows, faulty_every, seed, first_id=0, bad_value_every=0):
+    """
+    Return `rows` CSV lines as bytes. Every `faulty_every`-th row is missing its
+    last column, and every `bad_value_every`-th row has a negative amount and
+    an unknown country, which SCHEMA rejects.
+    """
+    generator = random.Random(seed)
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\r\n')
+    for i in range(rows):
+        row_id = first_id + i
+        row = [
+            row_id,
+            'customer-{}'.format(generator.randrange(100000)),
+            'user{}@example.com'.format(generator.randrange(1000000)),
+            '{:.2f}'.format(generator.uniform(1, 5000)),
+            generator.randrange(1, 50),
+            generator.choice(COUNTRIES),
+            '2024-{:02d}-{:02d}T{:02d}:{:02d}:00Z'.format(generator.randrange(1, 13), generator.randrange(1, 29),
+                                                          generator.randrange(24), generator.randrange(60)),
+            generator.choice(NOTES),
+        ]
+        if bad_value_every and i % bad_value_every == bad_value_every - 1:
+            row[3] = '-' + row[3]
+            row[5] = 'XX'
+        if faulty_every and i % faulty_every == faulty_every - 1:
+            row = row[:-1]
+        writer.writerow(row)
+    return text.getvalue().encode('utf-8')
+
+
+class SyntheticBody:
+    """
+    File-like stand-in for an S3 object body of about `size` bytes: a header
+    followed by a block of generated rows repeated until the size is reached.
+    Only whole rows are returned.
+    """
+
+    def __init__(self, size, faulty_every=1000, block_rows=10000, seed=1, bad_value_every=0):
+        self.header = (','.join(HEADER) + '\r\n').encode('utf-8')
+        self.block = build_block(block_rows, faulty_every, seed, bad_value_every=bad_value_every)
+        self.block_rows = block_rows
+        blocks = max(1, (size - len(self.header)) // len(self.block))
+        self.size = len(self.header) + blocks * len(self.block)
+        self.rows = 1 + blocks * block_rows
+        self.position = 0
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = self.size - self.position
+        amt = min(amt, self.size - self.position)
+        if amt <= 0:
+            return b''
+        chunks = []
+        while amt > 0:
+            if self.position < len(self.header):
+                source, offset = self.header, self.position
+            else:
+                source, offset = self.block, (self.position - len(self.header)) % len(self.block)
+            chunk = source[offset:offset + amt]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            amt -= len(chunk)
+        return b''.join(chunks)
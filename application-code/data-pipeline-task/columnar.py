@@ -0,0 +1,345 @@
+import csv
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+# Patterns of the values that can be cast to each type, checked on the raw text
+TYPE_PATTERNS = {
+    'int64': r'^[-+]?\d+$',
+    'float64': r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$',
+    'bool': r'^(?i:true|false|1|0)$',
+    'date': r'^\d{4}-\d{2}-\d{2}$',
+    'timestamp': r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[-+]\d{2}:?\d{2})?$',
+    'string': None,
+}
+
+# Arrow type of each rule type. Timestamps without an offset are taken as UTC
+ARROW_TYPES = {
+    'int64': pa.int64(),
+    'float64': pa.float64(),
+    'bool': pa.bool_(),
+    'date': pa.date32(),
+    'timestamp': pa.timestamp('us', 'UTC'),
+    'string': pa.string(),
+}
+
+# Types tried in order when inferring the type of a column
+INFERRED_TYPES = ['int64', 'float64', 'timestamp']
+
+# Batch size the CSV reader parses at once
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def cast_strings(values, type):
+    if type == 'timestamp':
+        try:
+            return pc.cast(values, ARROW_TYPES[type])
+        except pa.ArrowInvalid:
+            return pc.assume_timezone(pc.cast(values, pa.timestamp('us')), 'UTC')
+    return pc.cast(values, ARROW_TYPES[type])
+
+
+def cast_values(values, type):
+    """
+    Cast a column of text to a rule type, with null for empty values and
+    values that don't cast.
+    """
+    if type == 'string':
+        return values
+    empty = pc.equal(values, '')
+    if pc.any(empty).as_py():
+        values = pc.if_else(empty, None, values)
+    try:
+        # One cast of the whole batch is much faster than the pattern when every value is valid
+        return cast_strings(values, type)
+    except pa.ArrowInvalid:
+        pass
+    values = pc.if_else(pc.match_substring_regex(values, TYPE_PATTERNS[type]), values, None)
+    try:
+        return cast_strings(values, type)
+    except pa.ArrowInvalid:
+        # Some values match the pattern but still don't cast, such as a 13th month
+        return pa.array([cast_value(value, type) for value in values.to_pylist()], ARROW_TYPES[type])
+
+
+def cast_value(value, type):
+    if value is None:
+        return None
+    try:
+        return cast_strings(pa.array([value]), type)[0].as_py()
+    except pa.ArrowInvalid:
+        return None
+
+
+class ColumnRule:
+    """
+    The checks of one column of a validation schema.
+
+    :param name: The column's name in the header.
+    :param type: One of ARROW_TYPES. A value is of the type if Arrow can cast it.
+    :param nullable: Whether an empty value is valid.
+    :param min: Smallest valid value of an int64 or float64 column.
+    :param max: Largest valid value of an int64 or float64 column.
+    :param allowed: The only valid values.
+    :param pattern: A regular expression (RE2) values must match.
+    """
+
+    def __init__(self, name, type='string', nullable=True, min=None, max=None, allowed=None, pattern=None):
+        if type not in ARROW_TYPES:
+            raise ValueError('Unknown type {} of column {}. Use one of: {}'.format(type, name, ', '.join(ARROW_TYPES)))
+        self.name = name
+        self.type = type
+        self.nullable = nullable
+        self.min = min
+        self.max = max
+        self.allowed = pa.array([str(value) for value in allowed]) if allowed is not None else None
+        self.pattern = pattern
+
+    def violations(self, values):
+        """
+        Return the values of this column in a batch cast to the rule's type,
+        and (check, mask) pairs where mask is true for the rows that fail the
+        check.
+        """
+        empty = pc.equal(values, '')
+        present = pc.invert(empty)
+        checks = []
+        if not self.nullable:
+            checks.append(('null', empty))
+        typed = cast_values(values, self.type)
+        if self.type != 'string':
+            checks.append(('type', pc.and_(present, pc.is_null(typed))))
+        if self.type in ('int64', 'float64'):
+            if self.min is not None:
+                checks.append(('min', pc.fill_null(pc.less(typed, self.min), False)))
+            if self.max is not None:
+                checks.append(('max', pc.fill_null(pc.greater(typed, self.max), False)))
+        if self.allowed is not None:
+            checks.append(('allowed', pc.and_(present, pc.invert(pc.is_in(values, value_set=self.allowed)))))
+        if self.pattern:
+            checks.append(('pattern', pc.and_(present, pc.invert(pc.match_substring_regex(values, self.pattern)))))
+        return typed, checks
+
+
+def infer_rules(batch, names):
+    """
+    Rules giving the columns `names` of a batch the first of INFERRED_TYPES
+    that all their values cast to. Columns of text, or only empty values,
+    get none.
+    """
+    rules = []
+    for name in names:
+        values = batch.column(name)
+        present = len(values) - (pc.sum(pc.equal(values, '')).as_py() or 0)
+        for type in INFERRED_TYPES:
+            if present and cast_values(values, type).null_count == len(values) - present:
+                print("Inferred type {} of column {}".format(type, name))
+                rules.append(ColumnRule(name, type))
+                break
+    return rules
+
+
+def load_schema(text):
+    """
+    Parse a validation schema: a JSON object with a list of "columns", each
+    holding the arguments of a ColumnRule, for example
+    {"columns": [{"name": "amount", "type": "float64", "nullable": false, "min": 0}]}.
+    """
+    document = json.loads(text)
+    return [ColumnRule(**column) for column in document.get('columns', [])]
+
+
+class CsvBodyStream(io.RawIOBase):
+    """
+    Raw stream over an S3 object body, which the Arrow reader needs a file for.
+    """
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def to_csv(table, include_header=False):
+    """
+    The rows of `table` tab-separated with every value quoted, as the rows
+    engine writes them.
+    """
+    buffer = pa.BufferOutputStream()
+    pacsv.write_csv(table, buffer, pacsv.WriteOptions(include_header=include_header, delimiter='\t', eol='\r\n',
+                                                      quoting_style='all_valid', batch_size=64 * 1024))
+    return buffer.getvalue().to_pybytes()
+
+
+class ParquetSink:
+    """
+    Clean rows sink writing their typed columns as Parquet into `raw`, a
+    binary stream such as an S3MultipartWriter.
+
+    Batches are buffered into row groups of about `row_group_size` bytes of
+    Arrow data, since large row groups compress better and are faster to scan.
+
+    :param compression: A Parquet codec, such as zstd, snappy or gzip.
+    """
+
+    def __init__(self, raw, compression='zstd', row_group_size=64 * 1024 * 1024):
+        self.raw = raw
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.pending = []
+        self.pending_bytes = 0
+        self.rows = 0
+        self.row_groups = 0
+
+    @property
+    def key(self):
+        return self.raw.key
+
+    @property
+    def bytes_written(self):
+        return self.raw.bytes_written
+
+    def write_table(self, table):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.raw, table.schema, compression=self.compression)
+        if table.num_rows:
+            self.pending.append(table)
+            self.pending_bytes += table.nbytes
+        if self.pending_bytes >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        table = pa.concat_tables(self.pending)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+        self.rows += table.num_rows
+        self.row_groups += 1
+        self.pending = []
+        self.pending_bytes = 0
+
+    def close(self):
+        """
+        Write the last row group and the footer, and complete the upload.
+        """
+        try:
+            self.flush()
+            if self.writer is not None:
+                self.writer.close()
+        except Exception:
+            self.raw.abort()
+            raise
+        self.raw.close()
+
+    def abort(self):
+        self.raw.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def validate(body, clean_data, faulty_data, rules, block_size=BLOCK_SIZE, infer_types=False):
+    """
+    Validate an S3 object body batch by batch with vectorized kernels, and
+    return the row counts and the number of violations of each check.
+
+    Rows with a different number of columns than the header, and rows failing
+    any rule, are written to faulty_data, an S3Sink. The others are written to
+    clean_data: an S3Sink, or a ParquetSink, which gets the columns with rules
+    cast to their types and the others as text. With `infer_types`, columns
+    without rules get the types infer_rules finds in the first batch, and
+    later rows that don't cast to them are faulty.
+    """
+    stream = io.BufferedReader(CsvBodyStream(body), 1024 * 1024)
+    header = next(csv.reader([stream.readline().decode('utf-8')]), None)
+    counts = {"rows": 0, "clean_rows": 0, "faulty_rows": 0, "violations": {}}
+    if header is None:
+        return counts
+    print("Number of columns in file = ", len(header))
+    parquet = isinstance(clean_data, ParquetSink)
+    if not parquet:
+        csv.writer(clean_data, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL).writerow(header)
+    counts["rows"] = counts["clean_rows"] = 1
+
+    unknown = [rule.name for rule in rules if rule.name not in header]
+    if unknown:
+        raise ValueError('Schema columns {} are not in the header'.format(', '.join(unknown)))
+
+    # Rows with the wrong number of columns, which the reader can't put in a batch
+    malformed = []
+
+    def on_invalid_row(row):
+        malformed.append(row.text)
+        return 'skip'
+
+    # The reader fails on a file with a header only
+    reader = [] if not stream.peek(1) else pacsv.open_csv(
+        stream,
+        read_options=pacsv.ReadOptions(column_names=header, block_size=block_size),
+        parse_options=pacsv.ParseOptions(invalid_row_handler=on_invalid_row),
+        # Read every value as text, so a bad value fails its rule instead of the read
+        convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in header},
+                                             strings_can_be_null=False, quoted_strings_can_be_null=False),
+    )
+    faultyWriter = csv.writer(faulty_data, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
+    for batch in reader:
+        if infer_types:
+            ruled = set(rule.name for rule in rules)
+            rules = rules + infer_rules(batch, [name for name in header if name not in ruled])
+            infer_types = False
+        invalid = None
+        columns = {}
+        for rule in rules:
+            columns[rule.name], checks = rule.violations(batch.column(rule.name))
+            for check, mask in checks:
+                failed = pc.sum(mask).as_py() or 0
+                if failed:
+                    key = '{}:{}'.format(rule.name, check)
+                    counts["violations"][key] = counts["violations"].get(key, 0) + failed
+                    invalid = mask if invalid is None else pc.or_(invalid, mask)
+        if parquet:
+            clean = pa.Table.from_arrays([columns.get(name, batch.column(name)) for name in header], names=header)
+        else:
+            clean = pa.Table.from_batches([batch])
+        if invalid is not None:
+            clean = clean.filter(pc.invert(invalid))
+            faulty = batch.take(pc.indices_nonzero(invalid))
+            faulty_data.write_bytes(to_csv(pa.Table.from_batches([faulty])))
+            counts["faulty_rows"] += faulty.num_rows
+        if parquet:
+            clean_data.write_table(clean)
+        else:
+            clean_data.write_bytes(to_csv(clean))
+        counts["rows"] += batch.num_rows
+        counts["clean_rows"] += clean.num_rows
+
+        for text in malformed:
+            faultyWriter.writerows(csv.reader([text]))
+        counts["rows"] += len(malformed)
+        counts["faulty_rows"] += len(malformed)
+        if malformed:
+            counts["violations"]["columns"] = counts["violations"].get("columns", 0) + len(malformed)
+        malformed.clear()
+    if parquet and clean_data.writer is None:
+        # A file without rows still gets its schema
+        types = dict((rule.name, ARROW_TYPES[rule.type]) for rule in rules)
+        clean_data.write_table(pa.table({name: pa.array([], types.get(name, pa.string())) for name in header}))
+    return counts
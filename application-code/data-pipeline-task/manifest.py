@@ -0,0 +1,119 @@
+import fcntl
+import json
+import os
+from datetime import datetime, timezone
+
+import boto3
+
+
+def object_version(etag, last_modified):
+    """
+    The version of an S3 object recorded in the manifest: its ETag and its
+    LastModified time to the second, which is all S3 keeps.
+    """
+    return {
+        'etag': etag,
+        'last_modified': last_modified.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    }
+
+
+class DynamoDBManifest:
+    """
+    Manifest of the processed incoming files, in a DynamoDB table with the
+    folder as partition key and the object key as sort key, both strings.
+    A folder's files are read with one paginated query.
+    """
+
+    def __init__(self, table, client=None):
+        self.table = table
+        self.client = client or boto3.client('dynamodb')
+
+    def processed(self, folder):
+        """
+        Return the recorded version of each processed file of a folder, by key.
+        """
+        versions = {}
+        paginator = self.client.get_paginator('query')
+        pages = paginator.paginate(
+            TableName=self.table,
+            KeyConditionExpression='#folder = :folder',
+            ProjectionExpression='#key, etag, last_modified',
+            ExpressionAttributeNames={'#folder': 'folder', '#key': 'key'},
+            ExpressionAttributeValues={':folder': {'S': folder}}
+        )
+        for page in pages:
+            for item in page['Items']:
+                versions[item['key']['S']] = {
+                    'etag': item['etag']['S'],
+                    'last_modified': item['last_modified']['S']
+                }
+        return versions
+
+    def record(self, folder, key, version, size):
+        """
+        Record that a version of a file was processed.
+        """
+        self.client.put_item(
+            TableName=self.table,
+            Item={
+                'folder': {'S': folder},
+                'key': {'S': key},
+                'etag': {'S': version['etag']},
+                'last_modified': {'S': version['last_modified']},
+                'size': {'N': str(size)},
+                'processed_at': {'S': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+            }
+        )
+
+
+class LocalManifest:
+    """
+    Stand-in for DynamoDBManifest in a local JSON file, for tests and local
+    runs. Writers lock the file, so several processes can record at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, file):
+        file.seek(0)
+        text = file.read()
+        return json.loads(text) if text else {}
+
+    def processed(self, folder):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as file:
+            fcntl.flock(file, fcntl.LOCK_SH)
+            files = self.load(file).get(folder, {})
+        return dict((key, {'etag': files[key]['etag'], 'last_modified': files[key]['last_modified']}) for key in files)
+
+    def record(self, folder, key, version, size):
+        with open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            manifest = self.load(file)
+            entry = dict(version, size=size, processed_at=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+            manifest.setdefault(folder, {})[key] = entry
+            file.seek(0)
+            file.truncate()
+            json.dump(manifest, file, indent=1)
+
+
+def open_manifest(table='', path=''):
+    """
+    The manifest in the DynamoDB table, or else in the local file path, or
+    None when neither is set and every file is processed.
+    """
+    if table:
+        return DynamoDBManifest(table)
+    if path:
+        return LocalManifest(path)
+    return None
+
+
+def manifest_folder(key):
+    """
+    Folder a file is recorded under: <folder> of <folder>/incoming/<name>.
+    """
+    folder, found, _ = key.rpartition('/incoming/')
+    return folder if found else key.rpartition('/')[0]
@@ -0,0 +1,206 @@
+import gzip
+import io
+import queue
+import threading
+
+# Smallest part S3 accepts in a multipart upload, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Key suffix and content type of each compression
+COMPRESSIONS = {
+    'none': ('', 'text/csv'),
+    'gzip': ('.gz', 'application/gzip'),
+    'zstd': ('.zst', 'application/zstd'),
+}
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Writable binary stream into an S3 object, uploaded as a multipart upload.
+
+    Written bytes are buffered until they fill a part of `part_size` bytes,
+    which a background thread uploads while writing goes on. At most
+    `max_pending_parts` parts wait for upload, after which write blocks, so
+    memory stays below (max_pending_parts + 2) * part_size whatever the size of
+    the object. An object that never fills a part is written with put_object.
+    """
+
+    def __init__(self, s3Client, bucket, key, part_size=8 * 1024 * 1024, max_pending_parts=2, content_type='text/csv'):
+        super().__init__()
+        self.s3Client = s3Client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.extra = {'ContentType': content_type}
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.pending = queue.Queue(max_pending_parts)
+        self.uploader = None
+        self.error = None
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error:
+            raise self.error
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, part):
+        if self.upload_id is None:
+            self.upload_id = self.s3Client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.extra)['UploadId']
+            self.uploader = threading.Thread(target=self._upload, daemon=True)
+            self.uploader.start()
+        self.pending.put(part)
+
+    def _upload(self):
+        number = 0
+        while True:
+            part = self.pending.get()
+            if part is None:
+                return
+            number += 1
+            if self.error:
+                continue
+            try:
+                response = self.s3Client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                     PartNumber=number, Body=part)
+                self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.s3Client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.extra)
+            else:
+                if self.buffer:
+                    self.pending.put(bytes(self.buffer))
+                self.pending.put(None)
+                self.uploader.join()
+                if self.error:
+                    raise self.error
+                self.s3Client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                        MultipartUpload={'Parts': self.parts})
+            self.buffer = bytearray()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self):
+        """
+        Give up on the object, so that no parts are left behind in the bucket.
+        """
+        if self.upload_id is not None:
+            if self.uploader.is_alive():
+                # The uploader skips the parts still queued, then stops
+                self.error = self.error or RuntimeError('Upload aborted')
+                self.pending.put(None)
+                self.uploader.join()
+            self.s3Client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+        super().close()
+
+
+class S3Sink:
+    """
+    Text sink for csv.writer that compresses rows on the fly into an S3
+    multipart upload, so nothing is written to local disk.
+
+    :param compression: 'none', 'gzip' or 'zstd'. The key is given the
+        matching suffix.
+    """
+
+    def __init__(self, s3Client, bucket, key, compression='gzip', part_size=8 * 1024 * 1024, max_pending_parts=2):
+        if compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression {}. Use one of: {}'.format(compression, ', '.join(COMPRESSIONS)))
+        suffix, content_type = COMPRESSIONS[compression]
+        self.key = key + suffix
+        self.raw = S3MultipartWriter(s3Client, bucket, self.key, part_size, max_pending_parts, content_type=content_type)
+        if compression == 'gzip':
+            self.compressed = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=6)
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError('zstd compression needs the zstandard package')
+            self.compressed = zstandard.ZstdCompressor(level=3).stream_writer(self.raw, closefd=False)
+        else:
+            self.compressed = None
+        self.binary = self.compressed or self.raw
+        # Large writes to the compressor, which is much faster than one per row
+        self.text = io.TextIOWrapper(io.BufferedWriter(NonClosing(self.binary), 1024 * 1024), encoding='utf-8',
+                                     newline='')
+
+    @property
+    def bytes_written(self):
+        """
+        Bytes uploaded, after compression.
+        """
+        return self.raw.bytes_written
+
+    def write(self, text):
+        return self.text.write(text)
+
+    def write_bytes(self, data):
+        """
+        Write already encoded rows, after any text written before them.
+        """
+        self.text.flush()
+        self.binary.write(data)
+
+    def close(self):
+        """
+        Flush the compressor and complete the upload.
+        """
+        try:
+            self.text.close()
+            if self.compressed is not None:
+                self.compressed.close()
+        except Exception:
+            self.raw.abort()
+            raise
+        self.raw.close()
+
+    def abort(self):
+        self.raw.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class NonClosing(io.RawIOBase):
+    """
+    Raw stream that passes writes through to `stream` but leaves closing it to
+    its owner, since the compressors' close must run before the upload's.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.stream.write(data)
+        return len(data)
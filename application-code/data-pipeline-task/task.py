@@ -1,109 +1,416 @@
 from typing import List
 import boto3
 import os
+import codecs
 import json
 import csv
+import multiprocessing
+import queue
+import threading
+import requests
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from sinks import S3MultipartWriter, S3Sink
+from manifest import manifest_folder, object_version, open_manifest
 from datetime import date
 from botocore.exceptions import ClientError
 
+# Bytes read from S3 at a time, whatever the size of the file
+READ_BUFFER_SIZE = 1024 * 1024
+# Files validated at once. 0 uses every vCPU of the task
+PROCESSING_WORKERS = int(os.environ.get('PROCESSING_WORKERS', '0'))
+# Bucket the clean and faulty rows are written to, the input bucket by default
+OUTPUT_BUCKET = os.environ.get('OUTPUT_BUCKET', '')
+# none, gzip or zstd
+OUTPUT_COMPRESSION = os.environ.get('OUTPUT_COMPRESSION', 'gzip')
+# Size of each multipart upload part. Each output buffers at most 4 of them
+OUTPUT_PART_SIZE = int(os.environ.get('OUTPUT_PART_SIZE_MB', '8')) * 1024 * 1024
+# Chunks each worker may read ahead of validation, across the current and next files
+PREFETCH_CHUNKS = int(os.environ.get('PREFETCH_CHUNKS', '8'))
+# rows validates with the row loop, arrow with vectorized checks of VALIDATION_SCHEMA
+VALIDATION_ENGINE = os.environ.get('VALIDATION_ENGINE', 'rows')
+# Column rules of the arrow engine, as JSON or the s3:// URI of a JSON object
+VALIDATION_SCHEMA = os.environ.get('VALIDATION_SCHEMA', '')
+# csv, or parquet to write clean rows as Parquet with the arrow engine
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'csv')
+# Parquet codec of the clean rows
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'zstd')
+# Arrow data buffered into each Parquet row group
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_MB', '64')) * 1024 * 1024
+# declared gives columns without rules the string type, inferred the type of their first batch
+PARQUET_SCHEMA = os.environ.get('PARQUET_SCHEMA', 'declared')
+# DynamoDB table, or else local JSON file, recording the version of each processed file
+MANIFEST_TABLE = os.environ.get('MANIFEST_TABLE', '')
+MANIFEST_PATH = os.environ.get('MANIFEST_PATH', '')
+
 def convert_to_json_string(t):
     return f'{t}'
 
-now = date.today()
-processing_date = now.strftime("%m-%d-%Y")
 
-s3Client = boto3.client('s3')
-workflowClient = boto3.client('stepfunctions')
-try:
-    s3BucketName = os.environ["S3_BUCKET"]
-    foldername = os.environ['FOLDERNAME']
-    task_token = os.environ['TASK_TOKEN']
-    print (os.environ['FILES'])
-    file_list = json.loads(os.environ['FILES'])
-    for file in file_list:
-        print ("Reading file : " + file)
-        fileName = os.path.basename(file)
-        clean_data = open(fileName+'_processed.csv', "w")
-        faulty_data = open(fileName+'_errors.csv', "w")
-        fileObj = s3Client.get_object(Bucket=s3BucketName, Key=file)
-        data = fileObj['Body'].read().decode('utf-8').splitlines(True)
-        reader = csv.reader(data)
-        writerClean = csv.writer(clean_data, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
-        writerFaulty = csv.writer(faulty_data, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
-        rownum = 0
-        number_of_clean_rows = 0
-        number_of_faulty_rows = 0
-        number_of_columns = 0
-        for row in reader:
-            if (rownum == 0):
-                number_of_columns = len(row)
-                print("Number of columns in file = ", len(row))
-            if (len(row) == number_of_columns):
-                writerClean.writerow(row)
-                number_of_clean_rows = number_of_clean_rows+1
-            else:
-                writerFaulty.writerow(row)
-                number_of_faulty_rows = number_of_faulty_rows+1
-            rownum = rownum + 1
-
-        print ("Number of rows in file : " + str(rownum))
-        print ("Number of clean rows : " , str(number_of_clean_rows))
-        print ("Number of faulty rows : ", str(number_of_faulty_rows))
-        # print("Getting attributes of " + file)
-        # response = s3Client.get_object_attributes(
-        #     Bucket=s3BucketName,
-        #     Key=file,
-        #     ObjectAttributes=['ETag', 'Checksum', 'StorageClass', 'ObjectSize']
-        # )
-        # print(response)
-        # FUTURE: Upload clean and faulty files to another bucket or folder
-
-    result = {
-        "id": foldername,
-        "files": file_list,
-        "result": "pass",
-        "processing_date": processing_date,
-        "code": "O"
-    }
-    print(result)
-    if task_token:
-        print("Sending success output to Step Functions with task token " + task_token)
-        workflowClient.send_task_success(
-            taskToken=task_token,
-            output=json.dumps(result, default=convert_to_json_string)
-        )
-# Catch any boto3 client exception
-except ClientError as e:
-    result = {
-        'error': e.__dict__,
-        "id": foldername,
-        "files": file_list,
-        "processing_date": processing_date
+def iter_lines(body, chunk_size=READ_BUFFER_SIZE):
+    """
+    Yield the lines of an S3 object body with their line endings, reading
+    `chunk_size` bytes at a time through an incremental UTF-8 decoder, so memory
+    use doesn't grow with the size of the object.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    while True:
+        data = body.read(chunk_size)
+        text = pending + decoder.decode(data, final=not data)
+        if not data:
+            if text:
+                yield text
+            return
+        lines = text.splitlines(True)
+        # The last line may continue in the next chunk, and so may a trailing \r with its \n
+        pending = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        yield from lines
+
+
+def open_csv(body, chunk_size=READ_BUFFER_SIZE):
+    """
+    Return a csv.reader streaming the rows of an S3 object body.
+    """
+    return csv.reader(iter_lines(body, chunk_size))
+
+
+def process_rows(reader, writerClean, writerFaulty):
+    """
+    Write the rows with as many columns as the first to writerClean and the
+    others to writerFaulty, and return the row counts.
+    """
+    rownum = 0
+    number_of_clean_rows = 0
+    number_of_faulty_rows = 0
+    number_of_columns = 0
+    for row in reader:
+        if (rownum == 0):
+            number_of_columns = len(row)
+            print("Number of columns in file = ", len(row))
+        if (len(row) == number_of_columns):
+            writerClean.writerow(row)
+            number_of_clean_rows = number_of_clean_rows+1
+        else:
+            writerFaulty.writerow(row)
+            number_of_faulty_rows = number_of_faulty_rows+1
+        rownum = rownum + 1
+    return {
+        "rows": rownum,
+        "clean_rows": number_of_clean_rows,
+        "faulty_rows": number_of_faulty_rows
     }
-    print(result)
-    if task_token:
-        print("Sending failure output to Step Functions with task token " + task_token)
-        workflowClient.send_task_failure(
-            taskToken=task_token,
-            error="DataProcessingException",
-            cause=json.dumps(result, default=convert_to_json_string)
-        )
-# Catch any generic python exception
-except Exception as e:
-    result = {
-        "id": foldername,
-        "files": file_list,
-        "result": "fail",
-        "error": e,
-        "cause": "processing error",
-        "processing_date": processing_date
+
+
+def output_key(file, kind):
+    """
+    Key of the `kind` output of an incoming file: <folder>/incoming/<name>
+    becomes <folder>/<kind>/<name>_<kind>.csv.
+    """
+    folder, _, name = file.rpartition('/incoming/')
+    if not _:
+        folder, _, name = file.rpartition('/')
+    return "{}/{}/{}_{}.csv".format(folder, kind, name, kind).lstrip('/')
+
+
+def load_rules(s3Client):
+    """
+    The column rules of the arrow engine, or None with the rows engine.
+    """
+    if OUTPUT_FORMAT not in ('csv', 'parquet'):
+        raise ValueError('Unknown output format {}. Use csv or parquet'.format(OUTPUT_FORMAT))
+    # Only the arrow engine writes Parquet
+    if VALIDATION_ENGINE == 'rows' and OUTPUT_FORMAT == 'csv':
+        return None
+    if VALIDATION_ENGINE not in ('rows', 'arrow'):
+        raise ValueError('Unknown validation engine {}. Use rows or arrow'.format(VALIDATION_ENGINE))
+    import columnar
+    text = VALIDATION_SCHEMA
+    if text.startswith('s3://'):
+        bucket, _, key = text[len('s3://'):].partition('/')
+        text = s3Client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    return columnar.load_schema(text or '{}')
+
+
+def parquet_key(file):
+    """
+    Key of the Parquet output of an incoming file, partitioned by processing
+    date: <folder>/incoming/<name> becomes
+    <folder>/processed/processing_date=<yyyy-mm-dd>/<name>.parquet.
+    """
+    folder = output_key(file, 'processed').rpartition('/processed/')[0]
+    name = file.rpartition('/')[2]
+    return "{}/processed/processing_date={}/{}.parquet".format(folder, now.isoformat(), name).lstrip('/')
+
+
+def process_file(s3Client, file, body, rules=None):
+    print ("Reading file : " + file)
+    outputBucket = OUTPUT_BUCKET or os.environ["S3_BUCKET"]
+    # Rows are compressed and uploaded as they are validated, without touching local disk
+    if OUTPUT_FORMAT == 'parquet':
+        import columnar
+        clean_data = columnar.ParquetSink(
+            S3MultipartWriter(s3Client, outputBucket, parquet_key(file), OUTPUT_PART_SIZE,
+                              content_type='application/vnd.apache.parquet'),
+            PARQUET_COMPRESSION, PARQUET_ROW_GROUP_SIZE)
+    else:
+        clean_data = S3Sink(s3Client, outputBucket, output_key(file, 'processed'), OUTPUT_COMPRESSION, OUTPUT_PART_SIZE)
+    with clean_data, \
+            S3Sink(s3Client, outputBucket, output_key(file, 'errors'), OUTPUT_COMPRESSION, OUTPUT_PART_SIZE) as faulty_data:
+        if rules is not None:
+            import columnar
+            counts = columnar.validate(body, clean_data, faulty_data, rules,
+                                       infer_types=OUTPUT_FORMAT == 'parquet' and PARQUET_SCHEMA == 'inferred')
+        else:
+            reader = open_csv(body)
+            writerClean = csv.writer(clean_data, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
+            writerFaulty = csv.writer(faulty_data, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
+            counts = process_rows(reader, writerClean, writerFaulty)
+    counts["outputs"] = {
+        "clean": "s3://{}/{}".format(outputBucket, clean_data.key),
+        "faulty": "s3://{}/{}".format(outputBucket, faulty_data.key)
     }
-    print(result)
-    if task_token:
-        print("Sending failure output to Step Functions with task token " + task_token)
-        workflowClient.send_task_failure(
-            taskToken=task_token,
-            error="DataProcessingException",
-            cause=json.dumps(result, default=convert_to_json_string)
-        )
+    counts["clean_bytes"] = clean_data.bytes_written
+    counts["faulty_bytes"] = faulty_data.bytes_written
+    if OUTPUT_FORMAT == 'parquet':
+        counts["parquet_rows"] = clean_data.rows
+        counts["parquet_row_groups"] = clean_data.row_groups
+
+    print ("Number of rows in file : " + str(counts["rows"]))
+    print ("Number of clean rows : " , str(counts["clean_rows"]))
+    print ("Number of faulty rows : ", str(counts["faulty_rows"]))
+    if counts.get("violations"):
+        print ("Violations by check : " + json.dumps(counts["violations"]))
+    print ("Wrote {} and {}".format(counts["outputs"]["clean"], counts["outputs"]["faulty"]))
+    return counts
+
+
+def task_vcpus():
+    """
+    The vCPUs of the task, from the ECS task metadata endpoint, or else the
+    CPUs this process can run on.
+    """
+    uri = os.environ.get('ECS_CONTAINER_METADATA_URI_V4')
+    if uri:
+        try:
+            cpu = requests.get(uri + '/task', timeout=2).json().get('Limits', {}).get('CPU')
+            if cpu:
+                return max(1, int(cpu))
+        except (requests.RequestException, ValueError) as e:
+            print("Could not read the task metadata: " + str(e))
+    return len(os.sched_getaffinity(0))
+
+
+class PrefetchedBody:
+    """
+    Body of the current file, read from the chunks a Prefetcher queued.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+        self.done = False
+
+    def read(self, amt):
+        while not self.done and len(self.buffer) < amt:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.done = True
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+
+class Prefetcher(threading.Thread):
+    """
+    Download the files `keys` yields, one after another, into a queue of at
+    most `max_chunks` chunks. The next file starts downloading as soon as the
+    previous one is queued, so S3 reads overlap with validation of the file
+    before, while memory stays bounded.
+    """
+
+    def __init__(self, s3Client, s3BucketName, keys, max_chunks, chunk_size=READ_BUFFER_SIZE):
+        super().__init__(daemon=True)
+        self.s3Client = s3Client
+        self.s3BucketName = s3BucketName
+        self.keys = keys
+        self.chunk_size = chunk_size
+        # (key, chunk queue) of each file, in order, None after the last
+        self.files = queue.Queue()
+        self.max_chunks = max_chunks
+        self.slots = threading.BoundedSemaphore(max_chunks)
+
+    def run(self):
+        for key in self.keys:
+            chunks = SlotQueue(self.slots)
+            self.files.put((key, chunks))
+            try:
+                response = self.s3Client.get_object(Bucket=self.s3BucketName, Key=key)
+                # The version read, recorded in the manifest once the file is processed
+                chunks.version = object_version(response['ETag'], response['LastModified'])
+                chunks.size = response['ContentLength']
+                body = response['Body']
+                while True:
+                    data = body.read(self.chunk_size)
+                    chunks.put(data)
+                    if not data:
+                        break
+            except Exception as e:
+                chunks.put(e)
+                break
+        self.files.put(None)
+
+    def __iter__(self):
+        return iter(self.files.get, None)
+
+
+class SlotQueue(queue.Queue):
+    """
+    Chunk queue of one file. Each chunk holds one of the Prefetcher's slots
+    until it has been read, so the chunks of every file share one bound.
+    """
+
+    def __init__(self, slots):
+        super().__init__()
+        self.slots = slots
+        self.version = None
+        self.size = 0
+
+    def put(self, item, block=True, timeout=None):
+        self.slots.acquire()
+        super().put(item, block, timeout)
+
+    def get(self, block=True, timeout=None):
+        item = super().get(block, timeout)
+        self.slots.release()
+        return item
+
+
+def process_worker(s3BucketName, keys, prefetch_chunks):
+    """
+    Validate the files `keys` yields with a Prefetcher reading ahead, and return
+    their counts by file. Each file is recorded in the manifest, if any, once
+    its outputs are written.
+    """
+    s3Client = boto3.client('s3')
+    rules = load_rules(s3Client)
+    manifest = open_manifest(MANIFEST_TABLE, MANIFEST_PATH)
+    prefetcher = Prefetcher(s3Client, s3BucketName, keys, prefetch_chunks)
+    prefetcher.start()
+    counts = {}
+    for key, chunks in prefetcher:
+        counts[key] = process_file(s3Client, key, PrefetchedBody(chunks), rules)
+        if manifest is not None:
+            manifest.record(manifest_folder(key), key, chunks.version, chunks.size)
+    return counts
+
+
+def pool_worker(s3BucketName, work, prefetch_chunks):
+    return process_worker(s3BucketName, iter(work.get, None), prefetch_chunks)
+
+
+def process_files(s3BucketName, file_list, workers, prefetch_chunks):
+    """
+    Validate file_list with up to `workers` processes taking files from a shared
+    queue, and return their counts by file in file_list order.
+    """
+    workers = max(1, min(workers, len(file_list)))
+    print("Processing {} files with {} workers".format(len(file_list), workers))
+    if workers == 1:
+        counts = process_worker(s3BucketName, iter(file_list), prefetch_chunks)
+    else:
+        counts = {}
+        # spawn, since the parent's boto3 clients and threads don't survive a fork
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager, ProcessPoolExecutor(workers, mp_context=context) as pool:
+            work = manager.Queue()
+            for file in file_list + [None] * workers:
+                work.put(file)
+            futures = [pool.submit(pool_worker, s3BucketName, work, prefetch_chunks) for _ in range(workers)]
+            for future in futures:
+                counts.update(future.result())
+    return {file: counts[file] for file in file_list}
+
+
+def summarize_counts(counts):
+    totals = {"rows": 0, "clean_rows": 0, "faulty_rows": 0, "clean_bytes": 0, "faulty_bytes": 0}
+    violations = {}
+    for fileCounts in counts.values():
+        for key in totals:
+            totals[key] += fileCounts[key]
+        for check, count in fileCounts.get("violations", {}).items():
+            violations[check] = violations.get(check, 0) + count
+    if violations:
+        totals["violations"] = violations
+    return totals
+
+
+now = date.today()
+processing_date = now.strftime("%m-%d-%Y")
+
+def main():
+    workflowClient = boto3.client('stepfunctions')
+    try:
+        s3BucketName = os.environ["S3_BUCKET"]
+        foldername = os.environ['FOLDERNAME']
+        task_token = os.environ['TASK_TOKEN']
+        print (os.environ['FILES'])
+        file_list = json.loads(os.environ['FILES'])
+        counts = process_files(s3BucketName, file_list, PROCESSING_WORKERS or task_vcpus(), PREFETCH_CHUNKS)
+
+        result = {
+            "id": foldername,
+            "files": file_list,
+            "result": "pass",
+            "processing_date": processing_date,
+            "code": "O",
+            "counts": summarize_counts(counts),
+            "file_counts": counts
+        }
+        print(result)
+        if task_token:
+            print("Sending success output to Step Functions with task token " + task_token)
+            workflowClient.send_task_success(
+                taskToken=task_token,
+                output=json.dumps(result, default=convert_to_json_string)
+            )
+    # Catch any boto3 client exception
+    except ClientError as e:
+        result = {
+            'error': e.__dict__,
+            "id": foldername,
+            "files": file_list,
+            "processing_date": processing_date
+        }
+        print(result)
+        if task_token:
+            print("Sending failure output to Step Functions with task token " + task_token)
+            workflowClient.send_task_failure(
+                taskToken=task_token,
+                error="DataProcessingException",
+                cause=json.dumps(result, default=convert_to_json_string)
+            )
+    # Catch any generic python exception
+    except Exception as e:
+        result = {
+            "id": foldername,
+            "files": file_list,
+            "result": "fail",
+            "error": e,
+            "cause": "processing error",
+            "processing_date": processing_date
+        }
+        print(result)
+        if task_token:
+            print("Sending failure output to Step Functions with task token " + task_token)
+            workflowClient.send_task_failure(
+                taskToken=task_token,
+                error="DataProcessingException",
+                cause=json.dumps(result, default=convert_to_json_string)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+
+# Estimators of the message processing duration, from per-period CloudWatch
+# datapoints of (timestamp in seconds, value, sample count)
+
+# Statistic each estimator reads per period, computed by CloudWatch
+STATISTICS = {
+    'ewma': 'Average',
+    'trimmed_mean': 'TM(10%:90%)',
+    'p90': 'p90',
+}
+
+# Estimators that can't be combined from per-period values: a mean of per-minute
+# p90s sits below the p90 of the window whenever slow messages cluster in a few
+# minutes. CloudWatch computes these over the whole window, as a single period.
+WINDOWED = ('p90',)
+
+
+def estimate(estimator, datapoints, now, halfLife=900):
+    """
+    Combine per-period datapoints into a single processing duration.
+
+    'ewma' weights each period's average by its sample count and by how recent it
+    is, halving the weight every `halfLife` seconds. 'trimmed_mean' weights each
+    period's trimmed mean by its sample count. WINDOWED estimators are read as a
+    single datapoint over the window instead.
+
+    Returns None when there are no samples.
+    """
+    if estimator not in STATISTICS:
+        raise ValueError('Unknown duration estimator {}. Use one of: {}'.format(estimator, ', '.join(STATISTICS)))
+    if estimator in WINDOWED:
+        raise ValueError('The {} estimator is computed over the whole window, not from periods'.format(estimator))
+    totalWeight = 0.0
+    total = 0.0
+    for timestamp, value, count in datapoints:
+        weight = count
+        if estimator == 'ewma':
+            weight *= 0.5 ** (max(0.0, now - timestamp) / halfLife)
+        totalWeight += weight
+        total += weight * value
+    if totalWeight <= 0:
+        return None
+    return total / totalWeight
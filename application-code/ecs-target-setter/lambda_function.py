@@ -1,10 +1,12 @@
 import boto3
+import json
 import os
 import logging
 from botocore.config import Config
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
+from estimators import STATISTICS, WINDOWED, estimate
 
 # Create logger
 logging.basicConfig(level=logging.INFO)
@@ -33,9 +35,42 @@ appMetricName = os.environ['app_metric_name']
 bpiMetricName=os.environ['bpi_metric_name']
 metricType=os.environ['metric_type']
 metricNamespace=os.environ['metric_namespace']
+# Number of messages each task processes at once
+maxConcurrency=int(os.environ.get('max_concurrency', '1'))
+# Processing duration estimator: ewma or trimmed_mean of per-period statistics, or p90 of every sample, over the last durationWindow seconds
+durationEstimator=os.environ.get('duration_estimator', 'ewma')
+durationWindow=int(os.environ.get('duration_window', '3600'))
+durationPeriod=int(os.environ.get('duration_period', '60'))
+ewmaHalfLife=float(os.environ.get('ewma_half_life', '900'))
+if durationEstimator not in STATISTICS:
+    raise ValueError('Unknown duration_estimator {}'.format(durationEstimator))
+# Leave the policy alone unless the target moves by more than target_change_threshold percent,
+# and rewrite it at most once every min_update_interval seconds
+targetChangeThreshold=float(os.environ.get('target_change_threshold', '10'))
+minUpdateInterval=int(os.environ.get('min_update_interval', '1800'))
+decisionMetricName=os.environ.get('decision_metric_name', 'TargetBPIDecision')
 
+# Per-period datapoints kept between warm invocations: timestamp -> (value, sample count)
+durationHistory = {}
+durationFetchedUntil = None
+# Time of this container's last policy rewrite
+lastUpdateTime = None
 
-def publishMetricValue(metricValue):
+
+def decisionDimensions(decision):
+
+    return [
+        {
+            'Name': 'Decision',
+            'Value': decision
+        },
+        {
+            'Name': 'QueueName',
+            'Value': queueName
+        }
+    ]
+
+def publishMetricValue(metricValue, decision):
 
     response = cloudwatch.put_metric_data(
         Namespace = metricNamespace,
@@ -54,80 +89,109 @@ def publishMetricValue(metricValue):
                     }
                 ],
                 'StorageResolution': 1
+            },
+            {
+                'MetricName': decisionMetricName,
+                'Value': 1,
+                'Unit': 'Count',
+                'Dimensions': decisionDimensions(decision)
             }
         ]
     )
 
 def getMetricValue(metricNamespace, metricName):
 
-    # Define query
-    query={
-        'Id': 'query_123',
-        'MetricStat': {
-            'Metric': {
-                'Namespace': metricNamespace,
-                'MetricName': appMetricName,
-                    'Dimensions': [
-                        {
-                            'Name': 'Type',
-                            'Value': metricType
-                        },
-                        {
-                            'Name': 'QueueName',
-                            'Value': queueName
-                        },
-                    ]
+    global durationFetchedUntil
+    now = datetime.now(timezone.utc)
+    windowStart = now - timedelta(seconds=durationWindow)
+
+    # Define queries: the estimator's statistic and the sample count of each period
+    metric = {
+        'Namespace': metricNamespace,
+        'MetricName': metricName,
+        'Dimensions': [
+            {
+                'Name': 'Type',
+                'Value': metricType
             },
-            'Period': 1,
-            'Stat': 'Average',
-        }
+            {
+                'Name': 'QueueName',
+                'Value': queueName
+            },
+        ]
     }
+    queries = [
+        {
+            'Id': 'duration',
+            'MetricStat': {'Metric': metric, 'Period': durationPeriod, 'Stat': STATISTICS[durationEstimator]}
+        },
+        {
+            'Id': 'samples',
+            'MetricStat': {'Metric': metric, 'Period': durationPeriod, 'Stat': 'SampleCount'}
+        }
+    ]
 
-    response = cloudwatch.get_metric_data(
-        MetricDataQueries=[query],
-        StartTime=datetime.now(timezone.utc) - timedelta(seconds=86400),
-        EndTime=datetime.now(timezone.utc),
-    )
+    if durationEstimator in WINDOWED:
+        return getWindowedValue(queries, now)
 
-    if not response.get('MetricDataResults')[0].get('Values'):
-        msgProcessingDuration=defaultMsgProcDuration
-    else:
-        values = response.get('MetricDataResults')[0].get('Values')
-        total = sum(values)
-        count = len(values)
-        msgProcessingDuration =  total / count
-        print("count={} total={} msgProcessingDuration={}".format(count, total, msgProcessingDuration))
-        msgProcessingDuration=response.get('MetricDataResults')[0].get('Values')[0]
+    # Only fetch the periods since the last run, plus a few that may still have been filling
+    startTime = windowStart
+    if durationFetchedUntil is not None:
+        startTime = max(windowStart, durationFetchedUntil - timedelta(seconds=5 * durationPeriod))
 
-    # Return
-    return msgProcessingDuration
+    results = {'duration': {}, 'samples': {}}
+    paginator = cloudwatch.get_paginator('get_metric_data')
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=startTime, EndTime=now):
+        for result in page.get('MetricDataResults'):
+            results[result.get('Id')].update(zip(result.get('Timestamps'), result.get('Values')))
 
+    # Merge the new periods into the history kept between warm invocations
+    for timestamp, value in results['duration'].items():
+        durationHistory[timestamp] = (value, results['samples'].get(timestamp, 0.0))
+    for timestamp in [timestamp for timestamp in durationHistory if timestamp < windowStart]:
+        del durationHistory[timestamp]
+    durationFetchedUntil = now
 
+    datapoints = sorted((timestamp.timestamp(), value, count) for timestamp, (value, count) in durationHistory.items())
+    msgProcessingDuration = estimate(durationEstimator, datapoints, now.timestamp(), ewmaHalfLife)
+    print("estimator={} periods={} fetched={} msgProcessingDuration={}".format(durationEstimator, len(datapoints), len(results['duration']), msgProcessingDuration))
+    if not msgProcessingDuration:
+        msgProcessingDuration = defaultMsgProcDuration
 
-def lambda_handler(event, context):
+    # Return
+    return msgProcessingDuration
 
-    # Get cloudwatch metric for msg processing duration
-    msgProcessingDuration=getMetricValue(metricNamespace, appMetricName)
-    print('Most recent message processing duration is {}'.format(msgProcessingDuration))
 
-    # Calculate new target BPI (assuming latency of 5mins)
-    newTargetBPI =int(desiredLatency / msgProcessingDuration)
-    print('New Target BPI is {}'.format(newTargetBPI))
 
-    # Get aplication auto scaling policy of ECS
+def getWindowedValue(queries, now):
 
-    response = appautoscaling.describe_scaling_policies(PolicyNames=[ecs_sqs_app_scaling_policy_name], ServiceNamespace='ecs')
-    policies =response.get('ScalingPolicies')
-    policy=policies[0]
+    # One period spanning the whole window, so CloudWatch computes the statistic over every sample in it
+    period = -(-durationWindow // 60) * 60
+    for query in queries:
+        query['MetricStat']['Period'] = period
+    response = cloudwatch.get_metric_data(
+        MetricDataQueries=queries,
+        StartTime=now - timedelta(seconds=period),
+        EndTime=now,
+    )
+    results = {result.get('Id'): dict(zip(result.get('Timestamps'), result.get('Values'))) for result in response.get('MetricDataResults')}
 
+    # The window may straddle two aligned periods: use the one holding the most samples
+    msgProcessingDuration = None
+    if results.get('duration'):
+        timestamp = max(results['duration'], key=lambda timestamp: results['samples'].get(timestamp, 0.0))
+        msgProcessingDuration = results['duration'][timestamp]
+    print("estimator={} period={} msgProcessingDuration={}".format(durationEstimator, period, msgProcessingDuration))
+    if not msgProcessingDuration:
+        msgProcessingDuration = defaultMsgProcDuration
+    return msgProcessingDuration
 
-    # Get target tracking config and update target value
-    TargetTrackingConfig=policy.get('TargetTrackingScalingPolicyConfiguration')
-    TargetTrackingConfig['TargetValue'] = newTargetBPI
-    TargetTrackingConfig['ScaleOutCooldown'] = 240
-    TargetTrackingConfig['ScaleInCooldown'] = 240
+def buildCustomMetric(resourceId):
 
-    customMetric = {
+    # The ResourceId of an ECS service is service/<cluster name>/<service name>
+    _, clusterName, serviceName = resourceId.split('/')
+
+    return {
             'Metrics': [
                 {
                     'Id': 'm1',
@@ -155,11 +219,11 @@ def lambda_handler(event, context):
                             'Dimensions': [
                                 {
                                     'Name': 'ClusterName',
-                                    'Value': 'core-infra'
+                                    'Value': clusterName
                                 },
                                 {
                                     'Name': 'ServiceName',
-                                    'Value': 'ecsdemo-queue-proc3'
+                                    'Value': serviceName
                                 },
                             ],
                             'MetricName': 'RunningTaskCount',
@@ -170,7 +234,7 @@ def lambda_handler(event, context):
                     'ReturnData': False
                 },
                 {
-                    'Id': 'm3',
+                    'Id': 'e1',
                     'Label': 'Calculate the backlog per instance',
                     'Expression': 'm1 / m2',
                     'ReturnData': True
@@ -178,18 +242,88 @@ def lambda_handler(event, context):
             ]
     }
 
+def recentlyUpdated():
 
-    TargetTrackingConfig['CustomizedMetricSpecification'] = customMetric
-    # Update scaling policy of ASG
-    appautoscaling.put_scaling_policy(
-        ServiceNamespace='ecs',
-        ResourceId=policy.get('ResourceId'),
-        ScalableDimension=policy.get('ScalableDimension'),
-        PolicyName=policy.get('PolicyName'),
-        PolicyType=policy.get('PolicyType'),
-        TargetTrackingScalingPolicyConfiguration=TargetTrackingConfig
+    # Rewrites are recorded as decision metrics, so this holds across cold starts
+    now = datetime.now(timezone.utc)
+    if lastUpdateTime is not None and now - lastUpdateTime < timedelta(seconds=minUpdateInterval):
+        return True
+    period = max(60, minUpdateInterval // 60 * 60)
+    response = cloudwatch.get_metric_data(
+        MetricDataQueries=[{
+            'Id': 'updates',
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': metricNamespace,
+                    'MetricName': decisionMetricName,
+                    'Dimensions': decisionDimensions('Updated')
+                },
+                'Period': period,
+                'Stat': 'Sum'
+            }
+        }],
+        StartTime=now - timedelta(seconds=period),
+        EndTime=now,
     )
-    print('Scaling policy of ECS has been successfully updated!')
+    return sum(response.get('MetricDataResults')[0].get('Values')) > 0
+
+def decide(policy, newTargetBPI, newConfig):
+
+    # Updated, SkippedWithinBand or SkippedRateLimited
+    currentConfig = policy.get('TargetTrackingScalingPolicyConfiguration')
+    currentTargetBPI = currentConfig.get('TargetValue')
+    for key in ('CustomizedMetricSpecification', 'ScaleOutCooldown', 'ScaleInCooldown'):
+        if json.dumps(currentConfig.get(key), sort_keys=True) != json.dumps(newConfig.get(key), sort_keys=True):
+            print('{} of the scaling policy changed'.format(key))
+            return 'Updated'
+    if currentTargetBPI and abs(newTargetBPI - currentTargetBPI) * 100 <= targetChangeThreshold * currentTargetBPI:
+        return 'SkippedWithinBand'
+    if minUpdateInterval > 0 and recentlyUpdated():
+        return 'SkippedRateLimited'
+    return 'Updated'
+
+def lambda_handler(event, context):
+
+    global lastUpdateTime
+
+    # Get cloudwatch metric for msg processing duration
+    msgProcessingDuration=getMetricValue(metricNamespace, appMetricName)
+    print('Estimated message processing duration is {}'.format(msgProcessingDuration))
+
+    # Calculate new target BPI (each task works maxConcurrency messages at a time)
+    newTargetBPI =int(desiredLatency * maxConcurrency / msgProcessingDuration)
+    print('New Target BPI is {}'.format(newTargetBPI))
+
+    # Get aplication auto scaling policy of ECS
+
+    response = appautoscaling.describe_scaling_policies(PolicyNames=[ecs_sqs_app_scaling_policy_name], ServiceNamespace='ecs')
+    policies =response.get('ScalingPolicies')
+    policy=policies[0]
+
+
+    # Build the new target tracking config
+    TargetTrackingConfig=dict(policy.get('TargetTrackingScalingPolicyConfiguration'))
+    currentTargetBPI = TargetTrackingConfig.get('TargetValue')
+    TargetTrackingConfig['TargetValue'] = newTargetBPI
+    TargetTrackingConfig['ScaleOutCooldown'] = 240
+    TargetTrackingConfig['ScaleInCooldown'] = 240
+    TargetTrackingConfig['CustomizedMetricSpecification'] = buildCustomMetric(policy.get('ResourceId'))
+
+    # Only rewrite the policy when the target leaves the band around the current one, or the metric changed
+    decision = decide(policy, newTargetBPI, TargetTrackingConfig)
+    print('Decision {}: current Target BPI {}, new Target BPI {}'.format(decision, currentTargetBPI, newTargetBPI))
+    if decision == 'Updated':
+        # Update scaling policy of ASG
+        appautoscaling.put_scaling_policy(
+            ServiceNamespace='ecs',
+            ResourceId=policy.get('ResourceId'),
+            ScalableDimension=policy.get('ScalableDimension'),
+            PolicyName=policy.get('PolicyName'),
+            PolicyType=policy.get('PolicyType'),
+            TargetTrackingScalingPolicyConfiguration=TargetTrackingConfig
+        )
+        lastUpdateTime = datetime.now(timezone.utc)
+        print('Scaling policy of ECS has been successfully updated!')
 
-    # Publish new target BPI
-    publishMetricValue(newTargetBPI)
+    # Publish the target BPI in effect and the decision
+    publishMetricValue(newTargetBPI if decision == 'Updated' else currentTargetBPI, decision)
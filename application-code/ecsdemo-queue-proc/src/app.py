@@ -3,16 +3,20 @@
 import boto3
 import os
 import json
-import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from botocore.config import Config
-import datetime
+from metrics import MetricPublisher
+from shutdown import ShutdownCoordinator
+import queue_logging
 
-# Create logger
-#logging.basicConfig(filename='consumer.log', level=logging.INFO)
-logging.basicConfig(level=logging.INFO)
+# Create logger. Records are written as JSON lines by a background thread; the
+# per-message ones are sampled at LOG_SAMPLE_RATE.
+queue_logging.configure()
 logger = logging.getLogger()
+messageLogger = queue_logging.message_logger(__name__)
 
 # Define config
 config = Config(
@@ -32,69 +36,130 @@ app_metric_name = os.environ['app_metric_name']
 metric_type = os.environ['metric_type']
 metric_namespace = os.environ['metric_namespace']
 
+# Read optional environment variables
+max_concurrency = int(os.environ.get('max_concurrency', '1'))
+metric_flush_interval = float(os.environ.get('metric_flush_interval', '10'))
+metric_output = os.environ.get('metric_output', 'api')
+# Match the container's stopTimeout. In-flight messages get all but the last few
+# seconds of it, which are left to release messages and flush metrics.
+stop_timeout = float(os.environ.get('stop_timeout', '30'))
+drain_timeout = max(0.0, stop_timeout - 5)
+
+# Buffer message durations and publish them in aggregate
+metrics = MetricPublisher(
+    cloudwatch, metric_namespace, app_metric_name,
+    {'Type': metric_type, 'QueueName': queue_name},
+    flush_interval=metric_flush_interval, output=metric_output
+)
+
 
 def publishMetricValue(metricValue):
 
-    now = datetime.datetime.now()
-    logger.info('Time {} publishMetricValue with metric_namespace {} app_metric_name {} metricValue {} metric_type {} queue_name {}'.format(now, metric_namespace, app_metric_name, metricValue,metric_type, queue_name))
-    response = cloudwatch.put_metric_data(
-        Namespace = metric_namespace,
-        MetricData = [
-            {
-                'MetricName': app_metric_name,
-                'Value': metricValue,
-                'Dimensions': [
-                    {
-                        'Name': 'Type',
-                        'Value': metric_type
-                    },
-                    {
-                        'Name': 'QueueName',
-                        'Value': queue_name
-                    }
-                ],
-                'StorageResolution': 1
-            }
-        ]
-    )
+    messageLogger.debug('publishMetricValue with metric_namespace %s app_metric_name %s metricValue %s metric_type %s queue_name %s', metric_namespace, app_metric_name, metricValue, metric_type, queue_name)
+    metrics.record(metricValue)
 
-if __name__=="__main__":
+def releaseMessages(messages):
+
+    # Make the messages visible again right away, so another task picks them up
+    entries = [{'Id': str(ind), 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': 0} for ind, message in enumerate(messages)]
+    try:
+        response = messages[0].meta.client.change_message_visibility_batch(QueueUrl=messages[0].queue_url, Entries=entries)
+        for failed in response.get('Failed', []):
+            logger.warning('Could not release message_id %s: %s', messages[int(failed['Id'])].message_id, failed.get('Message'))
+    except ClientError as error:
+        logger.error('SQS Service Exception - Code: {}, Message: {}'.format(error.response['Error']['Code'],error.response['Error']['Message']))
+
+def processMessage(message, shutdown):
+
+    try:
+        messageBody = json.loads(message.body)
+        processingDuration = float(messageBody.get('duration'))
+        messageLogger.info('Processing message_id %s messageBody %s...', message.message_id, message.body)
+
+        # Work until done, unless the stop timeout is about to expire
+        if shutdown.aborting.wait(processingDuration):
+            releaseMessages([message])
+            return
+
+        # Delete the message
+        message.delete()
+
+        # Report message duration to cloudwatch
+        publishMetricValue(processingDuration)
+
+    except ClientError as error:
+        logger.error('SQS Service Exception - Code: {}, Message: {}'.format(error.response['Error']['Code'],error.response['Error']['Message']))
+
+    except Exception as e:
+        logger.error('Unexpected error - {}'.format(e))
+
+def main(stop=None):
+    """
+    Consume messages from the queue until `stop` is set, or forever without one.
+
+    Up to `max_concurrency` messages are processed at once. Each receive asks for
+    as many messages as there are idle workers, up to 10, and each message is
+    deleted as soon as it has been processed.
+
+    On SIGTERM the loop stops receiving and in-flight messages get until
+    `drain_timeout` seconds after the signal to finish. Messages still in flight
+    then are released back to the queue, and buffered metrics are published.
+
+    :param stop: An optional threading.Event that ends the loop once it is set.
+    """
 
     # Initialize variables
-    logger.info('Environment queue_name {} app_metric_name {} metric_type {} metric_namespace {}'.format(queue_name, app_metric_name, metric_type, metric_namespace))
+    logger.info('Environment queue_name {} app_metric_name {} metric_type {} metric_namespace {} max_concurrency {}'.format(queue_name, app_metric_name, metric_type, metric_namespace, max_concurrency))
     logger.info('Calling get_queue_by_name....')
     queue = sqs.get_queue_by_name(QueueName=queue_name)
-    batchSize = 1
     queueWaitTime= 5
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    idleWorkers = threading.BoundedSemaphore(max_concurrency)
+    inFlight = set()
+    inFlightLock = threading.Lock()
+    shutdown = ShutdownCoordinator(drain_timeout, stopping=stop).install()
+    metrics.start()
+
+    def finished(future):
+        with inFlightLock:
+            inFlight.discard(future)
+        idleWorkers.release()
 
     # start continuous loop
     logger.info('Starting queue consumer process....')
-    while True:
+    while not shutdown.stopping.is_set():
 
+        # Wait for an idle worker, then claim every other idle worker a single receive can fill
+        if not idleWorkers.acquire(timeout=1): continue
+        batchSize = 1
+        while batchSize < 10 and idleWorkers.acquire(blocking=False):
+            batchSize += 1
+
+        messages = []
+        submitted = 0
         try:
 
             # Read messages from queue
-            logger.info('Polling messages from the   processing queue')
+            logger.debug('Polling up to %s messages from the processing queue', batchSize)
             messages = queue.receive_messages(AttributeNames=['All'], MaxNumberOfMessages=batchSize, WaitTimeSeconds=queueWaitTime)
             if not messages: continue
 
 
-            logger.info('-- Received {} messages'.format(len(messages)))
+            logger.debug('-- Received %s messages', len(messages))
+
+            # Hand back messages that arrive after a stop instead of starting them
+            if shutdown.stopping.is_set():
+                releaseMessages(messages)
+                messages = []
+                continue
 
             # Process messages
             for message in messages:
-                now = datetime.datetime.now()
-                messageBody = json.loads(message.body)
-                processingDuration = messageBody.get('duration')
-                logger.info('Time {} Processing message_id {} messageBody {}...'.format(now, message.message_id, messageBody))
-                time.sleep(processingDuration)
-
-                # Delete the message
-                message.delete()
-                now = datetime.datetime.now()
-
-                # Report message duration to cloudwatch
-                publishMetricValue(processingDuration)
+                future = executor.submit(processMessage, message, shutdown)
+                with inFlightLock:
+                    inFlight.add(future)
+                future.add_done_callback(finished)
+                submitted += 1
 
         except ClientError as error:
             logger.error('SQS Service Exception - Code: {}, Message: {}'.format(error.response['Error']['Code'],error.response['Error']['Message']))
@@ -102,3 +167,24 @@ if __name__=="__main__":
 
         except Exception as e:
             logger.error('Unexpected error - {}'.format(e))
+
+        finally:
+            # Hand back the messages that were never submitted, and return their workers
+            # along with the workers that received no message
+            if submitted < len(messages):
+                releaseMessages(messages[submitted:])
+            for _ in range(batchSize - submitted):
+                idleWorkers.release()
+
+    # Let in-flight messages finish or release them, then publish their durations
+    with inFlightLock:
+        pending = list(inFlight)
+    shutdown.drain(pending)
+    executor.shutdown(wait=True)
+    shutdown.restore()
+    metrics.close()
+    logger.info('Consumer stopped')
+
+
+if __name__=="__main__":
+    main()
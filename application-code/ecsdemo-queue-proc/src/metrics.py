@@ -0,0 +1,150 @@
+
+# Import modules
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+# CloudWatch PutMetricData limits
+MAX_VALUES_PER_DATUM = 150
+MAX_DATUMS_PER_CALL = 1000
+
+# Embedded Metric Format limit
+MAX_EMF_VALUES = 100
+
+
+class MetricPublisher:
+    """
+    Buffers the values of a single metric and publishes them from a background
+    thread every `flush_interval` seconds, instead of making one PutMetricData
+    call per value.
+
+    With `output='api'` each flush makes one PutMetricData call, with the values
+    packed into Values/Counts arrays. With `output='emf'` each flush prints the
+    values in CloudWatch Embedded Metric Format to stdout instead, for a log router
+    that extracts EMF, such as the CloudWatch agent or FireLens, to turn into
+    metrics without any API call from the task.
+    """
+
+    def __init__(self, cloudwatch, namespace, metric_name, dimensions,
+                 flush_interval=10, output='api'):
+        """
+        :param cloudwatch: The CloudWatch client used in 'api' mode.
+        :param namespace: The metric namespace.
+        :param metric_name: The metric name.
+        :param dimensions: A dict of dimension names to values.
+        :param flush_interval: Seconds between flushes.
+        :param output: 'api' or 'emf'.
+        """
+        if output not in ('api', 'emf'):
+            raise ValueError("Unknown metric output {}".format(output))
+        self.cloudwatch = cloudwatch
+        self.namespace = namespace
+        self.metric_name = metric_name
+        self.dimensions = dimensions
+        self.flush_interval = flush_interval
+        self.output = output
+
+        self._values = Counter()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start flushing every `flush_interval` seconds on a background thread.
+        """
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def record(self, value):
+        """
+        Buffer a value until the next flush. Thread safe.
+        """
+        with self._lock:
+            self._values[value] += 1
+
+    def close(self):
+        """
+        Stop the background thread and publish every buffered value.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """
+        Publish and clear the buffered values.
+        """
+        with self._lock:
+            values, self._values = self._values, Counter()
+        if not values:
+            return
+        try:
+            if self.output == 'emf':
+                self._write_emf(values)
+            else:
+                self._put_metric_data(values)
+        except ClientError as error:
+            logger.error('CloudWatch Service Exception - Code: {}, Message: {}'.format(error.response['Error']['Code'],error.response['Error']['Message']))
+            logger.error('Dropped {} {} values'.format(sum(values.values()), self.metric_name))
+        except BotoCoreError as error:
+            # Connection errors and timeouts are transient, so publish the values with the next flush
+            logger.error('CloudWatch connection error: {}'.format(error))
+            with self._lock:
+                self._values.update(values)
+        else:
+            logger.info('Published {} {} values'.format(sum(values.values()), self.metric_name))
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # Keep flushing, an unexpected error must not stop publishing for good
+                logger.exception('Could not publish {} values'.format(self.metric_name))
+
+    def _put_metric_data(self, values):
+        items = sorted(values.items())
+        datums = [
+            {
+                'MetricName': self.metric_name,
+                'Dimensions': [{'Name': name, 'Value': value} for name, value in self.dimensions.items()],
+                'Values': [value for value, _ in items[start:start + MAX_VALUES_PER_DATUM]],
+                'Counts': [float(count) for _, count in items[start:start + MAX_VALUES_PER_DATUM]],
+                'StorageResolution': 1
+            }
+            for start in range(0, len(items), MAX_VALUES_PER_DATUM)
+        ]
+        for start in range(0, len(datums), MAX_DATUMS_PER_CALL):
+            self.cloudwatch.put_metric_data(
+                Namespace=self.namespace,
+                MetricData=datums[start:start + MAX_DATUMS_PER_CALL]
+            )
+
+    def _write_emf(self, values):
+        expanded = list(values.elements())
+        for start in range(0, len(expanded), MAX_EMF_VALUES):
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(self.dimensions)],
+                        'Metrics': [{'Name': self.metric_name, 'StorageResolution': 1}]
+                    }]
+                },
+                self.metric_name: expanded[start:start + MAX_EMF_VALUES]
+            }
+            document.update(self.dimensions)
+            sys.stdout.write(json.dumps(document) + '\n')
+        sys.stdout.flush()
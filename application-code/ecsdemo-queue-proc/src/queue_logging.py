@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Structured, non-blocking logging for the queue processors. This file is shared by
+container-queue-proc and ecsdemo-queue-proc; keep both copies identical, since each
+image is built from its own folder.
+
+configure() routes every record through a QueueHandler, so the processing threads
+only enqueue records. A QueueListener thread renders them, including their lazy
+%-style arguments, as one JSON object per line. message_logger() returns a logger
+for per-message records that keeps only a sample of records below WARNING.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+# Attributes of every LogRecord. Anything else was passed through `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single-line JSON object with its time, level, logger,
+    message, any `extra` fields and any exception.
+    """
+
+    def format(self, record):
+        document = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                    .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records as they are. The default QueueHandler formats each record
+    before enqueueing it, which would keep the formatting cost on the logging
+    thread. Arguments must therefore not be mutated after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """
+    Passes every record at WARNING or above and a `rate` fraction of the others.
+    The sample is taken before a record is created, so records that are left out
+    cost no more than a disabled level.
+    """
+
+    def __init__(self, logger, rate):
+        super().__init__(logger, {})
+        self.rate = rate
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level) and (
+            level >= logging.WARNING or random.random() < self.rate
+        )
+
+    def process(self, msg, kwargs):
+        return msg, kwargs
+
+
+def configure(level=None, stream=None):
+    """
+    Replace the root logger's handlers with a queue handler whose listener writes
+    JSON lines to `stream`. Safe to call more than once.
+
+    :param level: The root log level. Defaults to LOG_LEVEL, else INFO.
+    :param stream: The stream to write to. Defaults to stderr.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+def shutdown():
+    """
+    Write every queued record and stop the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
+
+
+def message_logger(name, rate=None):
+    """
+    Get the logger for per-message records of the module `name`. Records below
+    WARNING are sampled.
+
+    :param name: The name of the module that logs.
+    :param rate: The fraction of records to keep. Defaults to LOG_SAMPLE_RATE, else 1.
+    :return: A SampledLogger for the `<name>.messages` logger.
+    """
+    if rate is None:
+        rate = float(os.environ.get('LOG_SAMPLE_RATE', '1'))
+    return SampledLogger(logging.getLogger(name + '.messages'), rate)
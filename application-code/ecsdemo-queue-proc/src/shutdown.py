@@ -0,0 +1,81 @@
+
+# Import modules
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import wait
+
+logger = logging.getLogger(__name__)
+
+
+class ShutdownCoordinator:
+    """
+    Turns SIGTERM, sent by ECS on scale-in or a Fargate Spot interruption, into a
+    graceful stop within the container's stop timeout.
+
+    Once a signal arrives `stopping` is set, so the consumer stops receiving. The
+    consumer then calls drain() with its in-flight work, which waits for that work
+    to finish until `drain_timeout` seconds after the signal, then sets `aborting`
+    so unfinished messages are released back to the queue instead of being held
+    until their visibility timeout expires.
+    """
+
+    def __init__(self, drain_timeout, stopping=None):
+        """
+        :param drain_timeout: Seconds after the signal that in-flight work may run.
+        :param stopping: An optional threading.Event to use as `stopping`, so the
+                         consumer can also be stopped without a signal.
+        """
+        self.drain_timeout = drain_timeout
+        self.stopping = stopping or threading.Event()
+        self.aborting = threading.Event()
+        self._stopped_at = None
+        self._previous_handlers = {}
+
+    def install(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        """
+        Handle `signals` until restore() is called. Signal handlers can only be set
+        from the main thread, so elsewhere this does nothing.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return self
+        for signum in signals:
+            self._previous_handlers[signum] = signal.signal(signum, self._on_signal)
+        return self
+
+    def restore(self):
+        """
+        Put back the signal handlers replaced by install().
+        """
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def _on_signal(self, signum, frame):
+        logger.info('Received %s, stopping within %s seconds', signal.Signals(signum).name, self.drain_timeout)
+        self._stopped_at = time.monotonic()
+        self.stopping.set()
+
+    def remaining(self):
+        """
+        :return: Seconds left to drain. Without a signal the full drain timeout.
+        """
+        if self._stopped_at is None:
+            return self.drain_timeout
+        return max(0.0, self._stopped_at + self.drain_timeout - time.monotonic())
+
+    def drain(self, futures):
+        """
+        Wait for `futures` to finish until the drain timeout expires, then set
+        `aborting` and wait for the rest to release their messages.
+
+        :param futures: The futures of the in-flight messages.
+        :return: The number of futures that did not finish in time.
+        """
+        _, pending = wait(futures, timeout=self.remaining())
+        if pending:
+            logger.warning('Releasing %s in-flight messages', len(pending))
+            self.aborting.set()
+            wait(pending)
+        return len(pending)
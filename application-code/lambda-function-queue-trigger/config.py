@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from botocore.exceptions import ClientError
+
+PARAMETER_NAMES = [
+    'PIPELINE_UNPROCESSED_SQS_URL',
+    'PIPELINE_ENABLED',
+    'PIPELINE_ECS_MAX_TASKS',
+    'PIPELINE_ECS_CLUSTER',
+    'PIPELINE_ECS_TASK_CONTAINER',
+    'PIPELINE_ECS_TASK_DEFINITION',
+    'PIPELINE_ECS_TASK_SECURITYGROUP',
+    'PIPELINE_ECS_TASK_SUBNET',
+    'PIPELINE_S3_DEST_PREFIX'
+]
+
+THROTTLING_ERRORS = ('ThrottlingException', 'Throttling', 'TooManyRequestsException')
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """
+    The pipeline settings held in SSM Parameter Store.
+    """
+    sqs_url: str
+    enabled: bool
+    max_tasks: int
+    cluster: str
+    container: str
+    # The task definition family, without the revision stored in SSM
+    task_definition: str
+    subnet: str
+    security_group: str
+    s3_dest_prefix: str
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Build the config from the parameters returned by ssm.get_parameters.
+        """
+        values = {param['Name']: param['Value'] for param in parameters}
+        missing = [name for name in PARAMETER_NAMES if not values.get(name)]
+        if missing:
+            raise Exception("Required SSM: " + ",".join(PARAMETER_NAMES) + ". Missing: " + ",".join(missing))
+        taskdef = values['PIPELINE_ECS_TASK_DEFINITION']
+        return cls(
+            sqs_url=values['PIPELINE_UNPROCESSED_SQS_URL'],
+            enabled=values['PIPELINE_ENABLED'] == "1",
+            max_tasks=int(values['PIPELINE_ECS_MAX_TASKS']),
+            cluster=values['PIPELINE_ECS_CLUSTER'],
+            container=values['PIPELINE_ECS_TASK_CONTAINER'],
+            task_definition=taskdef[:taskdef.rindex(':')] if ':' in taskdef else taskdef,
+            subnet=values['PIPELINE_ECS_TASK_SUBNET'],
+            security_group=values['PIPELINE_ECS_TASK_SECURITYGROUP'],
+            s3_dest_prefix=values['PIPELINE_S3_DEST_PREFIX']
+        )
+
+
+def load_config(ssm):
+    """
+    Read and parse the pipeline parameters with a single SSM call.
+    """
+    response = ssm.get_parameters(Names=PARAMETER_NAMES, WithDecryption=True)
+    return PipelineConfig.from_parameters(response['Parameters'])
+
+
+class ConfigCache:
+    """
+    Keeps the parsed config at module level, so warm invocations of the Lambda
+    reuse it instead of calling SSM.
+
+    The config is reloaded in a background thread once `refresh_after` seconds
+    have passed, so invocations don't wait for SSM, and synchronously once it is
+    `ttl` seconds old. If SSM throttles a reload, the cached config is served
+    until a later reload succeeds.
+    """
+
+    def __init__(self, load, ttl=300, refresh_after=240):
+        """
+        :param load: A function that returns a fresh config.
+        :param ttl: Seconds a config may be served without a successful reload.
+        :param refresh_after: Seconds after which a config is reloaded in the
+                              background.
+        """
+        self.load = load
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self._value = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def get(self):
+        """
+        :return: The cached config, loading it first if there is none or it has
+                 expired.
+        """
+        age = time.monotonic() - self._loaded_at
+        if self._value is None or age >= self.ttl:
+            refresher = self._refresher
+            if refresher is not None:
+                refresher.join()
+            if self._value is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._reload(serve_stale=self._value is not None)
+        elif age >= self.refresh_after:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._refresh, daemon=True)
+                    self._refresher.start()
+        return self._value
+
+    def invalidate(self):
+        """
+        Reload the config on the next get().
+        """
+        self._loaded_at = 0.0
+
+    def _refresh(self):
+        try:
+            self._reload(serve_stale=True)
+        except Exception as error:
+            print("Background config refresh failed: " + str(error))
+        finally:
+            self._refresher = None
+
+    def _reload(self, serve_stale):
+        try:
+            value = self.load()
+        except ClientError as error:
+            if serve_stale and error.response['Error']['Code'] in THROTTLING_ERRORS:
+                print("SSM throttled the config reload. Serving the cached config.")
+                return
+            raise
+        self._value = value
+        self._loaded_at = time.monotonic()
+        print("Loaded config: " + str(value))
+
+
+def cache_from_environment(ssm):
+    """
+    Build a ConfigCache for `ssm` with CONFIG_TTL_SECONDS (300 by default) and
+    CONFIG_REFRESH_SECONDS (80% of the TTL by default).
+    """
+    ttl = float(os.environ.get('CONFIG_TTL_SECONDS', '300'))
+    refresh_after = float(os.environ.get('CONFIG_REFRESH_SECONDS', str(ttl * 0.8)))
+    return ConfigCache(lambda: load_config(ssm), ttl=ttl, refresh_after=refresh_after)
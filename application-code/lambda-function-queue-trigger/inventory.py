@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The most tasks a single ecs.run_task call can start
+MAX_RUN_TASK_COUNT = 10
+
+
+class TaskInventory:
+    """
+    Counts the pipeline's tasks that are starting or running, and starts new ones.
+
+    Counting lists every page of tasks whose desired status is RUNNING. ECS never
+    sets a desired status of PENDING: tasks that are provisioning or pending have
+    a desired status of RUNNING, so they are included. ListTasks is eventually
+    consistent, so tasks this inventory started in the last `launch_grace`
+    seconds are counted even if they are not listed yet. Counts are cached for
+    `ttl` seconds.
+    """
+
+    def __init__(self, ecs, ttl=10, launch_grace=60):
+        """
+        :param ecs: The ECS client.
+        :param ttl: Seconds a count is reused for.
+        :param launch_grace: Seconds a started task is counted without being listed.
+        """
+        self.ecs = ecs
+        self.ttl = ttl
+        self.launch_grace = launch_grace
+        self._cached = {}
+        self._launched = {}
+        self._lock = threading.Lock()
+
+    def list_task_arns(self, cluster, family):
+        """
+        :return: The set of ARNs of tasks with a desired status of RUNNING, whatever
+                 their last status: PROVISIONING, PENDING, ACTIVATING or RUNNING.
+        """
+        arns = set()
+        paginator = self.ecs.get_paginator('list_tasks')
+        for page in paginator.paginate(cluster=cluster, family=family, desiredStatus='RUNNING'):
+            arns.update(page['taskArns'])
+        return arns
+
+    def count(self, cluster, family):
+        """
+        :return: The number of tasks of `family` in `cluster` that are starting or running.
+        """
+        key = (cluster, family)
+        now = time.monotonic()
+        cached = self._cached.get(key)
+        if cached is None or now - cached[0] >= self.ttl:
+            cached = (now, self.list_task_arns(cluster, family))
+            self._cached[key] = cached
+        with self._lock:
+            recent = {
+                arn for arn, launched_at in self._launched.items()
+                if now - launched_at < self.launch_grace
+            }
+            self._launched = {arn: self._launched[arn] for arn in recent}
+        return len(cached[1] | recent)
+
+    def run_tasks(self, count, cluster, **run_task_args):
+        """
+        Start `count` tasks with concurrent run_task calls of up to 10 tasks each.
+
+        :param count: The number of tasks to start.
+        :param cluster: The cluster to start them in.
+        :param run_task_args: Every other run_task argument. The `base` of a
+                              capacity provider strategy only applies to the
+                              first call, so it is not repeated per call.
+        :return: The ARNs of the started tasks.
+        """
+        chunks = [
+            min(MAX_RUN_TASK_COUNT, count - start)
+            for start in range(0, count, MAX_RUN_TASK_COUNT)
+        ]
+
+        def run(index, chunk):
+            args = dict(run_task_args, cluster=cluster, count=chunk)
+            if index > 0 and 'capacityProviderStrategy' in args:
+                args['capacityProviderStrategy'] = [
+                    dict(provider, base=0) for provider in args['capacityProviderStrategy']
+                ]
+            response = self.ecs.run_task(**args)
+            for failure in response.get('failures', []):
+                print("Task failed to start: " + str(failure))
+            return [task['taskArn'] for task in response.get('tasks', [])]
+
+        if not chunks:
+            return []
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            started = [arn for arns in executor.map(run, range(len(chunks)), chunks) for arn in arns]
+
+        now = time.monotonic()
+        with self._lock:
+            self._launched.update((arn, now) for arn in started)
+        self._cached.clear()
+        return started
+
+
+def inventory_from_environment(ecs):
+    """
+    Build a TaskInventory for `ecs` with TASK_COUNT_TTL_SECONDS (10 by default).
+    """
+    return TaskInventory(ecs, ttl=float(os.environ.get('TASK_COUNT_TTL_SECONDS', '10')))
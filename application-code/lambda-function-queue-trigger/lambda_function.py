@@ -1,85 +1,61 @@
 import boto3
-from math import ceil
+import time
+
+from config import cache_from_environment
+from inventory import inventory_from_environment
+from scaling import QueueState, fetch_rates, policy_from_environment
 
 sqs = boto3.client('sqs')
 ecs = boto3.client('ecs')
 ssm = boto3.client('ssm')
+cloudwatch = boto3.client('cloudwatch')
 
 batch_size = 10
 max_tasks_per_run = 100
 
+# Kept across warm invocations
+config_cache = cache_from_environment(ssm)
+task_inventory = inventory_from_environment(ecs)
+scaling_policy = policy_from_environment(batch_size)
+
 
 def lambda_handler(event, context):
-    max_tasks = None
-    sqs_url = None
-    pipeline_enabled = None
-    TASK_CLUSTER = None
-    TASK_CONTAINER = None
-    TASK_DEFINITION = None
-    TASK_SUBNET = None
-    TASK_SECURITYGROUP = None
-    response = ssm.get_parameters(
-        Names=[
-            'PIPELINE_UNPROCESSED_SQS_URL',
-            'PIPELINE_ENABLED',
-            'PIPELINE_ECS_MAX_TASKS',
-            'PIPELINE_ECS_CLUSTER',
-            'PIPELINE_ECS_TASK_CONTAINER',
-            'PIPELINE_ECS_TASK_DEFINITION',
-            'PIPELINE_ECS_TASK_SECURITYGROUP',
-            'PIPELINE_ECS_TASK_SUBNET',
-            'PIPELINE_S3_DEST_PREFIX'
-        ],
-        WithDecryption=True
-    )
-    params = response['Parameters']
-    print("SSM Params: " + str(params))
-    for param in params:
-        if param['Name'] == 'PIPELINE_UNPROCESSED_SQS_URL':
-            sqs_url = param['Value']
-        if param['Name'] == 'PIPELINE_ECS_MAX_TASKS':
-            max_tasks = param['Value']
-        if param['Name'] == 'PIPELINE_ENABLED':
-            pipeline_enabled = param['Value']
-        if param['Name'] == 'PIPELINE_ECS_CLUSTER':
-            TASK_CLUSTER = param['Value']
-        if param['Name'] == 'PIPELINE_ECS_TASK_CONTAINER':
-            TASK_CONTAINER = param['Value']
-        if param['Name'] == 'PIPELINE_ECS_TASK_DEFINITION':
-            taskdef = param['Value']
-            TASK_DEFINITION = taskdef[:taskdef.rindex(':')]
-        if param['Name'] == 'PIPELINE_ECS_TASK_SUBNET':
-            TASK_SUBNET = param['Value']
-        if param['Name'] == 'PIPELINE_ECS_TASK_SECURITYGROUP':
-            TASK_SECURITYGROUP = param['Value']
-        if param['Name'] == 'PIPELINE_S3_DEST_PREFIX':
-            S3_DEST_PREFIX = param['Value']
-    if (sqs_url and pipeline_enabled and max_tasks and
-        TASK_CLUSTER and TASK_CONTAINER and TASK_DEFINITION and TASK_SUBNET and TASK_SECURITYGROUP):
-        max_tasks = int(max_tasks)
-    else:
-        raise Exception("Required SSM: PIPELINE_ECS_MAX_TASKS,PIPELINE_UNPROCESSED_SQS_URL,PIPELINE_ENABLED,PIPELINE_ECS_CLUSTER,"
-            "PIPELINE_ECS_TASK_CONTAINER,PIPELINE_ECS_TASK_DEFINITION,PIPELINE_ECS_TASK_SUBNET,PIPELINE_ECS_TASK_SECURITYGROUP,PIPELINE_S3_DEST_PREFIX")
-    if (pipeline_enabled != "1"):
+    config = config_cache.get()
+    if not config.enabled:
         print("ECS Pipeline is Disabled. Not starting tasks via Lambda.")
         return
     sqs_response = sqs.get_queue_attributes(
-        QueueUrl=sqs_url,
-        AttributeNames=['ApproximateNumberOfMessages']
+        QueueUrl=config.sqs_url,
+        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
     )
     sqs_queue_size = int(sqs_response['Attributes']['ApproximateNumberOfMessages'])
-    print("Current SQS Queue size: " + str(sqs_queue_size))
+    sqs_in_flight = int(sqs_response['Attributes']['ApproximateNumberOfMessagesNotVisible'])
+    print("Current SQS Queue size: " + str(sqs_queue_size) + ", in flight: " + str(sqs_in_flight))
     if sqs_queue_size == 0:
         return
-    ecs_response = ecs.list_tasks(
-        cluster=TASK_CLUSTER, maxResults=100, desiredStatus='RUNNING', family=TASK_CONTAINER)
-    current_running_tasks = len(ecs_response["taskArns"])
-    available_tasks = max_tasks - current_running_tasks
-    tasks_to_start = min([ceil(sqs_queue_size / batch_size), available_tasks, max_tasks_per_run, max_tasks])
+    current_running_tasks = task_inventory.count(config.cluster, config.container)
+    print("ECS Tasks pending or running: " + str(current_running_tasks))
+    arrival_rate, completion_rate, arrival_trend = None, None, 0.0
+    if scaling_policy.needs_rates:
+        arrival_rate, completion_rate, arrival_trend = fetch_rates(cloudwatch, config.sqs_url.rsplit('/', 1)[-1])
+        print("SQS arrival rate: " + str(arrival_rate) + "/s, completion rate: " + str(completion_rate) + "/s")
+    desired_tasks = scaling_policy.desired_tasks(QueueState(
+        visible=sqs_queue_size,
+        in_flight=sqs_in_flight,
+        running_tasks=current_running_tasks,
+        arrival_rate=arrival_rate,
+        completion_rate=completion_rate,
+        arrival_trend=arrival_trend,
+        timestamp=time.time()
+    ))
+    available_tasks = config.max_tasks - current_running_tasks
+    tasks_to_start = min([desired_tasks - current_running_tasks, available_tasks, max_tasks_per_run])
     print("ECS Tasks to start: " + str(tasks_to_start))
     if tasks_to_start <= 0:
         return
-    run_task_response = ecs.run_task(
+    started_tasks = task_inventory.run_tasks(
+        tasks_to_start,
+        config.cluster,
         capacityProviderStrategy=[
             {
                 'capacityProvider': 'FARGATE',
@@ -91,33 +67,32 @@ def lambda_handler(event, context):
                 'base': 0
             }
         ],
-        cluster=TASK_CLUSTER,
-        taskDefinition=TASK_DEFINITION,
+        taskDefinition=config.task_definition,
         overrides={
             'containerOverrides': [
                 {
-                    'name': TASK_CONTAINER,
+                    'name': config.container,
                     'environment': [
                         {
                             'name': 'PIPELINE_ECS_JOB_MODE',
                             'value': '1'
                         }, {
                             'name': 'PIPELINE_S3_DEST_PREFIX',
-                            'value': S3_DEST_PREFIX
+                            'value': config.s3_dest_prefix
                         }
                     ]
                 }
             ]
         },
-        count=tasks_to_start,
         # launchType='FARGATE',
         networkConfiguration={
             'awsvpcConfiguration': {
-                'subnets': [TASK_SUBNET],
-                'securityGroups': [TASK_SECURITYGROUP],
+                'subnets': [config.subnet],
+                'securityGroups': [config.security_group],
                 'assignPublicIp': 'DISABLED'
             }
         },
         propagateTags='TASK_DEFINITION'
     )
-    return tasks_to_start
+    print("ECS Tasks started: " + str(len(started_tasks)))
+    return len(started_tasks)
@@ -0,0 +1,218 @@
+import math
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class QueueState:
+    """
+    What a scaling policy sees on each run. Rates are in messages per second and
+    are None when they are unknown.
+    """
+    visible: int
+    in_flight: int
+    running_tasks: int
+    arrival_rate: Optional[float] = None
+    completion_rate: Optional[float] = None
+    # Change of the arrival rate, in messages per second per second
+    arrival_trend: float = 0.0
+    # Seconds, on any clock that only moves forward
+    timestamp: float = 0.0
+
+
+def task_throughput(state, default):
+    """
+    :return: The messages per second one task processes, as measured over the
+             recent completions of the running tasks, else `default`.
+    """
+    if state.completion_rate and state.running_tasks > 0:
+        return state.completion_rate / state.running_tasks
+    return default
+
+
+class ProportionalPolicy:
+    """
+    Starts one task for every `messages_per_task` visible messages, on top of the
+    tasks already running. This is the trigger's original rule.
+    """
+    needs_rates = False
+
+    def __init__(self, messages_per_task=10):
+        self.messages_per_task = messages_per_task
+
+    def desired_tasks(self, state):
+        return state.running_tasks + math.ceil(state.visible / self.messages_per_task)
+
+
+class PredictivePolicy:
+    """
+    Sizes the fleet to drain the backlog, and the arrivals projected from the
+    recent arrival rate and its trend, within `target_latency` seconds of tasks
+    becoming ready. Running tasks are credited with the work they finish while
+    new tasks start, and the fleet is never sized below the projected arrival
+    rate.
+    """
+    needs_rates = True
+
+    def __init__(self, target_latency, default_throughput, startup_seconds=60):
+        """
+        :param target_latency: Seconds in which the backlog should drain.
+        :param default_throughput: Messages per second per task, used until a
+                                   completion rate has been measured.
+        :param startup_seconds: Seconds from run_task to a task processing messages.
+        """
+        self.target_latency = target_latency
+        self.default_throughput = default_throughput
+        self.startup_seconds = startup_seconds
+
+    def desired_tasks(self, state):
+        per_task = task_throughput(state, self.default_throughput)
+        horizon = max(1.0, self.target_latency - self.startup_seconds)
+        arrival_rate = max(0.0, (state.arrival_rate or 0.0)
+                           + state.arrival_trend * (self.startup_seconds + horizon / 2))
+        backlog = max(0.0, state.visible + state.in_flight
+                      + (arrival_rate - state.running_tasks * per_task) * self.startup_seconds)
+        drain = math.ceil((backlog + arrival_rate * horizon) / (per_task * horizon))
+        return max(drain, math.ceil(arrival_rate / per_task))
+
+
+class PidPolicy:
+    """
+    Adjusts the fleet with a PID controller on the gap between the running tasks
+    and the tasks needed to drain the backlog within `target_latency` seconds.
+    The integral and the previous error are kept on the instance, so they carry
+    over between warm invocations.
+    """
+    needs_rates = True
+
+    def __init__(self, target_latency, default_throughput, kp=1.0, ki=0.002, kd=0.0,
+                 integral_limit=600.0):
+        """
+        :param target_latency: Seconds in which the backlog should drain.
+        :param default_throughput: Messages per second per task, used until a
+                                   completion rate has been measured.
+        :param kp: Proportional gain, in tasks per task of error.
+        :param ki: Integral gain, per second.
+        :param kd: Derivative gain, in seconds.
+        :param integral_limit: Bound on the integral, in task-seconds, against windup.
+        """
+        self.target_latency = target_latency
+        self.default_throughput = default_throughput
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.integral_limit = integral_limit
+        self._integral = 0.0
+        self._previous = None
+
+    def desired_tasks(self, state):
+        per_task = task_throughput(state, self.default_throughput)
+        needed = (state.visible + state.in_flight) / (per_task * self.target_latency)
+        error = needed - state.running_tasks
+        derivative = 0.0
+        if self._previous is not None:
+            previous_error, previous_timestamp = self._previous
+            elapsed = state.timestamp - previous_timestamp
+            if elapsed > 0:
+                self._integral = min(self.integral_limit, max(
+                    -self.integral_limit, self._integral + error * elapsed))
+                derivative = (error - previous_error) / elapsed
+        self._previous = (error, state.timestamp)
+        output = state.running_tasks + self.kp * error + self.ki * self._integral + self.kd * derivative
+        return max(0, math.ceil(output))
+
+
+POLICIES = {
+    'proportional': ProportionalPolicy,
+    'predictive': PredictivePolicy,
+    'pid': PidPolicy,
+}
+
+
+def policy_from_environment(messages_per_task):
+    """
+    Build the policy named by SCALING_POLICY (proportional by default).
+
+    The predictive and PID policies read TARGET_LATENCY_SECONDS (300 by default)
+    and TASK_THROUGHPUT, the messages per second one task processes (1 by
+    default). The predictive policy also reads TASK_STARTUP_SECONDS (60 by
+    default), and the PID policy PID_KP, PID_KI and PID_KD.
+    """
+    name = os.environ.get('SCALING_POLICY', 'proportional')
+    if name not in POLICIES:
+        raise Exception("Unknown SCALING_POLICY " + name + ". Use one of: " + ",".join(POLICIES))
+    if name == 'proportional':
+        return ProportionalPolicy(messages_per_task)
+    target_latency = float(os.environ.get('TARGET_LATENCY_SECONDS', '300'))
+    default_throughput = float(os.environ.get('TASK_THROUGHPUT', '1'))
+    if name == 'predictive':
+        return PredictivePolicy(target_latency, default_throughput,
+                                startup_seconds=float(os.environ.get('TASK_STARTUP_SECONDS', '60')))
+    return PidPolicy(target_latency, default_throughput,
+                     kp=float(os.environ.get('PID_KP', '1.0')),
+                     ki=float(os.environ.get('PID_KI', '0.002')),
+                     kd=float(os.environ.get('PID_KD', '0.0')))
+
+
+def linear_trend(points):
+    """
+    :param points: A list of (seconds, value) pairs.
+    :return: The least-squares slope of value over seconds, or 0 for fewer than
+             two points.
+    """
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def fetch_rates(cloudwatch, queue_name, window=600, now=None):
+    """
+    Read the recent arrival and completion rates of a queue from its
+    NumberOfMessagesSent and NumberOfMessagesDeleted metrics, in one
+    GetMetricData call with one-minute periods.
+
+    :param cloudwatch: The CloudWatch client.
+    :param queue_name: The queue name.
+    :param window: Seconds of history to average over.
+    :return: The arrival rate, completion rate and arrival trend. The rates are
+             None when the queue has no datapoints in the window.
+    """
+    now = now or datetime.now(timezone.utc)
+    queries = [
+        {
+            'Id': query_id,
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': 'AWS/SQS',
+                    'MetricName': metric_name,
+                    'Dimensions': [{'Name': 'QueueName', 'Value': queue_name}]
+                },
+                'Period': 60,
+                'Stat': 'Sum'
+            }
+        }
+        for query_id, metric_name in (('sent', 'NumberOfMessagesSent'), ('deleted', 'NumberOfMessagesDeleted'))
+    ]
+    response = cloudwatch.get_metric_data(
+        MetricDataQueries=queries,
+        StartTime=now - timedelta(seconds=window),
+        EndTime=now
+    )
+    series = {result['Id']: list(zip(result['Timestamps'], result['Values']))
+              for result in response['MetricDataResults']}
+
+    def rate(points):
+        if not points:
+            return None
+        return sum(value for _, value in points) / 60 / len(points)
+
+    arrivals = series.get('sent', [])
+    trend = linear_trend([(timestamp.timestamp(), value / 60) for timestamp, value in arrivals])
+    return rate(arrivals), rate(series.get('deleted', [])), trend
@@ -1,10 +1,12 @@
 
 import boto3
 import os
-import struct
 import json
 import logging
+import time
 from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from loadgen import BATCH_SIZE, LoadStats, build_entries, build_profile, run, send_batch
 
 # Create logger
 logging.basicConfig(level=logging.INFO)
@@ -15,35 +17,83 @@ config = Config(
    retries = {
       'max_attempts': 10,
       'mode': 'standard'
-   }
+   },
+   max_pool_connections = 50
 )
 
 # Define session and resources
 session = boto3.Session()
-sqs = session.resource('sqs', config=config)
+sqs = session.client('sqs', config=config)
 
 # Read  environment variables
 queue_name = os.environ['queue_name']
 default_msg_proc_duration = int(os.environ['default_msg_proc_duration'])
 number_of_messages = int(os.environ['number_of_messages'])
+# Threads sending batches
+send_workers = int(os.environ.get('send_workers', '16'))
+# Load generator settings, each of which the invocation event can override.
+# Without a load_profile each invocation sends number_of_messages at once.
+load_settings = {
+    'load_profile': os.environ.get('load_profile', ''),
+    'rate': float(os.environ.get('load_rate', '10')),
+    'duration': float(os.environ.get('load_duration', '50')),
+    'start_rate': float(os.environ.get('load_start_rate', '0')),
+    'steps': os.environ.get('load_steps', ''),
+    'burst_rate': float(os.environ.get('load_burst_rate', '0')) or None,
+    'burst_interval': float(os.environ.get('load_burst_interval', '60')),
+    'burst_seconds': float(os.environ.get('load_burst_seconds', '10')),
+}
 
+# Queue URL, kept between warm invocations
+queue_url = None
 
-def lambda_handler(event, context):
 
-    # Get the queue
-    queue = sqs.get_queue_by_name(QueueName=queue_name)
+def get_queue_url():
+
+    global queue_url
+    if queue_url is None:
+        queue_url = sqs.get_queue_url(QueueName=queue_name)['QueueUrl']
+    return queue_url
+
+
+def send_messages(count):
+
+    # Send count messages at once, 10 per call
+    stats = LoadStats()
+    started = time.monotonic()
+
+    def send(size):
+        latencies, failed = send_batch(sqs, get_queue_url(), build_entries(size, default_msg_proc_duration))
+        stats.record(size - failed, failed, latencies)
+
+    with ThreadPoolExecutor(max_workers=send_workers) as executor:
+        for sent in range(0, count, BATCH_SIZE):
+            executor.submit(send, min(BATCH_SIZE, count - sent))
+    return stats.summary(count, time.monotonic() - started)
+
+
+def lambda_handler(event, context):
 
-    # Send N messages
-    for i in range(number_of_messages):
+    settings = dict(load_settings)
+    settings.update((key, value) for key, value in (event or {}).items() if key in load_settings)
 
-        # Build Msg body
-        randomNumber = struct.unpack('H', os.urandom(2))[0]
-        messageBody = {"id": randomNumber, "duration": default_msg_proc_duration}
-        print('Sending message id: {}'.format(randomNumber))
+    if not settings['load_profile']:
+        summary = send_messages(number_of_messages)
+    else:
+        # Stop sending in time to report before the function times out
+        duration = settings['duration']
+        if context is not None:
+            duration = min(duration, context.get_remaining_time_in_millis() / 1000.0 - 5)
+        steps = settings['steps']
+        if isinstance(steps, str):
+            steps = [float(value) for value in steps.split(',') if value]
+        rate_at = build_profile(settings['load_profile'], float(settings['rate']), duration,
+                                start_rate=float(settings['start_rate']), steps=steps,
+                                burst_rate=float(settings['burst_rate']) if settings['burst_rate'] else None,
+                                burst_interval=float(settings['burst_interval']),
+                                burst_seconds=float(settings['burst_seconds']))
+        summary = run(sqs, get_queue_url(), rate_at, duration, default_msg_proc_duration, workers=send_workers)
+        summary['profile'] = settings['load_profile']
 
-        # Call API
-        response = queue.send_message(
-            MessageBody=json.dumps(messageBody),
-            MessageGroupId=str(messageBody['id']),
-            MessageDeduplicationId=str(messageBody['id']) + ':' + str(randomNumber),
-        )
+    print('Load summary: {}'.format(json.dumps(summary)))
+    return summary
@@ -0,0 +1,223 @@
+
+# Open-loop load generator for the processing queue: messages are sent with
+# send_message_batch, 10 per call, from a thread pool, at the rate a profile
+# gives for each second of the run
+
+import argparse
+import boto3
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Most entries send_message_batch accepts
+BATCH_SIZE = 10
+# Seconds between pacing steps
+STEP = 0.05
+
+PROFILES = ('constant', 'ramp', 'step', 'poisson')
+
+
+def build_profile(profile, rate, duration, start_rate=0.0, steps=None, burst_rate=None,
+                  burst_interval=60.0, burst_seconds=10.0, seed=None):
+    """
+    Return a function of the seconds since the start of the run giving the target
+    rate in messages per second.
+
+    :param profile: 'constant' sends `rate`. 'ramp' goes linearly from
+        `start_rate` to `rate` over `duration`. 'step' splits `duration` evenly
+        between the rates in `steps`. 'poisson' sends `rate`, plus bursts of
+        `burst_rate` lasting `burst_seconds` that start as a Poisson process
+        every `burst_interval` seconds on average.
+    """
+    if profile not in PROFILES:
+        raise ValueError('Unknown load profile {}. Use one of: {}'.format(profile, ', '.join(PROFILES)))
+    if duration <= 0:
+        raise ValueError('Load duration must be positive, got {}'.format(duration))
+    if profile == 'constant':
+        return lambda elapsed: rate
+    if profile == 'ramp':
+        return lambda elapsed: start_rate + (rate - start_rate) * min(1.0, elapsed / duration)
+    if profile == 'step':
+        steps = steps or [rate]
+        step_seconds = duration / len(steps)
+        return lambda elapsed: steps[min(len(steps) - 1, int(elapsed // step_seconds))]
+    if profile == 'poisson':
+        generator = random.Random(seed)
+        bursts = []
+        start = generator.expovariate(1.0 / burst_interval)
+        while start < duration:
+            bursts.append(start)
+            start += generator.expovariate(1.0 / burst_interval)
+        peak = rate * 10 if burst_rate is None else burst_rate
+        return lambda elapsed: peak if any(start <= elapsed < start + burst_seconds for start in bursts) else rate
+
+
+def build_entries(count, duration):
+    """
+    Build `count` batch entries. The queue is FIFO: each message gets its own
+    group, as the producer always did, and a unique deduplication id.
+    """
+    entries = []
+    for i in range(count):
+        random_number = struct.unpack('H', os.urandom(2))[0]
+        message_body = {"id": random_number, "duration": duration}
+        entries.append({
+            'Id': str(i),
+            'MessageBody': json.dumps(message_body),
+            'MessageGroupId': str(message_body['id']),
+            'MessageDeduplicationId': uuid.uuid4().hex,
+        })
+    return entries
+
+
+class LoadStats:
+    """
+    Messages sent and failed, and the latency of each send_message_batch call,
+    updated from the sending threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.calls = 0
+        self.latencies = []
+
+    def record(self, sent, failed, latencies):
+        with self.lock:
+            self.sent += sent
+            self.failed += failed
+            self.calls += len(latencies)
+            self.latencies.extend(latencies)
+
+    def summary(self, target, elapsed):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(math.ceil(p / 100.0 * len(latencies))) - 1)] * 1000, 1)
+
+        return {
+            'target_messages': target,
+            'sent': self.sent,
+            'failed': self.failed,
+            'calls': self.calls,
+            'seconds': round(elapsed, 2),
+            'achieved_rate': round(self.sent / elapsed, 1) if elapsed > 0 else None,
+            'latency_ms': {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+                           'max': percentile(100)},
+        }
+
+
+def send_batch(sqs, queue_url, entries, attempts=3):
+    """
+    Send up to 10 entries, retrying the ones SQS failed on its side. Return the
+    latency of each call and the number of messages that weren't sent.
+    """
+    latencies = []
+    failed = 0
+    for attempt in range(attempts):
+        started = time.monotonic()
+        try:
+            response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except Exception as e:
+            latencies.append(time.monotonic() - started)
+            print('send_message_batch failed: {}'.format(e))
+            failed += len(entries)
+            entries = []
+            break
+        latencies.append(time.monotonic() - started)
+        by_id = {entry['Id']: entry for entry in entries}
+        rejected = [failure for failure in response.get('Failed', []) if failure.get('SenderFault')]
+        if rejected:
+            print('Messages rejected: {}'.format(rejected))
+        # Rejections are final, so they count on every attempt; only SQS's own failures are retried
+        failed += len(rejected)
+        entries = [by_id[failure['Id']] for failure in response.get('Failed', []) if not failure.get('SenderFault')]
+        if not entries:
+            break
+    failed += len(entries)
+    return latencies, failed
+
+
+def run(sqs, queue_url, rate_at, duration, message_duration, workers=16, max_batch_delay=1.0):
+    """
+    Send messages at the target rate for `duration` seconds and return a summary
+    with the achieved rate and the send latency percentiles.
+
+    Sending is open loop: messages owed by the profile accumulate while the
+    threads are busy, so a rate the queue can't take shows up as an achieved
+    rate below the target rather than a slower schedule.
+    """
+    stats = LoadStats()
+    # At most two batches waiting per thread, so a slow queue doesn't buffer the whole run
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def send(count):
+        try:
+            entries = build_entries(count, message_duration)
+            latencies, failed = send_batch(sqs, queue_url, entries)
+            stats.record(count - failed, failed, latencies)
+        finally:
+            slots.release()
+
+    target = 0.0
+    owed = 0.0
+    last = 0.0
+    last_flush = 0.0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while last < duration:
+            time.sleep(STEP)
+            # Messages owed since the last step, however long it took
+            elapsed = min(duration, time.monotonic() - start)
+            due = rate_at(last) * (elapsed - last)
+            target += due
+            owed += due
+            last = elapsed
+            # Full batches go straight away, a partial one after max_batch_delay or at the end
+            while owed >= BATCH_SIZE or (owed >= 1 and (elapsed - last_flush >= max_batch_delay or elapsed >= duration)):
+                count = min(BATCH_SIZE, int(owed))
+                slots.acquire()
+                executor.submit(send, count)
+                owed -= count
+                last_flush = elapsed
+    return stats.summary(int(target), time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send messages to the processing queue at a target rate.')
+    parser.add_argument('--queue-name', required=True)
+    parser.add_argument('--profile', choices=PROFILES, default='constant')
+    parser.add_argument('--rate', type=float, default=10, help='Messages per second, or the ramp and burst baseline.')
+    parser.add_argument('--start-rate', type=float, default=0.0, help='Starting rate of the ramp profile.')
+    parser.add_argument('--steps', default=None, help='Comma-separated rates of the step profile.')
+    parser.add_argument('--burst-rate', type=float, default=None,
+                        help='Rate during poisson bursts. Defaults to 10 times --rate.')
+    parser.add_argument('--burst-interval', type=float, default=60.0, help='Mean seconds between bursts.')
+    parser.add_argument('--burst-seconds', type=float, default=10.0)
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds to send for.')
+    parser.add_argument('--message-duration', type=int, default=5,
+                        help='Processing duration carried in each message, in seconds.')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    sqs = boto3.client('sqs')
+    queue_url = sqs.get_queue_url(QueueName=args.queue_name)['QueueUrl']
+    steps = [float(value) for value in args.steps.split(',')] if args.steps else None
+    rate_at = build_profile(args.profile, args.rate, args.duration, start_rate=args.start_rate, steps=steps,
+                           burst_rate=args.burst_rate, burst_interval=args.burst_interval,
+                           burst_seconds=args.burst_seconds, seed=args.seed)
+    print(json.dumps(run(sqs, queue_url, rate_at, args.duration, args.message_duration, workers=args.workers)))
+
+
+if __name__ == '__main__':
+    main()
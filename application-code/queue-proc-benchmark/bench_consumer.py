@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Measure the throughput and latency of the ecsdemo-queue-proc consumer against
+in-process SQS and CloudWatch stand-ins provided by moto. Every message asks the
+consumer to work for --duration seconds, as the message-producer Lambda does.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_consumer.py --messages 100 --duration 0.05 --rate 50
+"""
+import argparse
+import os
+import threading
+import time
+
+for name, value in (('queue_name', 'bench-consumer-queue'), ('app_metric_name', 'MsgProcessingDuration'),
+                    ('metric_type', 'Single-Queue'), ('metric_namespace', 'ECS-SQS-BPI')):
+    os.environ.setdefault(name, value)
+
+import harness  # noqa: E402
+
+
+def run(app, recorder, queue, args, concurrency):
+    """
+    Feed the queue, run the consumer until every message has been deleted and
+    return the result record.
+    """
+    app.max_concurrency = concurrency
+    recorder.reset()
+    sampler = harness.ResourceSampler().start()
+    stop = threading.Event()
+    consumer = threading.Thread(target=app.main, args=(stop,), daemon=True)
+    started = time.time()
+    harness.Producer(
+        queue, lambda ind: {'id': ind, 'duration': args.duration}, args.messages, args.rate
+    ).start()
+    consumer.start()
+    if not recorder.wait_for(args.messages, args.timeout):
+        raise RuntimeError("Processed {} of {} messages".format(len(recorder.deleted), args.messages))
+    sampler.stop()
+    stop.set()
+    consumer.join()
+    return harness.summarize('concurrency {}'.format(concurrency), {'max_concurrency': concurrency},
+                             recorder, sampler, args.messages, started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100, help="Messages per run.")
+    parser.add_argument('--duration', type=float, default=0.05,
+                        help="Processing time requested by each message, in seconds.")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="Messages sent per second. 0 preloads the queue.")
+    parser.add_argument('--concurrency', default='1,10',
+                        help="Comma-separated max_concurrency values to run with.")
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--output', default=None,
+                        help="JSON results path. Defaults to results/consumer-<commit>.json.")
+    args = parser.parse_args()
+
+    recorder = harness.MessageRecorder()
+    mock = harness.start_fakes()
+    app = harness.import_worker(os.path.join('ecsdemo-queue-proc', 'src'))
+    queue = app.sqs.create_queue(QueueName=app.queue_name)
+
+    results = [
+        run(app, recorder, queue, args, int(concurrency))
+        for concurrency in args.concurrency.split(',')
+    ]
+
+    mock.stop()
+    harness.write_results('consumer', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Measure the logging overhead the queue workers add to every message, comparing
+the original pattern (eager str.format with datetime.now(), written synchronously
+by basicConfig's handler) with queue_logging (lazy %-style arguments, a queue
+handler drained by a listener thread, sampled per-message records and level
+gating).
+
+For each variant it reports the time spent on the logging thread per message and
+the total time per message once every record has been written. Records are
+written to /dev/null, so the numbers exclude the cost of the log destination.
+
+Usage:
+    python bench_logging.py --messages 100000 --sample-rate 0.01
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'ecsdemo-queue-proc', 'src'))
+
+import queue_logging  # noqa: E402
+
+BODY = json.dumps({'id': 12345, 'duration': 0.05, 'bench_sent_at': 1700000000.0, 'payload': 'x' * 512})
+
+
+class FakeMessage:
+    message_id = '6a1f0f3e-9b7c-4d9b-8f1e-3c2a5d4b7e90'
+    body = BODY
+
+
+def log_before(logger, message):
+    now = datetime.datetime.now()
+    body = json.loads(message.body)
+    logger.info('Time {} Processing message_id {} messageBody {}...'.format(now, message.message_id, body))
+    now = datetime.datetime.now()
+    logger.info('Time {} publishMetricValue with metric_namespace {} app_metric_name {} metricValue {} metric_type {} queue_name {}'.format(
+        now, 'ECS-SQS-BPI', 'MsgProcessingDuration', body.get('duration'), 'Single-Queue', 'ecsdemo-queue'))
+
+
+def log_after(logger, message):
+    body = json.loads(message.body)
+    logger.info('Processing message_id %s messageBody %s...', message.message_id, message.body)
+    logger.debug('publishMetricValue with metric_namespace %s app_metric_name %s metricValue %s metric_type %s queue_name %s',
+                 'ECS-SQS-BPI', 'MsgProcessingDuration', body.get('duration'), 'Single-Queue', 'ecsdemo-queue')
+
+
+def parse_only(_logger, message):
+    json.loads(message.body)
+
+
+def reset_root():
+    queue_logging.shutdown()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+
+def run(label, log, logger, count, finish):
+    message = FakeMessage()
+    started = time.perf_counter()
+    for _ in range(count):
+        log(logger, message)
+    logged = time.perf_counter()
+    finish()
+    finished = time.perf_counter()
+    return {
+        'label': label,
+        'messages': count,
+        'logging_thread_us_per_message': round((logged - started) / count * 1e6, 3),
+        'total_us_per_message': round((finished - started) / count * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--sample-rate', type=float, default=0.01,
+                        help="LOG_SAMPLE_RATE of the sampled variant.")
+    parser.add_argument('--output', default=None,
+                        help="JSON results path. Defaults to results/logging-<commit>.json.")
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, 'w')
+    results = []
+
+    reset_root()
+    results.append(run('no logging', parse_only, None, args.messages, lambda: None))
+
+    logging.basicConfig(level=logging.INFO, stream=devnull)
+    results.append(run('before: format, sync', log_before, logging.getLogger(), args.messages,
+                       devnull.flush))
+
+    for label, level, rate in (('after: lazy, queued', 'INFO', 1.0),
+                               ('after: sampled', 'INFO', args.sample_rate),
+                               ('after: level WARNING', 'WARNING', 1.0)):
+        reset_root()
+        queue_logging.configure(level=level, stream=devnull)
+        logger = queue_logging.message_logger('bench', rate)
+        results.append(run(label, log_after, logger, args.messages, queue_logging.shutdown))
+
+    reset_root()
+    devnull.close()
+
+    import harness
+    commit = harness.git_commit()
+    output = args.output or os.path.join(HERE, 'results', 'logging-{}.json'.format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'benchmark': 'logging', 'commit': commit, 'params': vars(args), 'results': results},
+                  file, indent=2)
+
+    print()
+    print('{:<24} {:>16} {:>16}'.format('run', 'logging us/msg', 'total us/msg'))
+    for result in results:
+        print('{:<24} {:>16.2f} {:>16.2f}'.format(
+            result['label'], result['logging_thread_us_per_message'], result['total_us_per_message']))
+    print()
+    print('Wrote ' + output)
+
+
+if __name__ == '__main__':
+    main()
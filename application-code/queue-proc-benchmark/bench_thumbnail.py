@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Measure the throughput and latency of the container-queue-proc thumbnail worker
+against in-process S3 and SQS stand-ins provided by moto, first with a single
+transfer thread and resize process and then with the configured pipeline sizes.
+
+The worker runs in resident mode and is stopped with SIGTERM once every message
+has been deleted, so each run ends with the worker's last long poll returning.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_thumbnail.py --images 200 --s3-latency-ms 40
+"""
+import argparse
+import io
+import os
+import random
+import signal
+import threading
+import time
+
+os.environ.setdefault('PIPELINE_S3_DEST_PREFIX', 'processed')
+
+import harness  # noqa: E402
+from PIL import Image  # noqa: E402
+
+SOURCE_BUCKET = 'bench-source'
+DEST_BUCKET = 'bench-destination'
+QUEUE_NAME = 'bench-processing-queue'
+
+
+def make_jpeg(width, height, seed):
+    """
+    Render a synthetic photo-like JPEG: a colour gradient with per-pixel noise so the
+    encoder cannot compress it away.
+    """
+    rng = random.Random(seed)
+    image = Image.radial_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + rng.randint(0, 20))
+    image = Image.merge('RGB', (image, noise, Image.linear_gradient('L').resize((width, height))))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def s3_event(bucket, key, size):
+    return {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key, 'size': size}}}]}
+
+
+def add_latency(client, seconds):
+    """
+    Delay every S3 API call made by `client` to approximate the round trip to S3.
+    """
+    def delay(**_kwargs):
+        time.sleep(seconds)
+    client.meta.events.register('before-send.s3', delay)
+
+
+def run(app, recorder, queue, objects, args, transfer_workers, resize_workers):
+    """
+    Feed the queue, run the worker until every message has been deleted and return
+    the result record.
+    """
+    recorder.reset()
+    sampler = harness.ResourceSampler().start()
+    count = len(objects)
+
+    def stop_when_done():
+        if not recorder.wait_for(count, args.timeout):
+            print("Timed out after processing {} of {} images".format(len(recorder.deleted), count))
+        sampler.stop()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    started = time.time()
+    harness.Producer(
+        queue, lambda ind: s3_event(SOURCE_BUCKET, *objects[ind]), count, args.rate
+    ).start()
+    threading.Thread(target=stop_when_done, daemon=True).start()
+    app.usage_demo(transfer_workers=transfer_workers, resize_workers=resize_workers)
+    if len(recorder.deleted) < count:
+        raise RuntimeError("Processed {} of {} images".format(len(recorder.deleted), count))
+    return harness.summarize(
+        '{} threads, {} procs'.format(transfer_workers, resize_workers),
+        {'transfer_workers': transfer_workers, 'resize_workers': resize_workers},
+        recorder, sampler, count, started
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=100, help="Images per run.")
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1200)
+    parser.add_argument('--rate', type=float, default=0,
+                        help="Notifications sent per second. 0 preloads the queue.")
+    parser.add_argument('--s3-latency-ms', type=float, default=40,
+                        help="Simulated latency added to every S3 request.")
+    parser.add_argument('--transfer-workers', type=int, default=8)
+    parser.add_argument('--resize-workers', type=int, default=0,
+                        help="Resize processes. 0 uses every available vCPU.")
+    parser.add_argument('--max-in-memory-mb', type=float, default=None,
+                        help="Overrides PIPELINE_MAX_IN_MEMORY_BYTES. 0 stages every image on disk.")
+    parser.add_argument('--renditions', default=None,
+                        help="Overrides PIPELINE_RENDITIONS, for example 1024,512,224:webp,64.")
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--output', default=None,
+                        help="JSON results path. Defaults to results/thumbnail-<commit>.json.")
+    args = parser.parse_args()
+
+    recorder = harness.MessageRecorder()
+    mock = harness.start_fakes()
+    app = harness.import_worker(os.path.join('container-queue-proc', 'src'))
+
+    app.QUEUE_NAME = QUEUE_NAME
+    app.DEST_BUCKET = DEST_BUCKET
+    app.IDLE_SECONDS = args.timeout
+    if args.max_in_memory_mb is not None:
+        app.MAX_IN_MEMORY_BYTES = int(args.max_in_memory_mb * 1024 * 1024)
+    if args.renditions is not None:
+        app.RENDITIONS = app.parse_renditions(args.renditions)
+    os.makedirs(app.WORK_DIR, exist_ok=True)
+
+    app.s3_client.create_bucket(Bucket=SOURCE_BUCKET)
+    app.s3_client.create_bucket(Bucket=DEST_BUCKET)
+    queue = app.sqs.create_queue(QueueName=QUEUE_NAME)
+
+    corpus = [make_jpeg(args.width, args.height, seed) for seed in range(8)]
+    objects = []
+    for ind in range(args.images):
+        key = 'ecsproc/image-{:05d}.jpg'.format(ind)
+        body = corpus[ind % len(corpus)]
+        app.s3_client.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=body)
+        objects.append((key, len(body)))
+    add_latency(app.s3_client, args.s3_latency_ms / 1000)
+
+    results = []
+    for transfer_workers, resize_workers in [
+            (1, 1), (args.transfer_workers, args.resize_workers or app.available_cpus())]:
+        results.append(run(app, recorder, queue, objects, args, transfer_workers, resize_workers))
+
+    mock.stop()
+    harness.write_results('thumbnail', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
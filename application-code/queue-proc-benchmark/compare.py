@@ -0,0 +1,60 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Compare two benchmark result files, for example from two commits, run by run.
+
+Usage:
+    python compare.py results/thumbnail-abc1234.json results/thumbnail-def5678.json
+"""
+import argparse
+import json
+
+METRICS = [
+    ('messages_per_second', 'msgs/s'),
+    ('processing_latency_seconds.p50', 'p50 s'),
+    ('processing_latency_seconds.p95', 'p95 s'),
+    ('processing_latency_seconds.p99', 'p99 s'),
+    ('cpu_utilisation_percent', 'cpu %'),
+    ('peak_rss_mb', 'rss MB'),
+]
+
+
+def lookup(result, path):
+    value = result
+    for part in path.split('.'):
+        value = value.get(part) if value else None
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    baseline_runs = {result['label']: result for result in baseline['results']}
+
+    print('{} {} -> {}'.format(candidate['benchmark'], baseline['commit'], candidate['commit']))
+    for result in candidate['results']:
+        before = baseline_runs.get(result['label'])
+        if before is None:
+            continue
+        print()
+        print(result['label'])
+        for path, name in METRICS:
+            old, new = lookup(before, path), lookup(result, path)
+            if old is None or new is None:
+                continue
+            change = '{:+.1f}%'.format(100 * (new - old) / old) if old else 'n/a'
+            print('  {:<8} {:>10.3f} {:>10.3f} {:>9}'.format(name, old, new, change))
+
+
+if __name__ == '__main__':
+    main()
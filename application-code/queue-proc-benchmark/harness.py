@@ -0,0 +1,302 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Shared harness for the queue worker benchmarks. It starts in-process S3, SQS and
+CloudWatch stand-ins provided by moto, feeds a queue at a configurable message
+rate, records when every message is received and deleted by watching the SQS
+calls the worker makes, and samples CPU and memory of the worker process and its
+children. Results are written as JSON so runs can be compared across commits.
+
+Import this module before the worker under test so its hooks are registered with
+every boto3 session the worker creates.
+"""
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                    ('AWS_DEFAULT_REGION', 'us-east-1')):
+    os.environ.setdefault(name, value)
+
+import boto3  # noqa: E402
+import psutil  # noqa: E402
+from botocore.handlers import BUILTIN_HANDLERS  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SENT_AT = 'bench_sent_at'
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """
+    :return: A dict of nearest-rank percentiles of `values`, keyed p50, p95, ...
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {'p{}'.format(point): None for point in points}
+    return {
+        'p{}'.format(point): round(ordered[max(0, math.ceil(point / 100 * len(ordered)) - 1)], 4)
+        for point in points
+    }
+
+
+class MessageRecorder:
+    """
+    Records the first receive and the delete of every message by hooking the SQS
+    client calls made by any boto3 session created after it is installed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self.reset()
+        BUILTIN_HANDLERS.append(('after-call.sqs.ReceiveMessage', self._on_receive))
+        BUILTIN_HANDLERS.append(('before-parameter-build.sqs.DeleteMessage', self._on_delete))
+        BUILTIN_HANDLERS.append(('before-parameter-build.sqs.DeleteMessageBatch', self._on_delete))
+
+    def reset(self):
+        with self._lock:
+            # receipt handle -> message id
+            self._handles = {}
+            # message id -> (sent at, first received at)
+            self._received = {}
+            # message id -> deleted at
+            self.deleted = {}
+
+    def _on_receive(self, parsed, **_kwargs):
+        now = time.time()
+        with self._lock:
+            for message in parsed.get('Messages', []):
+                try:
+                    sent_at = json.loads(message['Body']).get(SENT_AT)
+                except (ValueError, AttributeError):
+                    sent_at = None
+                self._handles[message['ReceiptHandle']] = message['MessageId']
+                self._received.setdefault(message['MessageId'], (sent_at, now))
+
+    def _on_delete(self, params, **_kwargs):
+        now = time.time()
+        if 'Entries' in params:
+            handles = [entry['ReceiptHandle'] for entry in params['Entries']]
+        else:
+            handles = [params['ReceiptHandle']]
+        with self._lock:
+            for handle in handles:
+                message_id = self._handles.get(handle)
+                if message_id is not None:
+                    self.deleted.setdefault(message_id, now)
+            self._lock.notify_all()
+
+    def wait_for(self, count, timeout):
+        """
+        Wait until `count` messages have been deleted.
+
+        :return: True if they were, False if `timeout` seconds passed first.
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: len(self.deleted) >= count, timeout)
+
+    def latencies(self):
+        """
+        :return: Lists of processing latencies (first receive to delete) and end to
+                 end latencies (send to delete), in seconds.
+        """
+        with self._lock:
+            processing, end_to_end = [], []
+            for message_id, deleted_at in self.deleted.items():
+                sent_at, received_at = self._received[message_id]
+                processing.append(deleted_at - received_at)
+                if sent_at is not None:
+                    end_to_end.append(deleted_at - sent_at)
+            return processing, end_to_end
+
+
+class ResourceSampler:
+    """
+    Samples the CPU time and resident memory of this process and its children,
+    such as resize pool processes, on a background thread.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.peak_rss = 0
+        self.cpu_seconds = 0.0
+        self._start_cpu = self._cpu()
+
+    def _cpu(self):
+        total = sum(self._process.cpu_times()[:2])
+        for child in self._process.children(recursive=True):
+            try:
+                total += sum(child.cpu_times()[:2])
+            except psutil.Error:
+                pass
+        return total
+
+    def _rss(self):
+        total = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self._rss())
+        self.cpu_seconds = self._cpu() - self._start_cpu
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.sample()
+        self._stop.set()
+        self._thread.join()
+
+
+class Producer:
+    """
+    Sends `count` messages built by `make_body(index)` to a queue, either all up
+    front or at a constant rate on a background thread.
+    """
+
+    def __init__(self, queue, make_body, count, rate=0):
+        self.queue_url = queue.url
+        self.make_body = make_body
+        self.count = count
+        self.rate = rate
+        self._client = boto3.session.Session().client(
+            'sqs', region_name=queue.meta.client.meta.region_name
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _send(self, indexes):
+        now = time.time()
+        self._client.send_message_batch(QueueUrl=self.queue_url, Entries=[
+            {'Id': str(ind), 'MessageBody': json.dumps(dict(self.make_body(ind), **{SENT_AT: now}))}
+            for ind in indexes
+        ])
+
+    def _run(self):
+        started = time.monotonic()
+        sent = 0
+        while sent < self.count:
+            due = min(self.count, int((time.monotonic() - started) * self.rate) + 1)
+            while sent < due:
+                batch = list(range(sent, min(due, sent + 10)))
+                self._send(batch)
+                sent += len(batch)
+            time.sleep(max(0.0, started + sent / self.rate - time.monotonic()))
+
+    def start(self):
+        """
+        Preload every message when the rate is 0, else start sending in the background.
+        """
+        if self.rate:
+            self._thread.start()
+        else:
+            for start in range(0, self.count, 10):
+                self._send(range(start, min(self.count, start + 10)))
+        return self
+
+
+def start_fakes():
+    """
+    Start the moto stand-ins for every AWS service.
+
+    :return: The mock, to stop once the benchmark is done.
+    """
+    mock = mock_aws()
+    mock.start()
+    return mock
+
+
+def import_worker(relative_src):
+    """
+    Import the `app` module of a worker from its source folder.
+    """
+    sys.path.insert(0, os.path.join(HERE, '..', relative_src))
+    import app
+    return app
+
+
+def summarize(label, config, recorder, sampler, count, started):
+    """
+    Build the result record of a single run. Throughput and CPU utilisation are
+    measured from `started` to the last delete.
+    """
+    processing, end_to_end = recorder.latencies()
+    finished = max(recorder.deleted.values())
+    elapsed = finished - started
+    return {
+        'label': label,
+        'config': config,
+        'messages': count,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(count / elapsed, 2),
+        'processing_latency_seconds': percentiles(processing),
+        'end_to_end_latency_seconds': percentiles(end_to_end),
+        'cpu_utilisation_percent': round(100 * sampler.cpu_seconds / elapsed / psutil.cpu_count(), 1),
+        'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_results(benchmark, params, results, output=None):
+    """
+    Print a table of the results and write them, with the commit and host they
+    were measured on, to `output` or to results/<benchmark>-<commit>.json.
+
+    :return: The path of the JSON file.
+    """
+    commit = git_commit()
+    document = {
+        'benchmark': benchmark,
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpus': psutil.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+    if output is None:
+        output = os.path.join(HERE, 'results', '{}-{}.json'.format(benchmark, commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(document, file, indent=2)
+
+    print()
+    print('{:<24} {:>10} {:>8} {:>8} {:>8} {:>8} {:>10}'.format(
+        'run', 'msgs/s', 'p50 s', 'p95 s', 'p99 s', 'cpu %', 'rss MB'))
+    for result in results:
+        latency = result['processing_latency_seconds']
+        print('{:<24} {:>10.1f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.1f} {:>10.1f}'.format(
+            result['label'], result['messages_per_second'], latency['p50'], latency['p95'],
+            latency['p99'], result['cpu_utilisation_percent'], result['peak_rss_mb']))
+    print()
+    print('Wrote ' + output)
+    return output
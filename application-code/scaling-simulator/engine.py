@@ -0,0 +1,311 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+A small discrete-event model of an SQS queue consumed by a fleet of ECS tasks,
+shared by the scaling simulators.
+
+Messages arrive as scheduled by a trace, wait in the queue and are handed to
+the first task with a free slot. Tasks take `startup_seconds` from launch to
+their first receive, process up to `concurrency` messages at once and are
+billed from launch until they stop. The model records every message's latency
+from arrival to completion and per-minute arrival and completion counts, which
+stand in for the queue's CloudWatch metrics.
+"""
+import heapq
+import itertools
+import math
+import random
+from collections import defaultdict, deque
+
+
+class Simulation:
+    """
+    An event queue and clock. Actions scheduled for the same time run in the
+    order they were scheduled.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        self._sequence = itertools.count()
+
+    def schedule(self, at, action, *args):
+        heapq.heappush(self._events, (at, next(self._sequence), action, args))
+
+    def every(self, interval, action, start=0.0):
+        """
+        Run `action()` at `start` and then every `interval` seconds.
+        """
+        def tick():
+            action()
+            self.schedule(self.now + interval, tick)
+        self.schedule(start, tick)
+
+    def run(self, until):
+        """
+        Run every action scheduled up to `until`, then leave the clock there.
+        """
+        while self._events and self._events[0][0] <= until:
+            at, _, action, args = heapq.heappop(self._events)
+            self.now = at
+            action(*args)
+        self.now = until
+
+
+class Task:
+    __slots__ = ('launched_at', 'ready_at', 'stopped_at', 'busy', 'stopping', 'idle_since')
+
+    def __init__(self, launched_at, ready_at):
+        self.launched_at = launched_at
+        self.ready_at = ready_at
+        self.stopped_at = None
+        self.busy = 0
+        self.stopping = False
+        self.idle_since = None
+
+
+def processing_sampler(distribution, rng):
+    """
+    :return: A function of a mean that samples a processing time from
+             `distribution`, 'fixed' or 'exponential'.
+    """
+    if distribution == 'fixed':
+        return lambda mean: mean
+    if distribution == 'exponential':
+        return lambda mean: rng.expovariate(1 / mean)
+    raise ValueError("Unknown processing time distribution {}".format(distribution))
+
+
+class QueueModel:
+    """
+    A queue and the tasks consuming it.
+    """
+
+    def __init__(self, sim, concurrency=1, startup_seconds=60, idle_exit_seconds=None,
+                 distribution='fixed', seed=1):
+        """
+        :param sim: The Simulation.
+        :param concurrency: Messages each task processes at once.
+        :param startup_seconds: Seconds from launch to a task's first receive.
+        :param idle_exit_seconds: Seconds a task with nothing to do keeps polling
+                                  before it exits, as the queue-processing tasks do.
+                                  None keeps tasks until they are stopped, as
+                                  service tasks are.
+        :param distribution: Distribution of processing times around each
+                             message's mean, 'fixed' or 'exponential'.
+        """
+        self.sim = sim
+        self.concurrency = concurrency
+        self.startup_seconds = startup_seconds
+        self.idle_exit_seconds = idle_exit_seconds
+        self.rng = random.Random(seed)
+        self.sample_processing = processing_sampler(distribution, self.rng)
+
+        # (arrived at, mean processing seconds) of every visible message
+        self.visible = deque()
+        self.in_flight = 0
+        self.tasks = []
+        self.stopped_tasks = []
+        # One entry per free slot of a ready task. Entries of stopped or stopping
+        # tasks are skipped when they are popped.
+        self._free_slots = deque()
+
+        self.latencies = []
+        self.arrivals_per_minute = defaultdict(int)
+        self.completions_per_minute = defaultdict(int)
+        # Processing seconds of each message completed in each minute
+        self.processing_per_minute = defaultdict(list)
+        self.launched = 0
+
+    # Arrivals
+
+    def add_arrivals(self, start, duration, count, mean_processing):
+        """
+        Schedule `count` arrivals at uniformly random times in
+        [`start`, `start` + `duration`).
+        """
+        for at in sorted(start + self.rng.random() * duration for _ in range(count)):
+            self.sim.schedule(at, self._arrive, mean_processing)
+
+    def _arrive(self, mean_processing):
+        self.visible.append((self.sim.now, mean_processing))
+        self.arrivals_per_minute[int(self.sim.now // 60)] += 1
+        self._dispatch()
+
+    # Tasks
+
+    @property
+    def running_tasks(self):
+        """
+        Tasks launched and not stopped, including those still starting.
+        """
+        return len(self.tasks)
+
+    @property
+    def desired_tasks(self):
+        """
+        Tasks launched and not told to stop.
+        """
+        return sum(1 for task in self.tasks if not task.stopping)
+
+    def started_tasks(self):
+        """
+        Tasks past their startup and not yet stopped, as Container Insights
+        reports RunningTaskCount.
+        """
+        return sum(1 for task in self.tasks if task.ready_at <= self.sim.now)
+
+    def launch(self, count):
+        for _ in range(count):
+            task = Task(self.sim.now, self.sim.now + self.startup_seconds)
+            self.tasks.append(task)
+            self.launched += 1
+            self.sim.schedule(task.ready_at, self._ready, task)
+
+    def stop(self, count):
+        """
+        Stop up to `count` tasks, idle ones first. Busy tasks finish the messages
+        they hold before they stop.
+        """
+        candidates = sorted((task for task in self.tasks if not task.stopping),
+                            key=lambda task: (task.busy, -task.launched_at))
+        for task in candidates[:count]:
+            task.stopping = True
+            if task.busy == 0:
+                self._retire(task)
+
+    def _ready(self, task):
+        if task.stopping:
+            return
+        task.idle_since = self.sim.now
+        self._free_slots.extend([task] * self.concurrency)
+        self._dispatch()
+        self._check_idle(task)
+
+    def _retire(self, task):
+        task.stopped_at = self.sim.now
+        self.tasks.remove(task)
+        self.stopped_tasks.append(task)
+
+    def _check_idle(self, task):
+        if self.idle_exit_seconds is None or task.busy or task.stopping or self.visible:
+            return
+        idle_since = task.idle_since
+        self.sim.schedule(self.sim.now + self.idle_exit_seconds, self._exit_if_idle, task, idle_since)
+
+    def _exit_if_idle(self, task, idle_since):
+        if task.idle_since == idle_since and task.busy == 0 and not task.stopping and not self.visible:
+            task.stopping = True
+            self._retire(task)
+
+    # Processing
+
+    def _dispatch(self):
+        while self.visible and self._free_slots:
+            task = self._free_slots.popleft()
+            if task.stopping:
+                continue
+            arrived_at, mean_processing = self.visible.popleft()
+            task.busy += 1
+            task.idle_since = None
+            self.in_flight += 1
+            processing = self.sample_processing(mean_processing)
+            self.sim.schedule(self.sim.now + processing, self._complete, task, arrived_at, processing)
+
+    def _complete(self, task, arrived_at, processing):
+        now = self.sim.now
+        minute = int(now // 60)
+        self.latencies.append(now - arrived_at)
+        self.completions_per_minute[minute] += 1
+        self.processing_per_minute[minute].append(processing)
+        self.in_flight -= 1
+        task.busy -= 1
+        if task.stopping:
+            if task.busy == 0:
+                self._retire(task)
+            return
+        self._free_slots.append(task)
+        if task.busy == 0:
+            task.idle_since = now
+        self._dispatch()
+        self._check_idle(task)
+
+    # Measurements
+
+    def rates(self, window, lag=0.0):
+        """
+        Per-second arrival and completion rates and the arrival trend over the
+        whole minutes in [now - lag - window, now - lag), as CloudWatch would
+        report them `lag` seconds late.
+
+        :return: The arrival rate, completion rate and a list of
+                 (seconds, arrival rate) points, one per minute.
+        """
+        end = int((self.sim.now - lag) // 60)
+        minutes = range(max(0, end - int(window // 60)), end)
+        if not minutes:
+            return None, None, []
+        arrivals = [self.arrivals_per_minute.get(minute, 0) for minute in minutes]
+        completions = [self.completions_per_minute.get(minute, 0) for minute in minutes]
+        points = [(minute * 60.0, count / 60) for minute, count in zip(minutes, arrivals)]
+        return sum(arrivals) / 60 / len(minutes), sum(completions) / 60 / len(minutes), points
+
+    def task_hours(self):
+        now = self.sim.now
+        return sum((task.stopped_at if task.stopped_at is not None else now) - task.launched_at
+                   for task in self.stopped_tasks + self.tasks) / 3600
+
+
+def percentile(ordered, point):
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(point / 100 * len(ordered)) - 1)]
+
+
+def summarize(label, model, slo_seconds, total_messages):
+    """
+    :return: The result record of a run: latency percentiles, the fraction of all
+             messages, including unprocessed ones, completed within the SLO, and
+             the task-hours used.
+    """
+    ordered = sorted(model.latencies)
+    within = sum(1 for latency in ordered if latency <= slo_seconds)
+    return {
+        'label': label,
+        'messages': total_messages,
+        'processed': len(ordered),
+        'latency_seconds': {
+            'p50': _round(percentile(ordered, 50)),
+            'p95': _round(percentile(ordered, 95)),
+            'p99': _round(percentile(ordered, 99)),
+            'max': _round(ordered[-1] if ordered else None),
+        },
+        'slo_seconds': slo_seconds,
+        'slo_attainment': round(within / total_messages, 4) if total_messages else 1.0,
+        'task_hours': round(model.task_hours(), 3),
+        'tasks_launched': model.launched,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def print_results(results):
+    print()
+    print('{:<28} {:>9} {:>9} {:>9} {:>9} {:>8} {:>10} {:>9}'.format(
+        'run', 'processed', 'p50 s', 'p95 s', 'p99 s', 'SLO %', 'task-hrs', 'launched'))
+    for result in results:
+        latency = result['latency_seconds']
+        print('{:<28} {:>9} {:>9} {:>9} {:>9} {:>8.2f} {:>10.2f} {:>9}'.format(
+            result['label'], result['processed'], _format(latency['p50']), _format(latency['p95']),
+            _format(latency['p99']), 100 * result['slo_attainment'], result['task_hours'],
+            result['tasks_launched']))
+    print()
+
+
+def _format(value):
+    return '-' if value is None else '{:.1f}'.format(value)
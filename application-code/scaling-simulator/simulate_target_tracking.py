@@ -0,0 +1,267 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Replay a queue trace against the sqs-dynamic-target-tracking blueprint: an ECS
+service scaled by Application Auto Scaling target tracking on the backlog per
+instance (BPI), whose target the ecs-target-setter Lambda rewrites from the
+recent message processing duration.
+
+Every minute the model records ApproximateNumberOfMessagesVisible and
+RunningTaskCount. Target tracking evaluates their ratio --metric-lag seconds
+later, as its CloudWatch alarms would. It scales out after 3 consecutive
+datapoints above the target and scales in after 15 below 90% of it. Scale-out
+and scale-in cooldowns apply as Application Auto Scaling applies them. Every
+--setter-period seconds the setter computes
+desired_latency * max_concurrency / processing duration, and sets it as the
+target when it differs from the current one by more than
+--target-change-threshold percent.
+
+Each combination of --desired-latency and cooldown values is one run, so they
+can be tuned against the same trace.
+
+Usage:
+    python traces.py synthesize --profile diurnal --hours 24 --rate 1 > day.csv
+    python simulate_target_tracking.py day.csv --processing-seconds 5 --desired-latency 60,120 --cooldown 60,240
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'ecs-target-setter'))
+
+import estimators  # noqa: E402
+from engine import QueueModel, Simulation, percentile, print_results, summarize  # noqa: E402
+from traces import load_trace, trace_end  # noqa: E402
+
+
+class TargetTracking:
+    """
+    Target tracking on the BPI metric of a QueueModel running as a service.
+    """
+
+    def __init__(self, sim, model, target, min_capacity, max_capacity, scale_out_cooldown,
+                 scale_in_cooldown, metric_lag, scale_out_datapoints=3, scale_in_datapoints=15):
+        self.sim = sim
+        self.model = model
+        self.target = target
+        self.min_capacity = min_capacity
+        self.max_capacity = max_capacity
+        self.scale_out_cooldown = scale_out_cooldown
+        self.scale_in_cooldown = scale_in_cooldown
+        self.metric_lag = metric_lag
+        self.scale_out_datapoints = scale_out_datapoints
+        self.scale_in_datapoints = scale_in_datapoints
+
+        # minute -> (visible messages, running tasks)
+        self.samples = {}
+        self.above = 0
+        self.below = 0
+        self.last_scale_out = (-math.inf, 0)
+        self.last_scale_in_at = -math.inf
+        self.scale_outs = 0
+        self.scale_ins = 0
+
+    def set_target(self, target):
+        """
+        Replace the target. Application Auto Scaling recreates the policy's alarms,
+        so their datapoint streaks start over.
+        """
+        if target != self.target:
+            self.target = target
+            self.above = 0
+            self.below = 0
+
+    def tick(self):
+        """
+        Record this minute's datapoints and evaluate the one `metric_lag` seconds old.
+        """
+        now = self.sim.now
+        self.samples[int(now // 60)] = (len(self.model.visible), self.model.started_tasks())
+        sample = self.samples.get(int((now - self.metric_lag) // 60))
+        if sample is None or sample[1] == 0:
+            return
+        visible, running = sample
+        metric = visible / running
+        self.above = self.above + 1 if metric > self.target else 0
+        self.below = self.below + 1 if metric < 0.9 * self.target else 0
+
+        current = self.model.desired_tasks
+        desired = min(self.max_capacity, max(self.min_capacity, math.ceil(current * metric / self.target)))
+        last_out_at, last_out_capacity = self.last_scale_out
+        in_scale_out_cooldown = now - last_out_at < self.scale_out_cooldown
+        if self.above >= self.scale_out_datapoints and desired > current:
+            # During a scale-out cooldown only a larger scale-out than the last one goes ahead
+            if not in_scale_out_cooldown or desired > last_out_capacity:
+                self.model.launch(desired - current)
+                self.last_scale_out = (now, desired)
+                self.scale_outs += 1
+        elif (self.below >= self.scale_in_datapoints and desired < current and not in_scale_out_cooldown
+              and now - self.last_scale_in_at >= self.scale_in_cooldown):
+            self.model.stop(current - desired)
+            self.last_scale_in_at = now
+            self.scale_ins += 1
+
+
+class TargetSetter:
+    """
+    The ecs-target-setter Lambda: sets the BPI target from the processing duration
+    of the messages completed in the last `window` seconds, per minute, as the
+    Lambda reads them from CloudWatch.
+    """
+
+    def __init__(self, model, tracking, desired_latency, max_concurrency, default_duration,
+                 estimator='ewma', window=3600, half_life=900, change_threshold=0):
+        self.model = model
+        self.tracking = tracking
+        self.desired_latency = desired_latency
+        self.max_concurrency = max_concurrency
+        self.default_duration = default_duration
+        self.estimator = estimator
+        self.window = window
+        self.half_life = half_life
+        self.change_threshold = change_threshold
+        self.updates = 0
+        self.skips = 0
+
+    def duration(self):
+        """
+        The processing duration the setter would estimate. 'latest' is the mean of
+        the most recent minute, close to the single most recent datapoint the
+        setter originally read.
+        """
+        end = int(self.model.sim.now // 60)
+        minutes = [minute for minute in range(max(0, end - int(self.window // 60)), end)
+                   if self.model.processing_per_minute.get(minute)]
+        if not minutes:
+            return self.default_duration
+        if self.estimator == 'latest':
+            values = self.model.processing_per_minute[minutes[-1]]
+            return sum(values) / len(values)
+        if self.estimator in estimators.WINDOWED:
+            # One period over the whole window, as the setter queries it
+            values = sorted(value for minute in minutes for value in self.model.processing_per_minute[minute])
+            return percentile(values, 90)
+        datapoints = [
+            (minute * 60.0, minute_statistic(self.estimator, self.model.processing_per_minute[minute]),
+             len(self.model.processing_per_minute[minute]))
+            for minute in minutes
+        ]
+        return estimators.estimate(self.estimator, datapoints, self.model.sim.now, self.half_life)
+
+    def update(self):
+        target = max(1, int(self.desired_latency * self.max_concurrency / self.duration()))
+        if abs(target - self.tracking.target) * 100 <= self.change_threshold * self.tracking.target:
+            self.skips += 1
+            return
+        self.tracking.set_target(target)
+        self.updates += 1
+
+
+def minute_statistic(estimator, values):
+    """
+    The statistic CloudWatch would return for one period of `values`.
+    """
+    ordered = sorted(values)
+    if estimator == 'trimmed_mean':
+        low, high = percentile(ordered, 10), percentile(ordered, 90)
+        kept = [value for value in ordered if low <= value <= high]
+        return sum(kept) / len(kept)
+    return sum(ordered) / len(ordered)
+
+
+def run(intervals, args, desired_latency, scale_out_cooldown, scale_in_cooldown):
+    sim = Simulation()
+    model = QueueModel(sim, concurrency=args.max_concurrency, startup_seconds=args.startup_seconds,
+                       distribution=args.distribution, seed=args.seed)
+    for interval in intervals:
+        sim.schedule(interval.start, model.add_arrivals, *interval)
+    model.launch(args.min_capacity)
+
+    tracking = TargetTracking(
+        sim, model, desired_latency * args.max_concurrency / args.default_duration,
+        args.min_capacity, args.max_capacity, scale_out_cooldown, scale_in_cooldown, args.metric_lag)
+    setter = TargetSetter(model, tracking, desired_latency, args.max_concurrency, args.default_duration,
+                          estimator=args.setter_estimator, window=args.setter_window,
+                          half_life=args.ewma_half_life, change_threshold=args.target_change_threshold)
+    sim.every(60, tracking.tick, start=60)
+    sim.every(args.setter_period, setter.update, start=args.setter_period)
+    sim.run(trace_end(intervals) + args.drain_seconds)
+
+    label = 'latency {:g}, cooldown {:g}/{:g}'.format(desired_latency, scale_out_cooldown, scale_in_cooldown)
+    result = summarize(label, model, args.slo or desired_latency, sum(interval.arrivals for interval in intervals))
+    result.update({
+        'config': {'desired_latency': desired_latency, 'scale_out_cooldown': scale_out_cooldown,
+                   'scale_in_cooldown': scale_in_cooldown},
+        'scale_outs': tracking.scale_outs,
+        'scale_ins': tracking.scale_ins,
+        'setter_updates': setter.updates,
+        'setter_skips': setter.skips,
+        'final_target': tracking.target,
+    })
+    return result
+
+
+def numbers(text):
+    return [float(value) for value in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', help="CSV trace, see traces.py.")
+    parser.add_argument('--desired-latency', type=numbers, default=[60],
+                        help="Comma-separated desired_latency values, in seconds.")
+    parser.add_argument('--cooldown', type=numbers, default=None,
+                        help="Comma-separated values used for both cooldowns.")
+    parser.add_argument('--scale-out-cooldown', type=numbers, default=[240])
+    parser.add_argument('--scale-in-cooldown', type=numbers, default=[240])
+    parser.add_argument('--slo', type=float, default=None,
+                        help="Latency SLO in seconds. Defaults to each run's desired latency.")
+    parser.add_argument('--processing-seconds', type=float, default=5,
+                        help="Mean processing time of messages the trace gives none for.")
+    parser.add_argument('--distribution', choices=['fixed', 'exponential'], default='exponential')
+    parser.add_argument('--default-duration', type=float, default=5, help="default_msg_proc_duration.")
+    parser.add_argument('--max-concurrency', type=int, default=10)
+    parser.add_argument('--min-capacity', type=int, default=1)
+    parser.add_argument('--max-capacity', type=int, default=10)
+    parser.add_argument('--startup-seconds', type=float, default=60)
+    parser.add_argument('--metric-lag', type=float, default=60,
+                        help="Seconds before a datapoint is seen by the alarms.")
+    parser.add_argument('--setter-period', type=float, default=3600, help="Seconds between setter runs.")
+    parser.add_argument('--setter-estimator', choices=['latest'] + list(estimators.STATISTICS), default='ewma',
+                        help="duration_estimator. 'latest' is the setter's original behavior.")
+    parser.add_argument('--setter-window', type=float, default=3600, help="duration_window, in seconds.")
+    parser.add_argument('--ewma-half-life', type=float, default=900, help="ewma_half_life, in seconds.")
+    parser.add_argument('--target-change-threshold', type=float, default=10,
+                        help="target_change_threshold, in percent. 0 sets every new target.")
+    parser.add_argument('--drain-seconds', type=float, default=3600,
+                        help="Seconds simulated after the trace ends.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this path.")
+    args = parser.parse_args()
+    if args.cooldown:
+        args.scale_out_cooldown = args.scale_in_cooldown = args.cooldown
+
+    intervals = load_trace(args.trace, args.processing_seconds)
+    results = [
+        run(intervals, args, *combination)
+        for combination in itertools.product(args.desired_latency, args.scale_out_cooldown,
+                                             args.scale_in_cooldown)
+        if args.cooldown is None or combination[1] == combination[2]
+    ]
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'simulator': 'target-tracking', 'params': vars(args), 'results': results},
+                      file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
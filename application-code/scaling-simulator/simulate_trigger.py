@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Replay a queue trace against the scaling policies of the queue-processing
+trigger Lambda (lambda-function-queue-trigger/scaling.py) and compare their
+latency SLO attainment and task-hours.
+
+Every --period seconds the simulated trigger reads the visible and in-flight
+message counts and the pending and running tasks. For the policies that use
+rates, it also reads per-minute arrival and completion rates over the last
+--rate-window seconds, reported --metric-lag seconds late as CloudWatch does.
+It then starts tasks as the Lambda does. Tasks exit once they find the queue
+empty for --idle-exit-seconds.
+
+Usage:
+    python traces.py synthesize --profile burst --hours 4 --rate 1 > burst.csv
+    python simulate_trigger.py burst.csv --processing-seconds 2 --policies proportional,predictive,pid
+"""
+import argparse
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'lambda-function-queue-trigger'))
+
+import scaling  # noqa: E402
+from engine import QueueModel, Simulation, print_results, summarize  # noqa: E402
+from traces import load_trace, trace_end  # noqa: E402
+
+
+def build_policy(name, args):
+    if name == 'proportional':
+        return scaling.ProportionalPolicy(args.messages_per_task)
+    if name == 'predictive':
+        return scaling.PredictivePolicy(args.target_latency, args.task_throughput,
+                                        startup_seconds=args.startup_seconds)
+    if name == 'pid':
+        return scaling.PidPolicy(args.target_latency, args.task_throughput,
+                                 kp=args.kp, ki=args.ki, kd=args.kd)
+    raise ValueError("Unknown policy {}. Use one of: {}".format(name, ', '.join(scaling.POLICIES)))
+
+
+def run(name, intervals, args):
+    sim = Simulation()
+    model = QueueModel(sim, concurrency=args.concurrency, startup_seconds=args.startup_seconds,
+                       idle_exit_seconds=args.idle_exit_seconds, distribution=args.distribution,
+                       seed=args.seed)
+    for interval in intervals:
+        sim.schedule(interval.start, model.add_arrivals, *interval)
+    policy = build_policy(name, args)
+
+    def trigger():
+        if not model.visible:
+            return
+        arrival_rate, completion_rate, points = None, None, []
+        if policy.needs_rates:
+            arrival_rate, completion_rate, points = model.rates(args.rate_window, args.metric_lag)
+        running = model.running_tasks
+        desired = policy.desired_tasks(scaling.QueueState(
+            visible=len(model.visible),
+            in_flight=model.in_flight,
+            running_tasks=running,
+            arrival_rate=arrival_rate,
+            completion_rate=completion_rate,
+            arrival_trend=scaling.linear_trend(points),
+            timestamp=sim.now
+        ))
+        to_start = min(desired - running, args.max_tasks - running, args.max_tasks_per_run)
+        if to_start > 0:
+            model.launch(to_start)
+
+    sim.every(args.period, trigger)
+    sim.run(trace_end(intervals) + args.drain_seconds)
+    return summarize(name, model, args.slo, sum(interval.arrivals for interval in intervals))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', help="CSV trace, see traces.py.")
+    parser.add_argument('--policies', default='proportional,predictive,pid')
+    parser.add_argument('--slo', type=float, default=300, help="Latency SLO in seconds.")
+    parser.add_argument('--processing-seconds', type=float, default=2,
+                        help="Mean processing time of messages the trace gives none for.")
+    parser.add_argument('--distribution', choices=['fixed', 'exponential'], default='exponential')
+    parser.add_argument('--concurrency', type=int, default=1, help="Messages each task processes at once.")
+    parser.add_argument('--startup-seconds', type=float, default=60)
+    parser.add_argument('--idle-exit-seconds', type=float, default=4,
+                        help="Seconds an idle task polls an empty queue before it exits.")
+    parser.add_argument('--period', type=float, default=120, help="Seconds between trigger runs.")
+    parser.add_argument('--max-tasks', type=int, default=10, help="PIPELINE_ECS_MAX_TASKS.")
+    parser.add_argument('--max-tasks-per-run', type=int, default=100)
+    parser.add_argument('--messages-per-task', type=int, default=10,
+                        help="Messages per started task for the proportional policy.")
+    parser.add_argument('--target-latency', type=float, default=300, help="TARGET_LATENCY_SECONDS.")
+    parser.add_argument('--task-throughput', type=float, default=None,
+                        help="TASK_THROUGHPUT. Defaults to concurrency / processing-seconds.")
+    parser.add_argument('--kp', type=float, default=1.0)
+    parser.add_argument('--ki', type=float, default=0.002)
+    parser.add_argument('--kd', type=float, default=0.0)
+    parser.add_argument('--rate-window', type=float, default=600)
+    parser.add_argument('--metric-lag', type=float, default=120)
+    parser.add_argument('--drain-seconds', type=float, default=3600,
+                        help="Seconds simulated after the trace ends.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this path.")
+    args = parser.parse_args()
+    if args.task_throughput is None:
+        args.task_throughput = args.concurrency / args.processing_seconds
+
+    intervals = load_trace(args.trace, args.processing_seconds)
+    results = [run(name.strip(), intervals, args) for name in args.policies.split(',')]
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'simulator': 'trigger', 'params': vars(args), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
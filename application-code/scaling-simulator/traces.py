@@ -0,0 +1,157 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Read, record and synthesize queue traces for the scaling simulators.
+
+A trace is a CSV file with a `seconds` column, the start of each interval from
+the start of the trace, an `arrivals` column, the messages sent from then until
+the next row, and an optional `processing_seconds` column, the mean processing
+time of those messages. The last interval is as long as the one before it.
+
+Usage:
+    python traces.py record --queue ecsdemo-queue-proc-processing-queue --hours 24 > trace.csv
+    python traces.py synthesize --profile diurnal --hours 6 --rate 2 > trace.csv
+"""
+import argparse
+import csv
+import math
+import random
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+Interval = namedtuple('Interval', ['start', 'duration', 'arrivals', 'processing_seconds'])
+
+
+def load_trace(path, default_processing_seconds):
+    """
+    :param path: The CSV trace.
+    :param default_processing_seconds: The mean processing time of intervals
+                                       without a processing_seconds value.
+    :return: The list of intervals, in time order.
+    """
+    with open(path, newline='') as file:
+        rows = [row for row in csv.DictReader(file)]
+    starts = [float(row['seconds']) for row in rows]
+    intervals = []
+    for ind, row in enumerate(rows):
+        if ind + 1 < len(rows):
+            duration = starts[ind + 1] - starts[ind]
+        else:
+            duration = starts[ind] - starts[ind - 1] if ind else 60.0
+        processing = row.get('processing_seconds') or default_processing_seconds
+        intervals.append(Interval(starts[ind], duration, int(float(row['arrivals'])), float(processing)))
+    return intervals
+
+
+def trace_end(intervals):
+    last = intervals[-1]
+    return last.start + last.duration
+
+
+def write_trace(rows, file):
+    writer = csv.writer(file)
+    writer.writerow(['seconds', 'arrivals'])
+    writer.writerows(rows)
+
+
+def record(queue_name, hours, region=None):
+    """
+    Read a queue's NumberOfMessagesSent at one-minute resolution from CloudWatch.
+    CloudWatch keeps one-minute datapoints for 15 days.
+
+    :return: A list of (seconds, arrivals) rows.
+    """
+    import boto3
+
+    cloudwatch = boto3.client('cloudwatch', region_name=region)
+    end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start = end - timedelta(hours=hours)
+    counts = {}
+    paginator = cloudwatch.get_paginator('get_metric_data')
+    for page in paginator.paginate(
+            MetricDataQueries=[{
+                'Id': 'sent',
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/SQS',
+                        'MetricName': 'NumberOfMessagesSent',
+                        'Dimensions': [{'Name': 'QueueName', 'Value': queue_name}]
+                    },
+                    'Period': 60,
+                    'Stat': 'Sum'
+                }
+            }],
+            StartTime=start, EndTime=end, ScanBy='TimestampAscending'):
+        for result in page['MetricDataResults']:
+            for timestamp, value in zip(result['Timestamps'], result['Values']):
+                counts[int((timestamp - start).total_seconds())] = int(value)
+    return [(seconds, counts.get(seconds, 0)) for seconds in range(0, int(hours * 3600), 60)]
+
+
+def synthesize(profile, hours, rate, seed=1):
+    """
+    Generate Poisson arrivals per minute around a mean of `rate` messages per
+    second.
+
+    :param profile: 'constant'; 'diurnal', a sine wave between 0 and twice the
+                    rate over the trace; or 'burst', the rate with a burst of ten
+                    times the rate for 10 minutes every hour.
+    :return: A list of (seconds, arrivals) rows.
+    """
+    rng = random.Random(seed)
+    minutes = int(hours * 60)
+    rows = []
+    for minute in range(minutes):
+        if profile == 'constant':
+            mean = rate
+        elif profile == 'diurnal':
+            mean = rate * (1 - math.cos(2 * math.pi * minute / minutes))
+        elif profile == 'burst':
+            mean = rate * (10 if minute % 60 >= 50 else 1)
+        else:
+            raise ValueError("Unknown profile {}".format(profile))
+        rows.append((minute * 60, poisson(rng, mean * 60)))
+    return rows
+
+
+def poisson(rng, mean):
+    """
+    Sample a Poisson count, with a normal approximation for large means.
+    """
+    if mean > 500:
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    threshold, count, product = math.exp(-mean), 0, rng.random()
+    while product > threshold:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    recorder = commands.add_parser('record', help="Record a trace from a queue's CloudWatch metrics.")
+    recorder.add_argument('--queue', required=True)
+    recorder.add_argument('--hours', type=float, default=24)
+    recorder.add_argument('--region', default=None)
+    synthesizer = commands.add_parser('synthesize', help="Generate a synthetic trace.")
+    synthesizer.add_argument('--profile', choices=['constant', 'diurnal', 'burst'], default='diurnal')
+    synthesizer.add_argument('--hours', type=float, default=6)
+    synthesizer.add_argument('--rate', type=float, default=2, help="Mean messages per second.")
+    synthesizer.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        rows = record(args.queue, args.hours, args.region)
+    else:
+        rows = synthesize(args.profile, args.hours, args.rate, args.seed)
+    write_trace(rows, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,253 @@
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import json
+import math
 import os
+import time
+from manifest import object_version, open_manifest
 
-client = boto3.client('s3')
+# Prefixes listed at once
+list_workers = int(os.environ.get('list_workers', '16'))
+# Depth of the folders holding an incoming/ prefix, 1 for <folder>/incoming/<file>
+folder_depth = int(os.environ.get('folder_depth', '1'))
+# Seconds left to build the response when listing stops before the function times out
+listing_margin = int(os.environ.get('listing_margin_seconds', '10'))
+
+# Bytes of input each work unit, and so each ECS task, is given
+target_unit_bytes = int(os.environ.get('target_unit_mb', '1024')) * 1024 * 1024
+# Longest FILES variable of a unit, since ECS allows 8 KB of overrides per task
+max_unit_files_chars = int(os.environ.get('max_unit_files_chars', '6000'))
+# Megabytes a task validates per second per vCPU, and the seconds a unit should take
+vcpu_mb_per_second = float(os.environ.get('vcpu_mb_per_second', '15'))
+unit_target_seconds = float(os.environ.get('unit_target_seconds', '600'))
+# Memory of each validation process, one per vCPU
+worker_memory_mb = int(os.environ.get('worker_memory_mb', '512'))
+max_task_cpu = int(os.environ.get('max_task_cpu', '4096'))
+
+# Memory sizes, in MiB, Fargate supports with each CPU size
+FARGATE_MEMORY = {
+    256: [512, 1024, 2048],
+    512: list(range(1024, 4097, 1024)),
+    1024: list(range(2048, 8193, 1024)),
+    2048: list(range(4096, 16385, 1024)),
+    4096: list(range(8192, 30721, 1024)),
+}
+
+client = boto3.client('s3', config=Config(max_pool_connections=list_workers))
 bucket = os.environ['input_bucket']
+# Files already processed, which are skipped unless they changed since
+manifest = open_manifest(os.environ.get('manifest_table', ''), os.environ.get('manifest_path', ''))
 
 class account:
     def __init__(self, id, files):
         self.id = id
         self.files = files
 
+def out_of_time(deadline):
+    return deadline is not None and time.monotonic() > deadline
+
+def list_prefixes(prefix, deadline):
+    """
+    Return the prefixes one level below prefix, and whether they were all
+    listed before the deadline.
+    """
+    prefixes = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        prefixes.extend(commonPrefix['Prefix'] for commonPrefix in page.get('CommonPrefixes', []))
+        if out_of_time(deadline):
+            return prefixes, False
+    return prefixes, True
+
+def list_objects(prefix, deadline):
+    """
+    Return every object under prefix, or None if the deadline passed first.
+    """
+    objects = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get('Contents', []))
+        if out_of_time(deadline):
+            return None
+    return objects
+
+def find_incoming_prefixes(executor, deadline):
+    """
+    Walk the folders down to folder_depth, listing only one level of each with
+    a delimiter, and return their <folder>/incoming/ prefixes, and whether the
+    walk completed. The objects of other prefixes, such as processed/ and
+    errors/, are never listed.
+    """
+    incoming = []
+    complete = True
+    level = ['']
+    for depth in range(folder_depth + 1):
+        children = []
+        for prefixes, listed in executor.map(lambda prefix: list_prefixes(prefix, deadline), level):
+            children.extend(prefixes)
+            complete = complete and listed
+        incoming.extend(prefix for prefix in children if prefix.endswith('/incoming/'))
+        level = [prefix for prefix in children if not prefix.endswith('/incoming/')]
+        if not complete:
+            break
+    return sorted(incoming), complete
+
+def list_new_objects(prefix, deadline):
+    """
+    Return the objects under an incoming/ prefix that the manifest doesn't
+    record at their current ETag and LastModified, and the number of the
+    others, or None if the deadline passed first.
+    """
+    objects = list_objects(prefix, deadline)
+    if objects is None or manifest is None:
+        return objects, 0
+    processed = manifest.processed(prefix[:-len('/incoming/')])
+    newObjects = [obj for obj in objects
+                  if processed.get(obj['Key']) != object_version(obj['ETag'], obj['LastModified'])]
+    return newObjects, len(objects) - len(newObjects)
+
+def list_incoming(deadline):
+    """
+    Return a map of folder to the new or changed objects of its incoming/
+    prefix, whether every folder was listed, and the number of files skipped
+    as already processed. Folders whose listing the deadline interrupted are
+    left out, for the next run to process.
+    """
+    folderObjects = {}
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=list_workers) as executor:
+        prefixes, complete = find_incoming_prefixes(executor, deadline)
+        futures = [(prefix, executor.submit(list_new_objects, prefix, deadline)) for prefix in prefixes]
+        for prefix, future in futures:
+            objects, skippedObjects = future.result()
+            if objects is None:
+                complete = False
+                continue
+            skipped += skippedObjects
+            # Ignore empty folders and the folder marker
+            objects = [obj for obj in objects if obj['Key'] != prefix]
+            if objects:
+                folderObjects[prefix[:-len('/incoming/')]] = objects
+    return folderObjects, complete, skipped
+
+def recommend_resources(unitBytes, fileCount):
+    """
+    Return the smallest Fargate cpu and memory, as strings for the task
+    overrides, that validate unitBytes in unit_target_seconds, given that each
+    file is validated by one process on one vCPU.
+    """
+    vcpus = min(unitBytes / (vcpu_mb_per_second * 1024 * 1024 * unit_target_seconds), fileCount)
+    cpus = [cpu for cpu in sorted(FARGATE_MEMORY) if cpu <= max_task_cpu] or [min(FARGATE_MEMORY)]
+    cpu = next((cpu for cpu in cpus if cpu >= vcpus * 1024), cpus[-1])
+    workers = min(max(1, cpu // 1024), fileCount)
+    memory = next((memory for memory in FARGATE_MEMORY[cpu] if memory >= workers * worker_memory_mb),
+                  FARGATE_MEMORY[cpu][-1])
+    return str(cpu), str(memory)
+
+def plan_units(folderObjects):
+    """
+    Bin-pack the files of every folder into work units of about
+    target_unit_bytes each, so that tasks get balanced amounts of data
+    whatever the folder they come from.
+
+    Files are placed largest first into the unit with the fewest bytes that
+    still has room for the key in its FILES variable, a new unit being opened
+    when none has. A file larger than the target gets a unit of its own.
+    """
+    files = [(obj['Size'], obj['Key'], folder) for folder in folderObjects for obj in folderObjects[folder]]
+    totalBytes = sum(size for size, key, folder in files)
+    units = []
+    # (bytes, unit index) of the units that still have room
+    lightest = []
+    for index in range(max(1, math.ceil(totalBytes / target_unit_bytes))):
+        units.append({'files': [], 'folders': set(), 'bytes': 0, 'chars': 2})
+        lightest.append((0, index))
+    for size, key, folder in sorted(files, reverse=True):
+        # A key costs its quoted length and a separator in the JSON list
+        chars = len(json.dumps(key)) + 2
+        while lightest and units[lightest[0][1]]['chars'] + chars > max_unit_files_chars:
+            heapq.heappop(lightest)
+        if lightest:
+            index = heapq.heappop(lightest)[1]
+        else:
+            index = len(units)
+            units.append({'files': [], 'folders': set(), 'bytes': 0, 'chars': 2})
+        unit = units[index]
+        unit['files'].append(key)
+        unit['folders'].add(folder)
+        unit['bytes'] += size
+        unit['chars'] += chars
+        heapq.heappush(lightest, (unit['bytes'], index))
+
+    units = sorted((unit for unit in units if unit['files']), key=lambda unit: -unit['bytes'])
+    folderUnits = {}
+    for unit in units:
+        for folder in unit['folders']:
+            folderUnits[folder] = folderUnits.get(folder, 0) + 1
+    workUnits = []
+    parts = {}
+    for unit in units:
+        folders = sorted(unit['folders'])
+        # Name a unit after its folder, numbering the parts of a folder split across units
+        if len(folders) > 1:
+            name = 'unit-{}'.format(len(workUnits) + 1)
+        elif folderUnits[folders[0]] > 1:
+            parts[folders[0]] = parts.get(folders[0], 0) + 1
+            name = '{}-part-{}'.format(folders[0], parts[folders[0]])
+        else:
+            name = folders[0]
+        cpu, memory = recommend_resources(unit['bytes'], len(unit['files']))
+        workUnits.append({
+            'foldername': name,
+            'folders': folders,
+            'files': unit['files'],
+            'bytes': unit['bytes'],
+            'cpu': cpu,
+            'memory': memory
+        })
+    return workUnits
+
 def lambda_handler(event, context):
     try:
-        response = client.list_objects_v2(
-            Bucket=bucket
-        )
-
-        # Create Map of folder to its corresponding files {<folder>:[<files>]}
-        folderFiles = {}
-        #print(response['Contents'])
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                # Look for 'incoming' objects
-                if '/incoming/' in obj['Key']:
-                    delimiters = obj['Key'].split('/incoming/')
-                    # Ignore empty folders
-                    if delimiters[1] != '':
-                        print(delimiters[0]+':'+delimiters[1])
-                        # If entry already exists in folder list, append file to folder's file list
-                        # else create folder entry and add file
-                        if delimiters[0] in folderFiles:
-                            folderFiles[delimiters[0]].append(obj['Key'])
-                        else:
-                            folderFiles[delimiters[0]] = []
-                            folderFiles[delimiters[0]].append(obj['Key'])
+        deadline = None
+        if context is not None:
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - listing_margin
+
+        # Create Map of folder to its corresponding files {<folder>:[<objects>]}
+        folderObjects, complete, skipped = list_incoming(deadline)
+        for folder in folderObjects:
+            print('{}: {} new or changed files'.format(folder, len(folderObjects[folder])))
+        print('{} files skipped as already processed'.format(skipped))
+        if not complete:
+            print('Listing stopped before the function timeout, the remaining folders are left for the next run')
 
         # Build the lambda response in the following format
         # {
-        # 'accounts': [{
-        #      'id':
+        # 'units': [{
+        #      'foldername':
+        #      'folders':
         #      'files':
+        #      'bytes':
+        #      'cpu':
+        #      'memory':
         #      }],
         # 'dataPreparationResult': true,
+        # 'listingComplete': true,
+        # 'skippedFiles': 0,
         # 'results': []
         #}
         details = {}
-        folders = []
-        details['dataPreparationResult'] = False if len(folderFiles) == 0 else True
-        for folder in folderFiles:
-            detail = {}
-            detail['foldername'] = folder
-            detail['files'] = folderFiles[folder]
-            folders.append(detail)
-        details['folders'] = folders
+        units = plan_units(folderObjects)
+        for unit in units:
+            print('{}: {} files, {} bytes, cpu {}, memory {}'.format(
+                unit['foldername'], len(unit['files']), unit['bytes'], unit['cpu'], unit['memory']))
+        details['dataPreparationResult'] = False if len(units) == 0 else True
+        details['units'] = units
+        details['listingComplete'] = complete
+        details['skippedFiles'] = skipped
         details['results'] = []
         return {
             'statusCode': 200 if details.get('dataPreparationResult') else 404,
@@ -1,6 +1,7 @@
 import aws_cdk as cdk
 import aws_cdk.aws_logs as logs
 import aws_cdk.aws_s3 as s3
+import aws_cdk.aws_dynamodb as dynamodb
 import aws_cdk.aws_ec2 as ec2
 import aws_cdk.aws_ecs as ecs
 import aws_cdk.aws_iam as iam
@@ -43,6 +44,13 @@ class DataPipelineStack(cdk.Stack):
         cdk.CfnOutput(self, "DataPipelineBucketName",
                       value=bucket.bucket_name
         )
+        # Manifest of the processed files, so that each run only processes new or changed ones
+        manifest_table = dynamodb.Table(self,
+                        'DataPipelineManifest',
+                        partition_key=dynamodb.Attribute(name='folder', type=dynamodb.AttributeType.STRING),
+                        sort_key=dynamodb.Attribute(name='key', type=dynamodb.AttributeType.STRING),
+                        billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                        removal_policy=cdk.RemovalPolicy.RETAIN)
         ecs_task_execution_role = iam.Role(
             self,
             'DataPipelineEcsTaskExecutionRole',
@@ -104,6 +112,7 @@ class DataPipelineStack(cdk.Stack):
           'DataPipelineDataProcessor',
           image= ecs.ContainerImage.from_ecr_repository(ecr_repository, 'latest'),
           essential= True,
+          environment= {'MANIFEST_TABLE': manifest_table.table_name},
           logging= ecs.AwsLogDriver(
             stream_prefix= 'ecs',
             mode= ecs.AwsLogDriverMode.NON_BLOCKING,
@@ -117,9 +126,14 @@ class DataPipelineStack(cdk.Stack):
           runtime= functions.Runtime.PYTHON_3_10,
           code= functions.Code.from_asset('lambda'),
           handler= 'prepareData.lambda_handler',
-          environment= {'input_bucket': bucket.bucket_name},
+          environment= {'input_bucket': bucket.bucket_name, 'manifest_table': manifest_table.table_name},
+          # Listing stops in time to respond before the timeout, leaving the remaining folders for the next run
+          timeout= cdk.Duration.minutes(5),
+          memory_size= 512,
           role= lambda_execution_role
         )
+        manifest_table.grant_read_data(data_preparation_function)
+        manifest_table.grant_write_data(ecs_task_role)
 
         # Create the state machine
         data_pipeline_workflow = create_data_pipeline_statemachine(
@@ -37,7 +37,7 @@ def create_data_pipeline_statemachine(
         container_definition=container_definition,
         environment= [
               tasks.TaskEnvironmentVariable(name= 'TASK_TOKEN',value= sfn.JsonPath.task_token),
-              tasks.TaskEnvironmentVariable(name= 'FOLDERNAME',value= '$.foldername'),
+              tasks.TaskEnvironmentVariable(name= 'FOLDERNAME',value= sfn.JsonPath.string_at('$.foldername')),
               tasks.TaskEnvironmentVariable(name= 'FILES',value= sfn.JsonPath.json_to_string(sfn.JsonPath.object_at('$.files'))),
               tasks.TaskEnvironmentVariable(name= 'S3_BUCKET',value= bucket)]
       )
@@ -47,6 +47,9 @@ def create_data_pipeline_statemachine(
         launch_target= tasks.EcsFargateLaunchTarget(platform_version=ecs.FargatePlatformVersion.LATEST),
         integration_pattern= sfn.IntegrationPattern.WAIT_FOR_TASK_TOKEN,
         container_overrides= [container_override],
+        # Size each task to its work unit, as recommended by the data preparation lambda
+        cpu= sfn.JsonPath.string_at('$.cpu'),
+        memory_mib= sfn.JsonPath.string_at('$.memory'),
         assign_public_ip= False,
         task_timeout= sfn.Timeout.duration(cdk.Duration.minutes(20))
       )
@@ -55,7 +58,7 @@ def create_data_pipeline_statemachine(
       #### Add catch statements to perform different actions based on exception. Some exceptions are from the state  ####
       #### machine execution and some could be from the task being run. Here we send all errors to EventBridge.      ####
       process_data_in_parallel = sfn.Map(stack, 'Parallel Execution',
-        items_path= '$.folders',
+        items_path= '$.units',
         max_concurrency= 0,
         result_path= "$.results"
       )
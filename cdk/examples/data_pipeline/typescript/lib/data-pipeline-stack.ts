@@ -1,5 +1,6 @@
 import * as cdk from 'aws-cdk-lib';
 import * as s3 from 'aws-cdk-lib/aws-s3'
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as ecs from 'aws-cdk-lib/aws-ecs';
 import * as iam from 'aws-cdk-lib/aws-iam';
@@ -35,6 +36,13 @@ export class DataPipelineBlueprintStack extends cdk.Stack {
     new cdk.CfnOutput(this, "DataPipelineBucketName", {
       value: bucket.bucketName
     })
+    // Manifest of the processed files, so that each run only processes new or changed ones
+    const manifestTable = new dynamodb.Table(this, 'DataPipelineManifest', {
+      partitionKey: { name: 'folder', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'key', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.RETAIN,
+    });
     // Build the roles
     // * StepFunction execution role - Role assumed by Step Function
     // * Ecs Task Execution Role - Role assumed by ECS to execute tasks
@@ -100,6 +108,9 @@ export class DataPipelineBlueprintStack extends cdk.Stack {
     const container = fargateTaskDefinition.addContainer('DataPipelineDataProcessor', {
       image: ecs.ContainerImage.fromEcrRepository(ecrRepository, "latest"),
       essential: true,
+      environment: {
+        "MANIFEST_TABLE": manifestTable.tableName
+      },
       logging: new ecs.AwsLogDriver({
         streamPrefix: "ecs",
         mode: ecs.AwsLogDriverMode.NON_BLOCKING
@@ -112,10 +123,16 @@ export class DataPipelineBlueprintStack extends cdk.Stack {
       code: lambda.Code.fromAsset('lambda'),
       handler: 'prepareData.lambda_handler',
       environment: {
-        "input_bucket": bucket.bucketName
+        "input_bucket": bucket.bucketName,
+        "manifest_table": manifestTable.tableName
       },
+      // Listing stops in time to respond before the timeout, leaving the remaining folders for the next run
+      timeout: cdk.Duration.minutes(5),
+      memorySize: 512,
       role: lambdaExecutionRole
     })
+    manifestTable.grantReadData(dataPreparationFunction);
+    manifestTable.grantWriteData(ecsTaskRole);
 
     // Create the state machine
     const dataPipelineWorkflow = createDataPipelineStateMachine(this,
@@ -46,7 +46,7 @@ export function createDataPipelineStateMachine(
         },
         {
           name: "FOLDERNAME",
-          value: "$.foldername"
+          value: sfn.JsonPath.stringAt("$.foldername")
         },
         {
           name: "FILES",
@@ -68,6 +68,9 @@ export function createDataPipelineStateMachine(
         // Comment above line and uncomment below line if you would like to send output back to the workflow
         /*integrationPattern: sfn.IntegrationPattern.WAIT_FOR_TASK_TOKEN,*/
         containerOverrides: [containerOverride],
+        // Size each task to its work unit, as recommended by the data preparation lambda
+        cpu: sfn.JsonPath.stringAt('$.cpu'),
+        memoryMiB: sfn.JsonPath.stringAt('$.memory'),
         assignPublicIp: false,
         taskTimeout: sfn.Timeout.duration(cdk.Duration.minutes(20))
       });
@@ -76,7 +79,7 @@ export function createDataPipelineStateMachine(
       /**** Add catch statements to perform different actions based on exception. Some exceptions are from the state ****/
       /**** machine execution and some could be from the task being run. Here we send all errors to EventBridge.     ****/
       const processDataInParallel = new sfn.Map(stack, 'Parallel Execution', {
-        itemsPath: '$.folders',
+        itemsPath: '$.units',
         maxConcurrency: 0,
         resultPath: "$.results"
       })
@@ -373,6 +373,12 @@ data "aws_iam_policy_document" "lambda_role" {
       "arn:aws:ssm:${local.region}:${data.aws_caller_identity.current.account_id}:parameter/*",
     ]
   }
+
+  statement {
+    sid       = "CloudWatchMetricsRead"
+    actions   = ["cloudwatch:GetMetricData"]
+    resources = ["*"]
+  }
 }
 
 ################################################################################
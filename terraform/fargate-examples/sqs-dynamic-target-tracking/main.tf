@@ -13,6 +13,8 @@ locals {
   scaling_policy_name       = "ecs_sqs_scaling"
   desired_latency           = 60
   default_msg_proc_duration = 5
+  max_concurrency           = 10
+  stop_timeout              = 30
   number_of_messages        = 50
   app_metric_name           = "MsgProcessingDuration"
   bpi_metric_name           = "ecsTargetBPI"
@@ -69,6 +71,8 @@ resource "aws_ecs_task_definition" "this" {
     {
       name  = local.container_name
       image = module.container_image_ecr.repository_url
+      # Seconds between SIGTERM and SIGKILL, used to drain in-flight messages
+      stopTimeout = local.stop_timeout
       environment = [
         {
           name  = "queue_name",
@@ -86,6 +90,14 @@ resource "aws_ecs_task_definition" "this" {
           name  = "metric_namespace",
           value = local.metric_namespace
         },
+        {
+          name  = "max_concurrency",
+          value = tostring(local.max_concurrency)
+        },
+        {
+          name  = "stop_timeout",
+          value = tostring(local.stop_timeout)
+        },
 
       ]
       logConfiguration = {
@@ -151,7 +163,7 @@ resource "aws_appautoscaling_policy" "ecs_sqs_app_scaling_policy" {
   service_namespace  = aws_appautoscaling_target.ecs_target.service_namespace
 
   target_tracking_scaling_policy_configuration {
-    target_value       = 12
+    target_value       = local.desired_latency * local.max_concurrency / local.default_msg_proc_duration
     scale_out_cooldown = 240
     scale_in_cooldown  = 240
 
@@ -238,6 +250,7 @@ module "lambda_function_message_producer" {
   attach_policy_json = true
   policy_json        = data.aws_iam_policy_document.lambda_role.json
   source_path        = "../../../application-code/message-producer/"
+  timeout            = 60
 
   environment_variables = {
     queue_name                = module.processing_queue.queue_name
@@ -279,6 +292,10 @@ module "lambda_function_target_bpi_update" {
     bpi_metric_name           = local.bpi_metric_name
     default_msg_proc_duration = local.default_msg_proc_duration
     desired_latency           = local.desired_latency
+    max_concurrency           = local.max_concurrency
+    duration_estimator        = "ewma"
+    target_change_threshold   = 10
+    min_update_interval       = 1800
   }
 
   allowed_triggers = {